@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "product_survey.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from survey.ingest import with_queue_writer  # noqa: E402
+
+application = with_queue_writer(django_application)
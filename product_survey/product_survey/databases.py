@@ -0,0 +1,69 @@
+"""
+DATABASES entries for the primary and the read replica.
+"""
+
+# Run on every new SQLite connection. WAL lets readers carry on while a
+# webhook writes; the rest trade a little durability on power loss and some
+# memory for fewer fsyncs and disk reads.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+]
+
+# Seconds a connection waits for the write lock before "database is locked"
+SQLITE_BUSY_TIMEOUT = 20
+
+# Seconds PostgreSQL connections are kept open between requests
+POSTGRES_CONN_MAX_AGE = 600
+
+
+def sqlite_database(name, replica=False):
+    """
+    A SQLite database in WAL mode. Transactions take the write lock when
+    they begin, so two writers never deadlock upgrading a read lock.
+    Replica connections refuse to write.
+    """
+    pragmas = SQLITE_PRAGMAS + (["PRAGMA query_only = ON"] if replica else [])
+    database = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": name,
+        "OPTIONS": {
+            "init_command": ";".join(pragmas),
+            "timeout": SQLITE_BUSY_TIMEOUT,
+            "transaction_mode": "IMMEDIATE",
+        },
+    }
+    if replica:
+        database["TEST"] = {"MIRROR": "default"}
+    return database
+
+
+def postgres_database(
+    name, host, user, password="", port=5432, replica=False, pool=None
+):
+    """
+    A PostgreSQL database with persistent connections checked before reuse,
+    or with a psycopg 3 connection pool when ``pool`` holds its options,
+    e.g. ``{"min_size": 2, "max_size": 10}``.
+    """
+    database = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": name,
+        "HOST": host,
+        "PORT": port,
+        "USER": user,
+        "PASSWORD": password,
+        "CONN_MAX_AGE": POSTGRES_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
+    }
+    if pool:
+        # Pooled connections are returned to the pool after each request
+        database["CONN_MAX_AGE"] = 0
+        database["OPTIONS"]["pool"] = pool
+    if replica:
+        database["TEST"] = {"MIRROR": "default"}
+    return database
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 
+from .databases import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "survey.middleware.RequestMetricsMiddleware",
+    "survey.profiling.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -79,13 +83,17 @@ WSGI_APPLICATION = "product_survey.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# The replica serves reads that may lag the primary: eligibility order scans,
+# exports, admin lists and NPS reports. Locally it is a second SQLite file
+# refreshed with `manage.py sync_replica`. On PostgreSQL use
+# databases.postgres_database() for both.
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
+    "default": sqlite_database(BASE_DIR / "db.sqlite3"),
+    "replica": sqlite_database(BASE_DIR / "db_replica.sqlite3", replica=True),
 }
 
+DATABASE_ROUTERS = ["survey.routers.ReadReplicaRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -127,3 +135,67 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Local webhook queue used by the queue_survey_response endpoint
+SURVEY_QUEUE_DIR = BASE_DIR / "webhook_queue"
+SURVEY_QUEUE_MAX_DEPTH = 10000
+SURVEY_QUEUE_BATCH_SIZE = 200
+# Run the queue writer inside each ASGI worker
+SURVEY_QUEUE_WRITER = True
+
+# Webhook deliveries remembered per process to answer retries without the DB
+SURVEY_DEDUP_CACHE_SIZE = 10000
+
+# Generated send_surveys CSV files, one per delivery date
+SURVEY_BATCH_DIR = BASE_DIR / "survey_batches"
+
+# Append-only log of raw webhook bodies, replayed with replay_webhooks
+SURVEY_WEBHOOK_LOG = True
+SURVEY_WEBHOOK_LOG_DIR = BASE_DIR / "webhook_log"
+SURVEY_WEBHOOK_LOG_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# "rows" stores one NPSSurveyQuestionResponse per answer, "compact" stores a
+# submission's answers on its NPSSurveyPrimaryResponse
+SURVEY_ANSWER_STORAGE = "rows"
+
+# Stack-sampling profiles of requests sent with this header, or of every
+# request slower than the threshold in seconds (None turns either off).
+# The header is only honoured from INTERNAL_IPS, or from anyone with DEBUG
+# on. Only the SURVEY_PROFILE_KEEP slowest are kept.
+SURVEY_PROFILE_HEADER = None
+SURVEY_PROFILE_THRESHOLD = None
+SURVEY_PROFILE_DIR = BASE_DIR / "profiles"
+SURVEY_PROFILE_KEEP = 20
+SURVEY_PROFILE_INTERVAL = 0.005
+
+# Send read-only workloads to the "replica" database. Off until the replica
+# is kept up to date, since reads from a stale copy miss recent rows.
+SURVEY_READ_REPLICA = False
+
+# Answers of the customer eligibility endpoint. Entries are dropped when a
+# customer is sent or fills a survey, but only in the process that did it:
+# with several worker processes use a shared backend such as Redis, or rely
+# on TIMEOUT to bound how stale an answer gets.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "eligibility": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "eligibility",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+}
+
+# Messaging provider dispatch_surveys sends surveys through: the dotted path
+# of a survey.dispatch.MessagingProvider and the keyword arguments it takes,
+# e.g. "survey.dispatch.HTTPProvider" with {"url": ..., "token": ...}
+SURVEY_DISPATCH_PROVIDER = None
+# Off while the send_surveys CSV is still uploaded by hand: surveys are then
+# issued as "manual" and dispatch_surveys refuses to run. Turn on once the
+# provider replaces the upload, or customers get every survey twice.
+SURVEY_DISPATCH_ENABLED = False
+SURVEY_DISPATCH_PROVIDER_OPTIONS = {}
+# Messages per second the provider accepts, and how many at once
+SURVEY_DISPATCH_RATE = 50
+SURVEY_DISPATCH_BURST = 100
@@ -0,0 +1,23 @@
+"""
+ASGI entry point for the webhook workers, serving only the Typeform webhook
+routes and the metrics endpoint. Run it with e.g.
+
+    uvicorn product_survey.webhook_asgi:application
+
+The routes are loaded before the worker reports it started, so the first
+delivery does not pay for importing them.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+from django.urls import get_resolver
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "product_survey.webhook_settings")
+
+django_application = get_asgi_application()
+get_resolver().url_patterns
+
+from survey.ingest import with_queue_writer  # noqa: E402
+
+application = with_queue_writer(django_application)
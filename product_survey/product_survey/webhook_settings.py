@@ -0,0 +1,15 @@
+"""
+Settings for the webhook workers served by product_survey.webhook_asgi.
+
+Only the survey app is installed and only the request metrics middleware
+runs: Typeform deliveries need no sessions, auth, messages, CSRF or
+clickjacking protection, and the admin is served by the full app.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = ["survey"]
+
+MIDDLEWARE = ["survey.middleware.RequestMetricsMiddleware"]
+
+ROOT_URLCONF = "product_survey.webhook_urls"
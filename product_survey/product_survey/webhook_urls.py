@@ -0,0 +1,25 @@
+"""
+URL configuration of the webhook workers, the same paths as the full app.
+"""
+
+from django.urls import path
+
+from survey.webhook_views import (
+    metrics_view,
+    queue_survey_response,
+    receive_survey_response,
+)
+
+urlpatterns = [
+    path(
+        "surveys/receive_survey_response/",
+        receive_survey_response,
+        name="receive_survey_response",
+    ),
+    path(
+        "surveys/queue_survey_response/",
+        queue_survey_response,
+        name="queue_survey_response",
+    ),
+    path("surveys/metrics/", metrics_view, name="metrics"),
+]
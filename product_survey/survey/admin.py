@@ -1,8 +1,12 @@
 from django.contrib import admin
+from django.db.models import OuterRef, Subquery
+from .pagination import EstimatedCountPaginator
+from .routers import read_replica
 from .models import (
     Order,
     OrderItem,
     NPSSurveyCustomer,
+    NPSSurveyCustomerState,
     NPSSurveyPrimaryResponse,
     NPSSurveyQuestionResponse,
     NPSSurveyQuestionnaire,
@@ -12,18 +16,36 @@ from .models import (
 # Register your models here.
 
 
+class LargeTableModelAdmin(admin.ModelAdmin):
+    # Changelists for tables with millions of rows
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ["-pk"]
+
+    def changelist_view(self, request, extra_context=None):
+        # Bulk actions are POSTed to the changelist and must see the primary
+        if request.method != "GET":
+            return super().changelist_view(request, extra_context)
+        with read_replica():
+            response = super().changelist_view(request, extra_context)
+            # The rows are read when the template renders
+            if hasattr(response, "render"):
+                response.render()
+        return response
+
+
 @admin.register(Order)
-class OrderModelAdmin(admin.ModelAdmin):
+class OrderModelAdmin(LargeTableModelAdmin):
     list_display = ["order_id", "customer_id", "customer_mobile", "delivery_time"]
 
 
 @admin.register(OrderItem)
-class OrderItemModelAdmin(admin.ModelAdmin):
+class OrderItemModelAdmin(LargeTableModelAdmin):
     list_display = ["order_id", "product_category"]
 
 
 @admin.register(NPSSurveyCustomer)
-class NPSSurveyCustomerModelAdmin(admin.ModelAdmin):
+class NPSSurveyCustomerModelAdmin(LargeTableModelAdmin):
     list_display = [
         "nps_survey_id",
         "customer_id",
@@ -37,13 +59,24 @@ class NPSSurveyCustomerModelAdmin(admin.ModelAdmin):
     ]
 
 
+@admin.register(NPSSurveyCustomerState)
+class NPSSurveyCustomerStateModelAdmin(admin.ModelAdmin):
+    list_display = [
+        "customer_id",
+        "last_sent_date",
+        "unfilled_count",
+        "survey_versions",
+        "last_filled_date",
+    ]
+
+
 @admin.register(NPSSurveyQuestionnaire)
 class NPSSurveyQuestionnaireModelAdmin(admin.ModelAdmin):
     list_display = ["survey_id", "product_category"]
 
 
 @admin.register(NPSSurveyPrimaryResponse)
-class NPSSurveyPrimaryResponseModelAdmin(admin.ModelAdmin):
+class NPSSurveyPrimaryResponseModelAdmin(LargeTableModelAdmin):
     list_display = [
         "nps_survey_id",
         "customer_id",
@@ -54,17 +87,28 @@ class NPSSurveyPrimaryResponseModelAdmin(admin.ModelAdmin):
 
 
 @admin.register(NPSSurveyQuestionResponse)
-class NPSSurveyQuestionResponseModelAdmin(admin.ModelAdmin):
+class NPSSurveyQuestionResponseModelAdmin(LargeTableModelAdmin):
     list_display = ["customer_id", "nps_survey_id", "question_id", "response"]
 
-    def customer_id(self, request):
-        nps_primary_res = NPSSurveyPrimaryResponse.objects.filter(
-            nps_survey_id=request.nps_survey_id
+    def get_queryset(self, request):
+        # Customer of every row on the page in the same query as the rows
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                primary_customer_id=Subquery(
+                    NPSSurveyPrimaryResponse.objects.filter(
+                        nps_survey_id=OuterRef("nps_survey_id")
+                    ).values("customer_id")[:1]
+                )
+            )
         )
-        if nps_primary_res:
-            return nps_primary_res.first().customer_id
+
+    @admin.display(description="customer id")
+    def customer_id(self, obj):
+        return obj.primary_customer_id
 
 
 @admin.register(NPSSurveyQuestions)
-class NPSSurveyQuestionResponseModelAdmin(admin.ModelAdmin):
+class NPSSurveyQuestionsModelAdmin(admin.ModelAdmin):
     list_display = ["question_description", "survey_id", "question_id"]
@@ -0,0 +1,196 @@
+import threading
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import (
+    NPSSurveyPrimaryResponse,
+    NPSSurveyQuestionResponse,
+    SurveyAnswerField,
+)
+
+# Values of the SURVEY_ANSWER_STORAGE setting
+ROW_STORAGE = "rows"
+COMPACT_STORAGE = "compact"
+
+# Submissions converted per transaction by compact_answers
+COMPACT_CHUNK_SIZE = 500
+
+
+class QuestionDictionary(NamedTuple):
+    # Typeform field id -> SurveyAnswerField.code and back
+    ids: dict
+    question_ids: dict
+    # Field ids answered with numbers
+    numeric: frozenset
+
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+def question_dictionary():
+    """
+    The SurveyAnswerField codes of Typeform fields, loaded once per process.
+    """
+    global _dictionary
+    with _dictionary_lock:
+        if _dictionary is None:
+            fields = SurveyAnswerField.objects.values_list(
+                "code", "question_id", "numeric"
+            )
+            ids = {}
+            numeric = set()
+            for code, question_id, is_numeric in fields:
+                ids[question_id] = code
+                if is_numeric:
+                    numeric.add(question_id)
+            _dictionary = QuestionDictionary(
+                ids=ids,
+                question_ids={code: question_id for question_id, code in ids.items()},
+                numeric=frozenset(numeric),
+            )
+        return _dictionary
+
+
+def clear_question_dictionary():
+    global _dictionary
+    with _dictionary_lock:
+        _dictionary = None
+
+
+def register_fields(question_ids, numeric=False):
+    """
+    Give ``question_ids`` a code if they have none, and mark them numeric
+    when ``numeric``. Codes are never reassigned.
+    """
+    SurveyAnswerField.objects.bulk_create(
+        [SurveyAnswerField(question_id=question_id) for question_id in question_ids],
+        ignore_conflicts=True,
+    )
+    if numeric:
+        SurveyAnswerField.objects.filter(
+            question_id__in=question_ids, numeric=False
+        ).update(numeric=True)
+    clear_question_dictionary()
+
+
+def record_numeric_fields(answers):
+    """
+    Remember the fields of ``answers`` that Typeform sent numbers for, so
+    their text rows are read back as numbers when compacted.
+    """
+    numeric = question_dictionary().numeric
+    found = {
+        question_id
+        for question_id, value in answers
+        if type(value) is int and question_id not in numeric
+    }
+    if found:
+        register_fields(found, numeric=True)
+
+
+def compact_storage():
+    return settings.SURVEY_ANSWER_STORAGE == COMPACT_STORAGE
+
+
+def encode_answers(answers):
+    """
+    Encode ``(question_id, value)`` pairs as ``[id, value]`` pairs for
+    ``NPSSurveyPrimaryResponse.answers``. Fields missing from the dictionary
+    keep their Typeform id, so nothing is lost.
+    """
+    ids = question_dictionary().ids
+    return [
+        [ids.get(question_id, question_id), value] for question_id, value in answers
+    ]
+
+
+def decode_answers(encoded):
+    question_ids = question_dictionary().question_ids
+    return [
+        (question_ids.get(key, key) if isinstance(key, int) else key, value)
+        for key, value in encoded or []
+    ]
+
+
+def typed_value(question_id, text):
+    # Numbers were stored as text in the row-per-answer table, other answers
+    # such as "007" stay text
+    if (
+        text is not None
+        and text.isdigit()
+        and question_id in question_dictionary().numeric
+    ):
+        return int(text)
+    return text
+
+
+def response_text(value):
+    # The value the row-per-answer table would hold
+    return None if value is None else str(value)
+
+
+def answer_rows(nps_survey_ids):
+    """
+    ``(nps_survey_id, question_id, response)`` for every answer of the
+    given submissions, whichever way they were stored, in the text form of
+    NPSSurveyQuestionResponse.
+    """
+    nps_survey_ids = [str(nps_survey_id) for nps_survey_id in nps_survey_ids]
+    rows = list(
+        NPSSurveyQuestionResponse.objects.filter(nps_survey_id__in=nps_survey_ids)
+        .order_by("id")
+        .values_list("nps_survey_id", "question_id", "response")
+    )
+    compact = NPSSurveyPrimaryResponse.objects.filter(
+        nps_survey_id__in=nps_survey_ids, answers__isnull=False
+    ).values_list("nps_survey_id", "answers")
+    for nps_survey_id, encoded in compact:
+        rows.extend(
+            (nps_survey_id, question_id, response_text(value))
+            for question_id, value in decode_answers(encoded)
+        )
+    return rows
+
+
+def compact_stored_answers(chunk_size=COMPACT_CHUNK_SIZE):
+    """
+    Move answers stored one row each onto their primary response, a chunk
+    of submissions per transaction. Returns the number of submissions moved.
+    """
+    total = 0
+    last_nps_survey_id = ""
+    while True:
+        nps_survey_ids = list(
+            NPSSurveyPrimaryResponse.objects.filter(
+                nps_survey_id__gt=last_nps_survey_id, answers__isnull=True
+            )
+            .order_by("nps_survey_id")
+            .values_list("nps_survey_id", flat=True)[:chunk_size]
+        )
+        if not nps_survey_ids:
+            return total
+        last_nps_survey_id = nps_survey_ids[-1]
+
+        with transaction.atomic():
+            rows = NPSSurveyQuestionResponse.objects.filter(
+                nps_survey_id__in=nps_survey_ids
+            )
+            answers = {}
+            for nps_survey_id, question_id, response in rows.order_by("id").values_list(
+                "nps_survey_id", "question_id", "response"
+            ):
+                answers.setdefault(nps_survey_id, []).append(
+                    (question_id, typed_value(question_id, response))
+                )
+            primary_responses = [
+                NPSSurveyPrimaryResponse(
+                    nps_survey_id=nps_survey_id, answers=encode_answers(encoded)
+                )
+                for nps_survey_id, encoded in answers.items()
+            ]
+            NPSSurveyPrimaryResponse.objects.bulk_update(primary_responses, ["answers"])
+            rows.delete()
+        total += len(primary_responses)
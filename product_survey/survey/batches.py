@@ -0,0 +1,53 @@
+import hashlib
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+
+from .generation import (
+    COPY_BLOCK_SIZE,
+    check_checkpoints,
+    generate_shard_rows,
+    shard_path,
+)
+from .models import SurveyBatch
+
+
+def record_batch(delivery_date, path):
+    digest = hashlib.sha1()
+    lines = 0
+    with open(path, "rb") as f:
+        while block := f.read(COPY_BLOCK_SIZE):
+            digest.update(block)
+            lines += block.count(b"\n")
+    batch, _ = SurveyBatch.objects.update_or_create(
+        delivery_date=delivery_date,
+        defaults={
+            "path": str(Path(path).resolve()),
+            # Lines after the header
+            "row_count": max(lines - 1, 0),
+            "etag": digest.hexdigest(),
+        },
+    )
+    return batch
+
+
+def check_batch(run_date):
+    # Raises GenerationConflict when generate_batch cannot run for the day
+    check_checkpoints(run_date, 1, settings.SURVEY_BATCH_DIR)
+
+
+def generate_batch(run_date, lock=None):
+    """
+    Issue the surveys for ``run_date`` into the batch file of its delivery
+    date, yielding the CSV text as it is committed, and record the batch once
+    the file is complete. An interrupted run resumes where it stopped.
+    ``lock`` is the JobLock held for the run, refreshed as chunks commit.
+    """
+    output_dir = Path(settings.SURVEY_BATCH_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for text, _ in generate_shard_rows(run_date, 0, 1, output_dir, lock=lock):
+        yield text
+
+    delivery_date = run_date - timedelta(days=30)
+    record_batch(delivery_date, shard_path(output_dir, run_date, 0, 1))
@@ -0,0 +1,295 @@
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .eligibility import ORDER_CHUNK_SIZE, start_of_day
+from .models import NPSSurveyCustomer
+from .responses import recent_deliveries
+from .synthetic import generate_history, webhook_payload
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# Webhooks posted per scale
+RECEIVE_SAMPLE = 500
+
+# Allowed slowdown against the baseline, and growth in queries per chunk of
+# orders or per webhook between scales
+DEFAULT_TOLERANCE = 0.25
+
+
+class Measurement(NamedTuple):
+    seconds: float
+    queries: int
+    peak_bytes: int
+
+
+class BenchmarkResult(NamedTuple):
+    scale: str
+    orders: int
+    day_orders: int
+    surveys_issued: int
+    send_seconds: float
+    send_queries: int
+    send_peak_bytes: int
+    webhooks: int
+    receive_seconds: float
+    receive_queries: float
+    receive_peak_bytes: int
+
+    @property
+    def send_queries_per_chunk(self):
+        return self.send_queries / max(1, math.ceil(self.day_orders / ORDER_CHUNK_SIZE))
+
+
+def measure(function):
+    """
+    Run ``function`` once and return its result with the wall time, the
+    queries it ran and the peak Python memory it allocated.
+    """
+    queries = 0
+
+    # Counted as they run, the query log only keeps the last 9000
+    def count_query(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    connection.ensure_connection()
+    tracemalloc.start()
+    try:
+        with connection.execute_wrapper(count_query):
+            started = time.perf_counter()
+            result = function()
+            seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, Measurement(seconds, queries, peak)
+
+
+def run_scale(scale, orders, batch_dir, seed=0, webhooks=RECEIVE_SAMPLE):
+    """
+    Generate ``orders`` synthetic orders into the current (empty) database,
+    then time one send_surveys request and ``webhooks`` webhook deliveries.
+    """
+    day_orders = generate_history(orders, seed=seed)
+    client = Client()
+
+    with override_settings(SURVEY_BATCH_DIR=batch_dir, SURVEY_WEBHOOK_LOG=False):
+        response, send = measure(lambda: client.get(reverse("send_surveys")))
+        if response.status_code != 200:
+            raise RuntimeError(f"send_surveys answered {response.status_code}")
+        response.close()
+
+        issued = NPSSurveyCustomer.objects.filter(
+            sent_date__gte=start_of_day(timezone.localdate())
+        )
+        rng = random.Random(seed)
+        payloads = [
+            json.dumps(webhook_payload(survey, rng))
+            for survey in issued.order_by("nps_survey_id")[:webhooks]
+        ]
+        recent_deliveries.clear()
+
+        def post_all():
+            for payload in payloads:
+                client.post(
+                    reverse("receive_survey_response"),
+                    data=payload,
+                    content_type="application/json",
+                )
+
+        _, receive = measure(post_all)
+
+    posted = max(1, len(payloads))
+    return BenchmarkResult(
+        scale=scale,
+        orders=orders,
+        day_orders=day_orders,
+        surveys_issued=issued.count(),
+        send_seconds=send.seconds,
+        send_queries=send.queries,
+        send_peak_bytes=send.peak_bytes,
+        webhooks=len(payloads),
+        receive_seconds=receive.seconds / posted,
+        receive_queries=receive.queries / posted,
+        receive_peak_bytes=receive.peak_bytes,
+    )
+
+
+def check_results(results, baseline=None, tolerance=DEFAULT_TOLERANCE):
+    """
+    Return a message for each regression: queries per chunk of orders or
+    per webhook growing with the input size, or timings slower than
+    ``baseline`` (a dict of scale to stored result fields) by more than
+    ``tolerance``. Scales missing from ``baseline`` fail too, unless it is
+    None.
+    """
+    failures = []
+    results = sorted(results, key=lambda result: result.orders)
+    for smaller, larger in zip(results, results[1:]):
+        if larger.send_queries_per_chunk > smaller.send_queries_per_chunk * (
+            1 + tolerance
+        ):
+            failures.append(
+                f"send_surveys: {larger.send_queries_per_chunk:.1f} queries per "
+                f"chunk at {larger.scale}, {smaller.send_queries_per_chunk:.1f} "
+                f"at {smaller.scale}"
+            )
+        if larger.receive_queries > smaller.receive_queries * (1 + tolerance):
+            failures.append(
+                f"receive_survey_response: {larger.receive_queries:.1f} queries "
+                f"per webhook at {larger.scale}, {smaller.receive_queries:.1f} "
+                f"at {smaller.scale}"
+            )
+
+    for result in results:
+        if baseline is None:
+            continue
+        stored = baseline.get(result.scale)
+        if not stored:
+            failures.append(
+                f"{result.scale}: no stored baseline to compare timings with, "
+                "record one with --update-baseline"
+            )
+            continue
+        for field in ["send_seconds", "receive_seconds"]:
+            limit = stored[field] * (1 + tolerance)
+            if getattr(result, field) > limit:
+                failures.append(
+                    f"{result.scale} {field}: {getattr(result, field):.4f}s, "
+                    f"baseline {stored[field]:.4f}s"
+                )
+    return failures
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, results):
+    baseline = load_baseline(path)
+    baseline.update({result.scale: result._asdict() for result in results})
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+# ASGI modules compared by benchmark_startup
+FULL_ENTRY = "product_survey.asgi"
+WEBHOOK_ENTRY = "product_survey.webhook_asgi"
+
+# Answered 400 without touching the database, but only once the webhook
+# route and its views are loaded
+STARTUP_PROBE_PATH = "/surveys/receive_survey_response/"
+
+# Run in a fresh interpreter: import the ASGI module, then send it one GET
+STARTUP_SCRIPT = """
+import asyncio, importlib, json, sys, time
+
+started = time.perf_counter()
+application = importlib.import_module(sys.argv[1]).application
+imported = time.perf_counter()
+
+
+async def first_response(path):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    messages = []
+    requests = asyncio.Queue()
+    requests.put_nowait({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        # Waits for a disconnect that never comes after the body
+        return await requests.get()
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]["status"]
+
+
+status = asyncio.run(first_response(sys.argv[2]))
+print(json.dumps({
+    "import_seconds": imported - started,
+    "first_response_seconds": time.perf_counter() - imported,
+    "status": status,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+class StartupResult(NamedTuple):
+    entry: str
+    # From spawning the interpreter to its first response
+    process_seconds: float
+    import_seconds: float
+    first_response_seconds: float
+    modules: int
+
+
+def start_once(entry):
+    env = dict(os.environ)
+    # Each entry point picks its own settings
+    env.pop("DJANGO_SETTINGS_MODULE", None)
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, entry, STARTUP_PROBE_PATH],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    process_seconds = time.perf_counter() - started
+    measured = json.loads(output.splitlines()[-1])
+    if measured["status"] != 400:
+        raise RuntimeError(f"{entry} answered {measured['status']}")
+    return process_seconds, measured
+
+
+def measure_startup(entry, runs=5):
+    """
+    Start ``entry`` in ``runs`` fresh interpreters and return the median
+    time to import it, to answer its first request and for the whole
+    process to get there.
+    """
+    samples = [start_once(entry) for _ in range(runs)]
+    return StartupResult(
+        entry=entry,
+        process_seconds=statistics.median(seconds for seconds, _ in samples),
+        import_seconds=statistics.median(m["import_seconds"] for _, m in samples),
+        first_response_seconds=statistics.median(
+            m["first_response_seconds"] for _, m in samples
+        ),
+        modules=samples[-1][1]["modules"],
+    )
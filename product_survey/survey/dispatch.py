@@ -0,0 +1,464 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from typing import NamedTuple
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .issuance import survey_row
+from .models import NPSSurveyCustomer
+
+# Values of NPSSurveyCustomer.dispatch_status
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+MANUAL = "manual"
+
+DISPATCH_FIELDS = [
+    "dispatch_status",
+    "dispatch_attempts",
+    "dispatched_at",
+    "provider_message_id",
+    "dispatch_error",
+]
+
+# Surveys read and recorded per chunk
+DISPATCH_CHUNK_SIZE = 1000
+# Provider batches in flight at once
+DISPATCH_CONCURRENCY = 4
+# Resends of a failed message, the first after DISPATCH_BACKOFF seconds and
+# each later one after twice as long
+DISPATCH_RETRIES = 3
+DISPATCH_BACKOFF = 0.5
+# Rows per UPDATE when recording delivery status
+UPDATE_BATCH_SIZE = 500
+
+metrics.describe(
+    "survey_dispatch_messages_total",
+    "counter",
+    "Survey messages handed to the messaging provider, by final status",
+)
+metrics.describe(
+    "survey_dispatch_retries_total", "counter", "Provider batches sent again"
+)
+
+
+class Message(NamedTuple):
+    nps_survey_id: int
+    phone: str
+    survey_type: str
+    survey_link: str
+
+
+class DeliveryResult(NamedTuple):
+    nps_survey_id: int
+    ok: bool
+    provider_message_id: str = ""
+    error: str = ""
+    # Worth sending again, e.g. rate limited or a provider hiccup
+    retryable: bool = False
+    attempts: int = 1
+
+
+class ProviderError(Exception):
+    """
+    A whole batch failed. ``retryable`` when the provider may take it later,
+    after ``retry_after`` seconds when it said so.
+    """
+
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` tokens a second on average and bursts of ``capacity``.
+
+    Callers reserve their tokens before waiting, running the balance into
+    debt, so they are served in the order they asked and no lock is needed
+    within an event loop.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens):
+        # Seconds to wait before the reserved tokens may be used
+        self._refill()
+        self.tokens -= tokens
+        return max(0.0, -self.tokens / self.rate)
+
+    def try_take(self, tokens):
+        self._refill()
+        # Allow for float rounding against a bucket with the same settings
+        if self.tokens + 1e-6 < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def acquire(self, tokens=1):
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class MessagingProvider:
+    """
+    Interface of messaging providers. ``send_batch`` is called from worker
+    threads with at most ``batch_size`` messages and returns a
+    DeliveryResult per message, in order, or raises ProviderError.
+    """
+
+    batch_size = 100
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HTTPProvider(MessagingProvider):
+    """
+    Posts batches to a provider's bulk send endpoint, reusing up to
+    ``pool_size`` kept-alive connections.
+
+    The endpoint takes ``{"messages": [{"id", "to", "template", "link"}]}``
+    and answers ``{"results": [{"id", "status", "message_id", "error"}]}``
+    where status is "accepted", "retry" or "rejected".
+    """
+
+    def __init__(
+        self,
+        url,
+        token="",
+        batch_size=100,
+        pool_size=DISPATCH_CONCURRENCY,
+        timeout=10.0,
+    ):
+        self.url = url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Retries are done by the dispatcher, within the rate limit
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def send_batch(self, messages):
+        body = {
+            "messages": [
+                {
+                    "id": str(message.nps_survey_id),
+                    "to": message.phone,
+                    "template": message.survey_type,
+                    "link": message.survey_link,
+                }
+                for message in messages
+            ]
+        }
+        try:
+            response = self.session.post(self.url, json=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ProviderError(f"{type(e).__name__}: {e}")
+
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get("Retry-After", "")
+            raise ProviderError(
+                f"Provider answered {response.status_code}",
+                retry_after=float(retry_after) if retry_after.isdigit() else None,
+            )
+        if response.status_code >= 400:
+            raise ProviderError(
+                f"Provider answered {response.status_code}: {response.text[:200]}",
+                retryable=False,
+            )
+
+        results = {
+            str(result.get("id")): result
+            for result in response.json().get("results", [])
+        }
+        return [
+            self.delivery_result(message, results.get(str(message.nps_survey_id)))
+            for message in messages
+        ]
+
+    def delivery_result(self, message, result):
+        if result is None:
+            return DeliveryResult(
+                message.nps_survey_id,
+                False,
+                error="Missing from the provider's answer",
+                retryable=True,
+            )
+        status = result.get("status")
+        return DeliveryResult(
+            message.nps_survey_id,
+            status == "accepted",
+            provider_message_id=str(result.get("message_id") or ""),
+            error=str(result.get("error") or ""),
+            retryable=status == "retry",
+        )
+
+    def close(self):
+        self.session.close()
+
+
+class FakeProvider(MessagingProvider):
+    """
+    In-memory provider for tests and offline load runs.
+
+    It enforces its own token bucket of ``rate_limit`` messages a second
+    and ``burst`` at once, rejecting whole batches past it as a real
+    provider would. Each batch takes ``latency`` seconds, each message fails
+    its first ``transient_failures`` attempts, and messages without a phone
+    number are rejected.
+    """
+
+    def __init__(
+        self,
+        batch_size=100,
+        rate_limit=None,
+        burst=None,
+        latency=0.0,
+        transient_failures=0,
+    ):
+        self.batch_size = batch_size
+        self.latency = latency
+        self.transient_failures = transient_failures
+        self.bucket = (
+            TokenBucket(rate_limit, burst or batch_size) if rate_limit else None
+        )
+        self.delivered = {}
+        self.attempts = Counter()
+        self.batches = 0
+        self.rate_limited = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        with self._lock:
+            if self.bucket and not self.bucket.try_take(len(messages)):
+                self.rate_limited += 1
+                raise ProviderError("Rate limited", retry_after=1 / self.bucket.rate)
+            self.batches += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                return [self.deliver(message) for message in messages]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def deliver(self, message):
+        self.attempts[message.nps_survey_id] += 1
+        attempt = self.attempts[message.nps_survey_id]
+        if not message.phone:
+            return DeliveryResult(message.nps_survey_id, False, error="No phone")
+        if attempt <= self.transient_failures:
+            return DeliveryResult(
+                message.nps_survey_id, False, error="Try again", retryable=True
+            )
+        self.delivered[message.nps_survey_id] = message
+        return DeliveryResult(
+            message.nps_survey_id,
+            True,
+            provider_message_id=f"fake-{message.nps_survey_id}-{attempt}",
+        )
+
+
+def messaging_provider():
+    if not settings.SURVEY_DISPATCH_PROVIDER:
+        raise ValueError("SURVEY_DISPATCH_PROVIDER is not set")
+    provider_class = import_string(settings.SURVEY_DISPATCH_PROVIDER)
+    return provider_class(**settings.SURVEY_DISPATCH_PROVIDER_OPTIONS)
+
+
+async def send_with_retry(provider, batch, bucket, retries, backoff):
+    """
+    Send ``batch`` within the rate limit, sending the messages that failed
+    in a retryable way again up to ``retries`` times with exponential
+    backoff and jitter. Returns the last DeliveryResult of every message.
+    """
+    final = {}
+    attempts = Counter()
+    retry_after = None
+    for attempt in range(retries + 1):
+        if attempt:
+            metrics.inc("survey_dispatch_retries_total")
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(max(delay, retry_after or 0))
+        if bucket:
+            await bucket.acquire(len(batch))
+        attempts.update(message.nps_survey_id for message in batch)
+
+        retry_after = None
+        try:
+            results = await asyncio.to_thread(provider.send_batch, batch)
+        except ProviderError as e:
+            retry_after = e.retry_after
+            results = [
+                DeliveryResult(
+                    message.nps_survey_id, False, error=str(e), retryable=e.retryable
+                )
+                for message in batch
+            ]
+
+        failed = []
+        for message, result in zip(batch, results):
+            final[message.nps_survey_id] = result
+            if result.retryable:
+                failed.append(message)
+        batch = failed
+        if not batch:
+            break
+
+    return [
+        result._replace(attempts=attempts[nps_survey_id])
+        for nps_survey_id, result in final.items()
+    ]
+
+
+async def send_messages(
+    provider,
+    messages,
+    bucket=None,
+    concurrency=DISPATCH_CONCURRENCY,
+    retries=DISPATCH_RETRIES,
+    backoff=DISPATCH_BACKOFF,
+):
+    """
+    Split ``messages`` into provider batches and send up to
+    ``concurrency`` of them at once.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(batch):
+        async with semaphore:
+            return await send_with_retry(provider, batch, bucket, retries, backoff)
+
+    size = provider.batch_size
+    sent = await asyncio.gather(
+        *(
+            send(messages[start : start + size])
+            for start in range(0, len(messages), size)
+        )
+    )
+    return [result for results in sent for result in results]
+
+
+def survey_message(survey):
+    row = survey_row(survey)
+    return Message(
+        nps_survey_id=survey.nps_survey_id,
+        phone=row["customer_phone"],
+        survey_type=row["survey_type"],
+        survey_link=row["survey_link"],
+    )
+
+
+def record_results(surveys, results):
+    """
+    Store the outcome of every survey of a chunk with batched UPDATEs.
+    Surveys still failing after their retries are marked failed.
+    """
+    by_id = {result.nps_survey_id: result for result in results}
+    now = timezone.now()
+    for survey in surveys:
+        result = by_id[survey.nps_survey_id]
+        survey.dispatch_status = SENT if result.ok else FAILED
+        survey.dispatch_attempts += result.attempts
+        survey.dispatched_at = now
+        survey.provider_message_id = result.provider_message_id[:100]
+        survey.dispatch_error = result.error[:255]
+    NPSSurveyCustomer.objects.bulk_update(
+        surveys, DISPATCH_FIELDS, batch_size=UPDATE_BATCH_SIZE
+    )
+
+
+class DispatchStats(NamedTuple):
+    sent: int
+    failed: int
+    # Messages that needed more than one attempt
+    retried: int
+    seconds: float
+
+    @property
+    def throughput(self):
+        return (self.sent + self.failed) / self.seconds if self.seconds else 0.0
+
+
+def dispatch_surveys(
+    provider,
+    statuses=(PENDING,),
+    rate=None,
+    burst=None,
+    concurrency=DISPATCH_CONCURRENCY,
+    retries=DISPATCH_RETRIES,
+    backoff=DISPATCH_BACKOFF,
+    chunk_size=DISPATCH_CHUNK_SIZE,
+    record=True,
+):
+    """
+    Hand every survey whose dispatch_status is in ``statuses`` to
+    ``provider``, at most ``rate`` messages a second, and record how each
+    went. Surveys are read a chunk at a time in nps_survey_id order and
+    each chunk's status is recorded before the next is sent. With
+    ``record=False`` the surveys are left untouched, for dry runs.
+    """
+    bucket = TokenBucket(rate, burst or provider.batch_size) if rate else None
+    surveys = NPSSurveyCustomer.objects.filter(dispatch_status__in=statuses).order_by(
+        "nps_survey_id"
+    )
+    totals = Counter()
+    started = time.perf_counter()
+    last_nps_survey_id = 0
+    while True:
+        chunk = list(surveys.filter(nps_survey_id__gt=last_nps_survey_id)[:chunk_size])
+        if not chunk:
+            break
+        last_nps_survey_id = chunk[-1].nps_survey_id
+
+        messages = [survey_message(survey) for survey in chunk]
+        results = asyncio.run(
+            send_messages(provider, messages, bucket, concurrency, retries, backoff)
+        )
+        if record:
+            record_results(chunk, results)
+
+        for result in results:
+            status = SENT if result.ok else FAILED
+            totals[status] += 1
+            totals["retried"] += result.attempts > 1
+            metrics.inc("survey_dispatch_messages_total", status=status)
+
+    return DispatchStats(
+        sent=totals[SENT],
+        failed=totals[FAILED],
+        retried=totals["retried"],
+        seconds=time.perf_counter() - started,
+    )
@@ -0,0 +1,209 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, NPSSurveyCustomerState
+from .routers import read_replica
+
+# Orders containing any of these categories are never surveyed
+EXCLUDED_CATEGORIES = ["Netraa", "Conditioner"]
+
+# Customers with this many unfilled surveys are omitted
+UNFILLED_SURVEY_LIMIT = 3
+
+# Customers sent a survey within this many days are not sent another
+COOLDOWN_DAYS = 90
+
+# Cache alias holding customer_eligibility() answers
+ELIGIBILITY_CACHE = "eligibility"
+
+# Orders evaluated per chunk when streaming a batch
+ORDER_CHUNK_SIZE = 500
+
+# survey_id=1 Means V1 and survey_id=2 Means V2
+SURVEY_FORMS = {
+    1: ("RVcdBbTG", "V1"),
+    2: ("bXFb9h7f", "V2"),
+}
+
+ELIGIBLE = "eligible"
+EXCLUDED_CATEGORY = "excluded_category"
+EXCLUDED_COOLDOWN = "excluded_cooldown"
+EXCLUDED_UNFILLED = "excluded_unfilled"
+
+
+class SurveyDecision(NamedTuple):
+    order_id: int
+    customer_id: int
+    customer_mobile: str
+    product_categories: list
+    outcome: str
+    survey_id: int
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def delivered_on(delivery_date):
+    # Half-open datetime range instead of delivery_time__date so the
+    # delivery_time index can be used
+    start = start_of_day(delivery_date)
+    end = start_of_day(delivery_date + timedelta(days=1))
+    return Order.objects.filter(delivery_time__gte=start, delivery_time__lt=end)
+
+
+def order_categories(orders):
+    # One query for the items of every order instead of one per order
+    categories = defaultdict(list)
+    items = (
+        OrderItem.objects.filter(order_id__in=orders.values("order_id"))
+        .order_by("id")
+        .values_list("order_id", "product_category")
+    )
+    for order_id, product_category in items:
+        categories[order_id].append(product_category)
+    return categories
+
+
+def customer_history(orders, cooldown_start):
+    # One indexed lookup of the per-customer state for every customer in the
+    # batch, answering the cooldown, unfilled and V1 questions
+    if not isinstance(cooldown_start, datetime):
+        cooldown_start = start_of_day(cooldown_start)
+    states = NPSSurveyCustomerState.objects.filter(
+        customer_id__in=orders.values("customer_id")
+    )
+    return state_history(states, cooldown_start)
+
+
+def state_history(states, cooldown_start):
+    return {
+        state.customer_id: {
+            "recent": state.last_sent_date is not None
+            and state.last_sent_date >= cooldown_start,
+            "unfilled": state.unfilled_count,
+            "received_v1": bool(state.survey_versions & 1),
+        }
+        for state in states
+    }
+
+
+def customer_outcome(customer):
+    # The rules that depend on the customer alone, for a history entry
+    if customer.get("recent"):
+        return EXCLUDED_COOLDOWN
+    if customer.get("unfilled", 0) >= UNFILLED_SURVEY_LIMIT:
+        return EXCLUDED_UNFILLED
+    return ELIGIBLE
+
+
+def evaluate_orders(orders, cooldown_start):
+    """
+    Apply the survey rules to every order in ``orders`` using a fixed number
+    of queries and yield a ``SurveyDecision`` per order, in order_id order.
+    """
+    orders = orders.order_by("order_id")
+    # Orders are imported long before their surveys are due, so a replica
+    # that lags a little still has them. The customer history comes from the
+    # primary as it holds the surveys issued by earlier chunks of this run.
+    with read_replica():
+        categories = order_categories(orders)
+        rows = list(orders.values("order_id", "customer_id", "customer_mobile"))
+    history = customer_history(orders, cooldown_start)
+
+    # Customers surveyed earlier in this batch fall inside the 90 day window
+    surveyed = set()
+
+    for order in rows:
+        customer_id = order["customer_id"]
+        product_categories = categories.get(order["order_id"], [])
+        customer = history.get(customer_id, {})
+        survey_id = 2 if customer.get("received_v1") else 1
+
+        if any(pc in EXCLUDED_CATEGORIES for pc in product_categories):
+            outcome = EXCLUDED_CATEGORY
+        elif customer_id in surveyed:
+            outcome = EXCLUDED_COOLDOWN
+        else:
+            outcome = customer_outcome(customer)
+            if outcome == ELIGIBLE and product_categories:
+                surveyed.add(customer_id)
+
+        yield SurveyDecision(
+            order_id=order["order_id"],
+            customer_id=customer_id,
+            customer_mobile=order["customer_mobile"],
+            product_categories=product_categories,
+            outcome=outcome,
+            survey_id=survey_id,
+        )
+
+
+def order_chunks(orders, chunk_size=ORDER_CHUNK_SIZE):
+    """
+    Split ``orders`` into querysets of at most ``chunk_size`` orders, walking
+    the order_id index so no chunk needs an OFFSET or a large IN list.
+    """
+    last_order_id = None
+    while True:
+        chunk = orders.order_by("order_id")
+        if last_order_id is not None:
+            chunk = chunk.filter(order_id__gt=last_order_id)
+        with read_replica():
+            order_ids = list(chunk.values_list("order_id", flat=True)[:chunk_size])
+        if not order_ids:
+            return
+        yield orders.filter(order_id__range=(order_ids[0], order_ids[-1]))
+        last_order_id = order_ids[-1]
+
+
+def eligibility_key(customer_id, day):
+    # Dated so answers never outlive the day the cooldown was checked for
+    return f"eligibility:{day}:{customer_id}"
+
+
+def customer_eligibility(customer_id):
+    """
+    Whether ``customer_id`` would be sent a survey today, and which version,
+    under the customer rules of send_surveys. The product category rule
+    depends on the order, so it is not applied. Answers are cached until
+    the customer is sent a survey or fills one.
+    """
+    today = timezone.localdate()
+    cache = caches[ELIGIBILITY_CACHE]
+    key = eligibility_key(customer_id, today)
+    answer = cache.get(key)
+    if answer is None:
+        states = NPSSurveyCustomerState.objects.filter(customer_id=customer_id)
+        customer = state_history(
+            states, start_of_day(today - timedelta(days=COOLDOWN_DAYS))
+        ).get(customer_id, {})
+        survey_id = 2 if customer.get("received_v1") else 1
+        outcome = customer_outcome(customer)
+        answer = {
+            "customer_id": customer_id,
+            "eligible": outcome == ELIGIBLE,
+            "outcome": outcome,
+            "survey_id": survey_id,
+            "survey_version": SURVEY_FORMS[survey_id][1],
+        }
+        cache.set(key, answer)
+    return answer
+
+
+def invalidate_eligibility(customer_ids):
+    """
+    Drop the cached answers of ``customer_ids`` once the current
+    transaction commits, so they are never re-read from the old state.
+    """
+    keys = [
+        eligibility_key(customer_id, timezone.localdate())
+        for customer_id in set(customer_ids)
+    ]
+    if keys:
+        transaction.on_commit(lambda: caches[ELIGIBILITY_CACHE].delete_many(keys))
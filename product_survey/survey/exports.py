@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import CharField, Exists, OuterRef
+from django.db.models.functions import Cast
+
+from .answers import answer_rows
+from .eligibility import start_of_day
+from .models import NPSSurveyCustomer, NPSSurveyPrimaryResponse, NPSSurveyQuestions
+from .routers import read_replica
+
+# Submissions read per query
+EXPORT_PAGE_SIZE = 500
+
+EXPORT_FORMATS = ["csv", "jsonl"]
+
+SUBMISSION_FIELDS = [
+    "nps_survey_id",
+    "customer_id",
+    "product_category",
+    "survey_id",
+    "sent_date",
+    "survey_filled_date",
+    "age",
+    "gender",
+]
+
+
+class ExportFilters(NamedTuple):
+    survey_id: int = None
+    product_category: str = None
+    # Inclusive range of the days submissions were filled
+    start: object = None
+    end: object = None
+
+
+def answered_surveys(filters):
+    responses = NPSSurveyPrimaryResponse.objects.filter(
+        nps_survey_id=Cast(OuterRef("nps_survey_id"), CharField())
+    )
+    if filters.start:
+        responses = responses.filter(
+            survey_filled_date__gte=start_of_day(filters.start)
+        )
+    if filters.end:
+        responses = responses.filter(
+            survey_filled_date__lt=start_of_day(filters.end + timedelta(days=1))
+        )
+
+    surveys = NPSSurveyCustomer.objects.filter(Exists(responses))
+    if filters.survey_id is not None:
+        surveys = surveys.filter(survey_id=filters.survey_id)
+    if filters.product_category:
+        surveys = surveys.filter(product_category=filters.product_category)
+    return surveys.order_by("nps_survey_id")
+
+
+def question_columns(survey_id=None):
+    questions = NPSSurveyQuestions.objects.order_by("pk")
+    if survey_id is not None:
+        questions = questions.filter(survey_id=survey_id)
+    with read_replica():
+        return list(dict.fromkeys(questions.values_list("question_id", flat=True)))
+
+
+def submission_pages(filters, after=0, page_size=EXPORT_PAGE_SIZE):
+    """
+    Yield the answered surveys matching ``filters`` with an nps_survey_id
+    above ``after``, a page of ``page_size`` submissions at a time. Each
+    submission is a dict of ``SUBMISSION_FIELDS`` plus ``answers``, a dict
+    of question_id to response.
+
+    Pages are read by seeking past the last nps_survey_id, so every page
+    costs the same and an export can resume from the last id it wrote.
+    """
+    surveys = answered_surveys(filters)
+    while True:
+        # Read from the replica a page at a time: the block must not stay
+        # open while the caller holds a page
+        with read_replica():
+            page = list(
+                surveys.filter(nps_survey_id__gt=after).values(
+                    "nps_survey_id",
+                    "customer_id",
+                    "product_category",
+                    "survey_id",
+                    "sent_date",
+                )[:page_size]
+            )
+            if not page:
+                return
+            after = page[-1]["nps_survey_id"]
+
+            ids = [str(submission["nps_survey_id"]) for submission in page]
+            primary = {
+                row["nps_survey_id"]: row
+                for row in NPSSurveyPrimaryResponse.objects.filter(
+                    nps_survey_id__in=ids
+                ).values("nps_survey_id", "survey_filled_date", "age", "gender")
+            }
+            answers = {nps_survey_id: {} for nps_survey_id in ids}
+            for nps_survey_id, question_id, response in answer_rows(ids):
+                answers[nps_survey_id][question_id] = response
+
+        for submission in page:
+            nps_survey_id = str(submission["nps_survey_id"])
+            response = primary[nps_survey_id]
+            submission["survey_filled_date"] = response["survey_filled_date"]
+            submission["age"] = response["age"]
+            submission["gender"] = response["gender"]
+            submission["answers"] = answers[nps_survey_id]
+        yield page
+
+
+def csv_chunks(pages, questions, header=True):
+    """
+    Yield ``(text, last_nps_survey_id, submissions)`` per page, one CSV row
+    per submission with a column per question in ``questions``.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(SUBMISSION_FIELDS + questions)
+        yield buffer.getvalue(), None, 0
+        buffer.seek(0)
+        buffer.truncate()
+
+    for page in pages:
+        for submission in page:
+            writer.writerow(
+                [submission[field] for field in SUBMISSION_FIELDS]
+                + [submission["answers"].get(question) for question in questions]
+            )
+        yield buffer.getvalue(), page[-1]["nps_survey_id"], len(page)
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def jsonl_chunks(pages):
+    for page in pages:
+        text = "".join(
+            json.dumps(submission, cls=DjangoJSONEncoder) + "\n" for submission in page
+        )
+        yield text, page[-1]["nps_survey_id"], len(page)
+
+
+def export_chunks(
+    filters, file_format, after=0, page_size=EXPORT_PAGE_SIZE, header=True
+):
+    pages = submission_pages(filters, after=after, page_size=page_size)
+    if file_format == "jsonl":
+        return jsonl_chunks(pages)
+    return csv_chunks(pages, question_columns(filters.survey_id), header=header)
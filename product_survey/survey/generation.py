@@ -0,0 +1,200 @@
+import csv
+import io
+import os
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import F
+
+from . import metrics
+from .eligibility import (
+    COOLDOWN_DAYS,
+    ELIGIBLE,
+    EXCLUDED_CATEGORY,
+    EXCLUDED_COOLDOWN,
+    EXCLUDED_UNFILLED,
+    ORDER_CHUNK_SIZE,
+    delivered_on,
+    evaluate_orders,
+    order_chunks,
+)
+from .issuance import CSV_FIELDS, issue_surveys
+from .models import SurveyJobCheckpoint
+
+# Characters read at a time when replaying a shard file
+COPY_BLOCK_SIZE = 64 * 1024
+
+# Decision outcome -> reason label of survey_orders_excluded_total
+EXCLUSION_REASONS = {
+    EXCLUDED_CATEGORY: "category",
+    EXCLUDED_COOLDOWN: "cooldown",
+    EXCLUDED_UNFILLED: "unfilled",
+}
+
+metrics.describe(
+    "survey_orders_scanned_total", "counter", "Delivered orders checked for a survey"
+)
+metrics.describe(
+    "survey_orders_excluded_total",
+    "counter",
+    "Delivered orders not surveyed, by reason",
+)
+metrics.describe("survey_surveys_issued_total", "counter", "Surveys issued")
+
+
+def shard_orders(run_date, shard, shards):
+    orders = delivered_on(run_date - timedelta(days=30))
+    if shards > 1:
+        # Every order of a customer lands in the same shard, so the cooldown
+        # between a customer's orders still holds
+        orders = orders.alias(shard=F("customer_id") % shards).filter(shard=shard)
+    return orders
+
+
+class GenerationConflict(Exception):
+    pass
+
+
+def shard_path(output_dir, run_date, shard, shards):
+    return Path(output_dir) / f"surveys-{run_date}-{shard + 1}-of-{shards}.csv"
+
+
+def checkpoint_name(run_date, shard, shards):
+    return f"generate_surveys:{run_date}:{shard + 1}-of-{shards}"
+
+
+def check_checkpoints(run_date, shards, output_dir):
+    """
+    Raise GenerationConflict if another run of ``run_date``, with a
+    different number of shards or output directory, has a checkpoint. The
+    surveys it issued are recorded but only its own files list them, so
+    only that run can finish the day.
+    """
+    output_dir = str(Path(output_dir).resolve())
+    names = {checkpoint_name(run_date, shard, shards) for shard in range(shards)}
+    checkpoints = SurveyJobCheckpoint.objects.filter(
+        name__startswith=f"generate_surveys:{run_date}:"
+    )
+    for checkpoint in checkpoints:
+        other_dir = checkpoint.position.get("output_dir")
+        if checkpoint.name not in names or other_dir not in (None, output_dir):
+            raise GenerationConflict(
+                f"Surveys for {run_date} were partly generated by another run "
+                f"({checkpoint.name} in {other_dir or 'another directory'}), "
+                "finish it with generate_surveys using the same --output and "
+                "--shards"
+            )
+
+
+def record_pipeline(decisions, issued):
+    outcomes = Counter(decision.outcome for decision in decisions)
+    metrics.inc("survey_orders_scanned_total", len(decisions))
+    for outcome, reason in EXCLUSION_REASONS.items():
+        metrics.inc("survey_orders_excluded_total", outcomes[outcome], reason=reason)
+    metrics.inc("survey_surveys_issued_total", issued)
+
+
+def generate_shard_rows(
+    run_date, shard, shards, output_dir, chunk_size=ORDER_CHUNK_SIZE, lock=None
+):
+    """
+    Issue the surveys of one shard for ``run_date``, committing a checkpoint
+    with every chunk, and yield ``(csv_text, surveys_issued)`` as each chunk
+    is committed. The JobLock ``lock`` is refreshed with every chunk.
+
+    The shard's CSV is truncated back to the last committed chunk on resume,
+    so a crash never leaves rows for surveys not recorded. Text written by an
+    earlier, interrupted run is yielded first so the output is always whole.
+    """
+    check_checkpoints(run_date, shards, output_dir)
+    output = {"output_dir": str(Path(output_dir).resolve())}
+    checkpoint, _ = SurveyJobCheckpoint.objects.get_or_create(
+        name=checkpoint_name(run_date, shard, shards), defaults={"position": output}
+    )
+    position = checkpoint.position
+
+    path = shard_path(output_dir, run_date, shard, shards)
+    with open(path, "a+", newline="") as f:
+        csv_bytes = position.get("csv_bytes", 0)
+        if f.seek(0, os.SEEK_END) < csv_bytes:
+            raise GenerationConflict(
+                f"{path} is shorter than its checkpoint, it lost committed rows"
+            )
+        f.truncate(csv_bytes)
+        f.seek(0)
+        while block := f.read(COPY_BLOCK_SIZE):
+            yield block, 0
+        if position.get("done"):
+            return
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+        if not f.tell():
+            writer.writeheader()
+
+        cooldown_start = run_date - timedelta(days=COOLDOWN_DAYS)
+        orders = shard_orders(run_date, shard, shards)
+        if position.get("order_id") is not None:
+            orders = orders.filter(order_id__gt=position["order_id"])
+
+        for chunk in order_chunks(orders, chunk_size):
+            decisions = list(evaluate_orders(chunk, cooldown_start))
+            with transaction.atomic():
+                if lock is not None:
+                    lock.refresh()
+                rows = issue_surveys(d for d in decisions if d.outcome == ELIGIBLE)
+                writer.writerows(rows)
+                text = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+                checkpoint.position = {
+                    "order_id": decisions[-1].order_id,
+                    "csv_bytes": f.tell(),
+                    **output,
+                }
+                checkpoint.save()
+            record_pipeline(decisions, len(rows))
+            yield text, len(rows)
+
+        # Nothing to evaluate, the header still has to be written
+        if buffer.tell():
+            f.write(buffer.getvalue())
+            yield buffer.getvalue(), 0
+
+    checkpoint.position = {"csv_bytes": path.stat().st_size, "done": True, **output}
+    checkpoint.save()
+
+
+def generate_shard_day(run_date, shard, shards, output_dir, chunk_size, lock=None):
+    return sum(
+        issued
+        for _, issued in generate_shard_rows(
+            run_date, shard, shards, output_dir, chunk_size, lock
+        )
+    )
+
+
+def generate_shard(run_dates, shard, shards, output_dir, chunk_size, lock=None):
+    # Dates run in order so earlier days' surveys count towards the cooldown
+    issued = sum(
+        generate_shard_day(run_date, shard, shards, output_dir, chunk_size, lock)
+        for run_date in run_dates
+    )
+    return shard, issued
+
+
+def merge_shards(run_date, shards, output_dir):
+    path = Path(output_dir) / f"surveys-{run_date}.csv"
+    with open(path, "w", newline="") as merged:
+        merged.write(",".join(CSV_FIELDS) + "\r\n")
+        for shard in range(shards):
+            with open(shard_path(output_dir, run_date, shard, shards), newline="") as f:
+                next(f, None)
+                for line in f:
+                    merged.write(line)
+    return path
@@ -0,0 +1,250 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from typing import NamedTuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, SurveyJobCheckpoint
+
+# Orders upserted per transaction
+IMPORT_BATCH_SIZE = 5000
+# Rows per INSERT statement
+INSERT_BATCH_SIZE = 1000
+
+WATERMARK_CHECKPOINT = "import_orders"
+
+ORDER_FIELDS = ["customer_id", "customer_mobile", "delivery_time"]
+
+
+class InvalidRow(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+class OrderRecord(NamedTuple):
+    order_id: int
+    customer_id: int
+    customer_mobile: str
+    delivery_time: datetime
+    product_categories: list
+
+
+class ImportStats(NamedTuple):
+    rows: int
+    orders: int
+    items: int
+    skipped: int
+    invalid: int
+    seconds: float
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def open_export(path):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def export_format(path):
+    name = str(path).removesuffix(".gz")
+    return "jsonl" if name.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_export(f, file_format):
+    """
+    Yield ``(line, row)`` for every record of an open export without
+    reading the whole file. CSV exports have one row per order item, JSONL
+    exports one object per order with a ``product_categories`` list, yielded
+    undecoded so a malformed line fails like any other invalid row.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            product_category = row.pop("product_category", None)
+            row["product_categories"] = [product_category] if product_category else []
+            yield reader.line_num, row
+        return
+
+    for line, text in enumerate(f, start=1):
+        if text.strip():
+            yield line, text
+
+
+def parse_order(line, row):
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise InvalidRow(line, f"not JSON ({e})")
+        if not isinstance(row, dict):
+            raise InvalidRow(line, "not a JSON object")
+
+    try:
+        order_id = int(row["order_id"])
+        customer_id = int(row["customer_id"])
+        customer_mobile = str(row["customer_mobile"]).strip()
+        delivery_time = datetime.fromisoformat(str(row["delivery_time"]))
+    except KeyError as e:
+        raise InvalidRow(line, f"missing {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise InvalidRow(line, str(e))
+
+    if not customer_mobile or len(customer_mobile) > 15:
+        raise InvalidRow(line, f"bad customer_mobile {customer_mobile!r}")
+    if timezone.is_naive(delivery_time):
+        delivery_time = timezone.make_aware(delivery_time)
+
+    product_categories = row.get("product_categories") or []
+    if not isinstance(product_categories, list):
+        raise InvalidRow(line, "product_categories is not a list")
+    for product_category in product_categories:
+        if not product_category or len(str(product_category)) > 100:
+            raise InvalidRow(line, f"bad product_category {product_category!r}")
+
+    return OrderRecord(
+        order_id=order_id,
+        customer_id=customer_id,
+        customer_mobile=customer_mobile,
+        delivery_time=delivery_time,
+        product_categories=[str(pc) for pc in product_categories],
+    )
+
+
+def watermark_key(record):
+    return (record.delivery_time, record.order_id)
+
+
+def load_watermark():
+    checkpoint = SurveyJobCheckpoint.objects.filter(name=WATERMARK_CHECKPOINT).first()
+    if checkpoint is None or not checkpoint.position:
+        return None
+    return (
+        datetime.fromisoformat(checkpoint.position["delivery_time"]),
+        checkpoint.position["order_id"],
+    )
+
+
+def save_watermark(key):
+    delivery_time, order_id = key
+    SurveyJobCheckpoint.objects.update_or_create(
+        name=WATERMARK_CHECKPOINT,
+        defaults={
+            "position": {
+                "delivery_time": delivery_time.isoformat(),
+                "order_id": order_id,
+            }
+        },
+    )
+
+
+def write_orders(records):
+    """
+    Upsert one batch of orders and replace their items in one transaction.
+    """
+    Order.objects.bulk_create(
+        [
+            Order(
+                order_id=record.order_id,
+                customer_id=record.customer_id,
+                customer_mobile=record.customer_mobile,
+                delivery_time=record.delivery_time,
+            )
+            for record in records
+        ],
+        batch_size=INSERT_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["order_id"],
+        update_fields=ORDER_FIELDS,
+    )
+    OrderItem.objects.filter(
+        order_id__in=[record.order_id for record in records]
+    ).delete()
+    items = [
+        OrderItem(order_id_id=record.order_id, product_category=product_category)
+        for record in records
+        for product_category in record.product_categories
+    ]
+    OrderItem.objects.bulk_create(items, batch_size=INSERT_BATCH_SIZE)
+    return len(items)
+
+
+def import_orders(
+    rows,
+    batch_size=IMPORT_BATCH_SIZE,
+    incremental=False,
+    max_errors=0,
+    on_error=None,
+    on_batch=None,
+):
+    """
+    Upsert the orders in ``rows`` (as yielded by ``read_export``) in
+    transactions of ``batch_size`` orders, holding one batch in memory.
+
+    Rows of the same order are merged, so a CSV export must keep the items
+    of an order on adjacent rows. With ``incremental`` only orders after the
+    stored (delivery_time, order_id) watermark are loaded, and the watermark
+    is advanced in each batch's transaction. Invalid rows are passed to
+    ``on_error`` and skipped until there are more than ``max_errors`` of
+    them. ``on_batch`` is called with the running ``ImportStats``.
+    """
+    started = time.monotonic()
+    watermark = load_watermark() if incremental else None
+    latest = watermark
+    counts = {"rows": 0, "orders": 0, "items": 0, "skipped": 0, "invalid": 0}
+    batch = {}
+
+    def stats():
+        return ImportStats(seconds=time.monotonic() - started, **counts)
+
+    def flush():
+        nonlocal latest
+        records = list(batch.values())
+        batch.clear()
+        with transaction.atomic():
+            counts["items"] += write_orders(records)
+            if incremental:
+                keys = [watermark_key(record) for record in records]
+                latest = max(keys + [latest] if latest else keys)
+                save_watermark(latest)
+        counts["orders"] += len(records)
+        if on_batch is not None:
+            on_batch(stats())
+
+    for line, row in rows:
+        counts["rows"] += 1
+        try:
+            record = parse_order(line, row)
+        except InvalidRow as e:
+            counts["invalid"] += 1
+            if counts["invalid"] > max_errors:
+                raise
+            if on_error is not None:
+                on_error(e)
+            continue
+
+        if watermark is not None and watermark_key(record) <= watermark:
+            counts["skipped"] += 1
+            continue
+
+        if record.order_id in batch:
+            batch[record.order_id].product_categories.extend(record.product_categories)
+            continue
+        if len(batch) >= batch_size:
+            flush()
+        batch[record.order_id] = record
+
+    if batch:
+        flush()
+    return stats()
@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import threading
+import time
+from itertools import count
+from pathlib import Path
+
+from django.conf import settings
+from django.db import (
+    InterfaceError,
+    OperationalError,
+    close_old_connections,
+    connection,
+)
+
+from . import metrics
+from .responses import parse_survey_response, record_survey_responses
+
+logger = logging.getLogger(__name__)
+
+metrics.describe(
+    "survey_queue_depth", "gauge", "Webhook payloads waiting in the local queue"
+)
+metrics.describe(
+    "survey_queue_oldest_age_seconds",
+    "gauge",
+    "Age of the oldest payload waiting in the local queue",
+)
+metrics.describe(
+    "survey_queue_drain_lag_seconds",
+    "gauge",
+    "Time between receiving and storing the oldest payload of the last batch",
+)
+metrics.describe("survey_queue_enqueued_total", "counter", "Webhook payloads accepted")
+metrics.describe(
+    "survey_queue_rejected_total", "counter", "Webhook payloads refused as queue full"
+)
+metrics.describe("survey_queue_drained_total", "counter", "Webhook payloads stored")
+metrics.describe(
+    "survey_queue_failed_total", "counter", "Webhook payloads that could not be stored"
+)
+
+# Database errors that pass on their own, such as a locked SQLite file or a
+# dropped connection. Payloads failing with them stay queued for a retry.
+RETRYABLE_ERRORS = (OperationalError, InterfaceError)
+
+# Seconds the queue depth counted by put() is trusted before the directory
+# is scanned again, since other processes drain the same queue
+DEPTH_RECOUNT_INTERVAL = 1.0
+
+_sequence = count()
+_queues = {}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WebhookQueue:
+    """
+    Append-only spool of raw webhook bodies, one file per payload.
+
+    A payload is acknowledged once its file is fsynced and renamed into
+    ``pending/``. File names start with the receive time in nanoseconds, so
+    sorting them gives arrival order. The writer renames a batch into
+    ``processing/`` before storing it, and moves payloads it cannot store
+    into ``failed/``, or back into ``pending/`` when the database was
+    unavailable.
+    """
+
+    def __init__(self, directory, max_depth, create=True):
+        self.directory = Path(directory)
+        self.max_depth = max_depth
+        self.pending = self.directory / "pending"
+        self.processing = self.directory / "processing"
+        self.failed = self.directory / "failed"
+        if create:
+            for path in (self.pending, self.processing, self.failed):
+                path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._depth = None
+        self._counted_at = 0.0
+
+    def _names(self, directory):
+        try:
+            return sorted(entry.name for entry in os.scandir(directory))
+        except FileNotFoundError:
+            return []
+
+    def depth(self):
+        try:
+            return sum(1 for _ in os.scandir(self.pending))
+        except FileNotFoundError:
+            return 0
+
+    def oldest_age(self):
+        names = self._names(self.pending)
+        if not names:
+            return 0
+        return time.time() - received_at(names[0])
+
+    def put(self, body):
+        with self._lock:
+            now = time.monotonic()
+            if self._depth is None or now - self._counted_at > DEPTH_RECOUNT_INTERVAL:
+                self._depth = self.depth()
+                self._counted_at = now
+            if self._depth >= self.max_depth:
+                raise QueueFull
+            self._depth += 1
+
+        name = f"{time.time_ns():020d}-{os.getpid()}-{next(_sequence)}.json"
+        tmp_path = self.directory / f".{name}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.pending / name)
+        fsync_directory(self.pending)
+        return name
+
+    def claim(self, limit):
+        claimed = []
+        for name in self._names(self.pending)[:limit]:
+            try:
+                os.rename(self.pending / name, self.processing / name)
+            except FileNotFoundError:
+                # Taken by another writer
+                continue
+            # The modification time records when the payload was claimed
+            os.utime(self.processing / name)
+            claimed.append(self.processing / name)
+        return claimed
+
+    def ack(self, paths):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    def reject(self, path):
+        os.rename(path, self.failed / path.name)
+
+    def release(self, paths):
+        # Hand claimed payloads back to be stored by a later batch
+        for path in paths:
+            os.rename(path, self.pending / path.name)
+
+    def recover(self, older_than=300):
+        # Put back payloads claimed by a writer that stopped mid-batch
+        cutoff = time.time() - older_than
+        for entry in os.scandir(self.processing):
+            if entry.stat().st_mtime < cutoff:
+                os.rename(entry.path, self.pending / entry.name)
+
+
+def fsync_directory(path):
+    # Makes a rename into the directory survive a crash
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def received_at(name):
+    return int(name.split("-", 1)[0]) / 1e9
+
+
+def webhook_queue():
+    # One instance per directory so put() keeps its depth count
+    key = (str(settings.SURVEY_QUEUE_DIR), settings.SURVEY_QUEUE_MAX_DEPTH)
+    if key not in _queues:
+        _queues[key] = WebhookQueue(*key)
+    return _queues[key]
+
+
+def collect_queue_metrics():
+    # Only reads, scrapes must not create the queue directories
+    queue = WebhookQueue(
+        settings.SURVEY_QUEUE_DIR, settings.SURVEY_QUEUE_MAX_DEPTH, create=False
+    )
+    metrics.set_gauge("survey_queue_depth", queue.depth())
+    metrics.set_gauge("survey_queue_oldest_age_seconds", queue.oldest_age())
+
+
+metrics.register_collector(collect_queue_metrics)
+
+
+def drain(queue, batch_size):
+    """
+    Store up to ``batch_size`` queued payloads in one transaction and return
+    how many were taken off the queue. Payloads are put back when the
+    database is unavailable, and only moved to ``failed/`` when they cannot
+    be stored at all.
+    """
+    paths = queue.claim(batch_size)
+    if not paths:
+        return 0
+
+    parsed = []
+    for path in paths:
+        try:
+            parsed.append((path, parse_survey_response(json.loads(path.read_bytes()))))
+        except (ValueError, AttributeError, TypeError):
+            logger.exception("Unparseable webhook payload %s", path.name)
+            queue.reject(path)
+            metrics.inc("survey_queue_failed_total")
+
+    if not parsed:
+        return len(paths)
+
+    try:
+        record_survey_responses([response for _, response in parsed])
+    except RETRYABLE_ERRORS:
+        queue.release([path for path, _ in parsed])
+        raise
+    except Exception:
+        # Store one by one so a single bad payload does not hold back the rest
+        released = 0
+        for path, response in parsed:
+            try:
+                record_survey_responses([response])
+            except RETRYABLE_ERRORS:
+                logger.exception("Webhook payload %s left queued", path.name)
+                queue.release([path])
+                released += 1
+                continue
+            except Exception:
+                logger.exception("Could not store webhook payload %s", path.name)
+                queue.reject(path)
+                metrics.inc("survey_queue_failed_total")
+                continue
+            queue.ack([path])
+            metrics.inc("survey_queue_drained_total")
+    else:
+        queue.ack([path for path, _ in parsed])
+        metrics.inc("survey_queue_drained_total", len(parsed))
+        released = 0
+
+    metrics.set_gauge(
+        "survey_queue_drain_lag_seconds", time.time() - received_at(paths[0].name)
+    )
+    return len(paths) - released
+
+
+def drain_forever(stop_event, poll_interval=0.5):
+    queue = webhook_queue()
+    queue.recover()
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            drained = drain(queue, settings.SURVEY_QUEUE_BATCH_SIZE)
+        except Exception:
+            logger.exception("Webhook queue writer failed")
+            drained = 0
+        if not drained:
+            stop_event.wait(poll_interval)
+    connection.close()
+
+
+class QueueWriter:
+    # Background thread draining the local queue into the database
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(
+                target=drain_forever,
+                args=(self.stop_event,),
+                name="survey-queue-writer",
+                daemon=True,
+            )
+            self.thread.start()
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+
+def with_queue_writer(application):
+    """
+    Wrap an ASGI application so the queue writer runs for the lifetime of
+    the server process, started and stopped by the ASGI lifespan protocol.
+    """
+    writer = QueueWriter()
+
+    async def wrapped(scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await application(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if settings.SURVEY_QUEUE_WRITER:
+                    writer.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                writer.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return wrapped
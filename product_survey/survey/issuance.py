@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .eligibility import SURVEY_FORMS
+from .models import NPSSurveyCustomer
+from .rollup import record_sent_rollup
+from .state import record_sent
+
+# Survey ids are reserved this many at a time
+ID_BLOCK_SIZE = 1000
+# Rows per INSERT statement
+INSERT_BATCH_SIZE = 500
+
+SURVEY_LINK = "https://nathabit.typeform.com/to/{form_id}#customer_id={customer_id}&product_category={product_category}&nps_survey_id={nps_survey_id}"
+# https://nathabit.typeform.com/to/RVcdBbTG#customer_id=xxxxx&product_category=xxxxx&nps_survey_id=xxxxx
+
+CSV_FIELDS = [
+    "order_id",
+    "customer_id",
+    "customer_phone",
+    "product_category",
+    "survey_type",
+    "survey_link",
+]
+
+
+def allocate_survey_ids(count, using="default"):
+    """
+    Reserve ``count`` nps_survey_id values so rows can be linked before they
+    are inserted. Reserved ids are never handed out by the database again.
+    """
+    if count <= 0:
+        return []
+
+    connection = connections[using]
+    table = connection.ops.quote_name(NPSSurveyCustomer._meta.db_table)
+    column = connection.ops.quote_name(NPSSurveyCustomer._meta.pk.column)
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+                "FROM generate_series(1, %s)",
+                [
+                    NPSSurveyCustomer._meta.db_table,
+                    NPSSurveyCustomer._meta.pk.column,
+                    count,
+                ],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+        if connection.vendor == "sqlite":
+            # Bumping sqlite_sequence takes the write lock before anything is
+            # read, and AUTOINCREMENT never reuses a value at or below it.
+            cursor.execute(
+                f"UPDATE sqlite_sequence SET seq = MAX(seq, "
+                f"(SELECT COALESCE(MAX({column}), 0) FROM {table})) + %s "
+                f"WHERE name = %s",
+                [count, NPSSurveyCustomer._meta.db_table],
+            )
+            if not cursor.rowcount:
+                cursor.execute(
+                    f"INSERT INTO sqlite_sequence (name, seq) "
+                    f"SELECT %s, COALESCE(MAX({column}), 0) + %s FROM {table}",
+                    [NPSSurveyCustomer._meta.db_table, count],
+                )
+            cursor.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = %s",
+                [NPSSurveyCustomer._meta.db_table],
+            )
+            last = cursor.fetchone()[0]
+            return list(range(last - count + 1, last + 1))
+
+        last = (
+            NPSSurveyCustomer.objects.using(using)
+            .select_for_update()
+            .aggregate(last=Max("nps_survey_id"))["last"]
+            or 0
+        )
+        return list(range(last + 1, last + count + 1))
+
+
+def survey_row(survey):
+    form_id, survey_type = SURVEY_FORMS[survey.survey_id]
+    return {
+        "order_id": survey.order_id,
+        "customer_id": survey.customer_id,
+        "customer_phone": survey.customer_mobile,
+        "product_category": survey.product_category,
+        "survey_type": survey_type,
+        "survey_link": SURVEY_LINK.format(
+            form_id=form_id,
+            customer_id=survey.customer_id,
+            product_category=survey.product_category,
+            nps_survey_id=survey.nps_survey_id,
+        ),
+    }
+
+
+def issue_surveys(decisions, using="default"):
+    """
+    Record a survey for every product category of the eligible ``decisions``
+    in one transaction and return the CSV rows for them.
+    """
+    sent_date = timezone.now()
+    # Left for dispatch_surveys, or uploaded from the CSV by hand
+    dispatch_status = "pending" if settings.SURVEY_DISPATCH_ENABLED else "manual"
+    surveys = [
+        NPSSurveyCustomer(
+            customer_id=decision.customer_id,
+            customer_mobile=decision.customer_mobile,
+            sent_date=sent_date,
+            product_category=product_category,
+            survey_id=decision.survey_id,
+            order_id=decision.order_id,
+            utm_parameter=f"utm={decision.customer_id}",
+            dispatch_status=dispatch_status,
+        )
+        for decision in decisions
+        for product_category in decision.product_categories
+    ]
+
+    with transaction.atomic(using=using):
+        for start in range(0, len(surveys), ID_BLOCK_SIZE):
+            block = surveys[start : start + ID_BLOCK_SIZE]
+            for survey, nps_survey_id in zip(
+                block, allocate_survey_ids(len(block), using=using)
+            ):
+                survey.nps_survey_id = nps_survey_id
+        NPSSurveyCustomer.objects.using(using).bulk_create(
+            surveys, batch_size=INSERT_BATCH_SIZE
+        )
+        record_sent(surveys, using=using)
+        record_sent_rollup(surveys, using=using)
+
+    return [survey_row(survey) for survey in surveys]
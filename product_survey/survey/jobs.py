@@ -0,0 +1,73 @@
+import os
+import socket
+from datetime import timedelta
+from uuid import uuid4
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import SurveyJobLock
+
+# Held by anything that issues surveys
+GENERATION_LOCK = "survey_generation"
+# Held while surveys are handed to the messaging provider
+DISPATCH_LOCK = "survey_dispatch"
+
+# A lock not refreshed for this long was left behind by a run that died
+LOCK_TIMEOUT = timedelta(hours=6)
+
+
+class JobLocked(Exception):
+    pass
+
+
+class JobLock:
+    """
+    Database lock shared by every process and host using the database.
+    Use as a context manager, or call ``acquire``/``release`` when the work
+    outlives the calling frame, such as a streaming response. Long jobs call
+    ``refresh`` as they make progress so the lock is not taken as stale.
+    """
+
+    def __init__(self, name, timeout=LOCK_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex}"
+        self.held = False
+
+    def acquire(self):
+        now = timezone.now()
+        SurveyJobLock.objects.filter(
+            name=self.name, acquired_at__lt=now - self.timeout
+        ).delete()
+        try:
+            with transaction.atomic():
+                SurveyJobLock.objects.create(
+                    name=self.name, owner=self.owner, acquired_at=now
+                )
+        except IntegrityError:
+            return False
+        self.held = True
+        return True
+
+    def refresh(self):
+        # Raises JobLocked if another run took the lock over as stale
+        refreshed = SurveyJobLock.objects.filter(
+            name=self.name, owner=self.owner
+        ).update(acquired_at=timezone.now())
+        if not refreshed:
+            raise JobLocked(self.name)
+
+    def release(self):
+        # Safe to call more than once
+        if self.held:
+            SurveyJobLock.objects.filter(name=self.name, owner=self.owner).delete()
+            self.held = False
+
+    def __enter__(self):
+        if not self.acquire():
+            raise JobLocked(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
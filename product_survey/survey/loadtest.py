@@ -0,0 +1,221 @@
+import json
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from itertools import count
+from typing import NamedTuple
+
+import requests
+
+from .eligibility import SURVEY_FORMS
+from .models import NPSSurveyCustomer
+from .synthetic import CATEGORIES, webhook_payload
+
+STEADY = "steady"
+DUPLICATES = "duplicates"
+RETRY_STORM = "retry-storm"
+SCENARIOS = [STEADY, DUPLICATES, RETRY_STORM]
+
+# Synthetic nps_survey_ids start here so they never match issued surveys
+SYNTHETIC_SURVEY_ID_START = 10**9
+
+LOCK_ERROR = "database is locked"
+
+
+class Delivery(NamedTuple):
+    submission: int
+    body: bytes
+    attempt: int
+
+
+class Outcome(NamedTuple):
+    submission: int
+    attempt: int
+    seconds: float
+    status: int
+    # "timeout", "connection" or "lock" when the delivery failed that way
+    error: str
+
+
+class FakeTypeform:
+    """
+    Produces form_response webhook bodies for the V1 and V2 forms, answering
+    the given ``surveys`` in turn or made-up ones when there are none.
+    """
+
+    def __init__(self, seed=0, v1_share=0.5, surveys=None):
+        self.rng = random.Random(seed)
+        self.v1_share = v1_share
+        self.surveys = list(surveys or [])
+        self._ids = count(SYNTHETIC_SURVEY_ID_START)
+        self._lock = threading.Lock()
+
+    def next_survey(self):
+        if self.surveys:
+            return self.surveys.pop()
+        return NPSSurveyCustomer(
+            nps_survey_id=next(self._ids),
+            customer_id=self.rng.randint(1, 100000),
+            product_category=self.rng.choice(CATEGORIES),
+            survey_id=1 if self.rng.random() < self.v1_share else 2,
+        )
+
+    def submission(self):
+        with self._lock:
+            payload = webhook_payload(self.next_survey(), self.rng)
+        return json.dumps(payload).encode("utf-8")
+
+
+def unfilled_surveys(limit):
+    return list(
+        NPSSurveyCustomer.objects.filter(
+            survey_filled=False, survey_id__in=list(SURVEY_FORMS)
+        ).order_by("-nps_survey_id")[:limit]
+    )
+
+
+def percentile(values, share):
+    # Nearest-rank percentile of already sorted values
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(share * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class LoadTestReport(NamedTuple):
+    scenario: str
+    submissions: int
+    requests: int
+    seconds: float
+    p50: float
+    p95: float
+    p99: float
+    errors: int
+    lock_timeouts: int
+    retries: int
+    statuses: dict
+
+    @property
+    def throughput(self):
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    @property
+    def error_rate(self):
+        return self.errors / self.requests if self.requests else 0.0
+
+    @property
+    def lock_timeout_rate(self):
+        return self.lock_timeouts / self.requests if self.requests else 0.0
+
+
+def summarize(scenario, outcomes, seconds):
+    latencies = sorted(outcome.seconds for outcome in outcomes)
+    failed = [o for o in outcomes if o.error or not 200 <= o.status < 300]
+    return LoadTestReport(
+        scenario=scenario,
+        submissions=len({outcome.submission for outcome in outcomes}),
+        requests=len(outcomes),
+        seconds=seconds,
+        p50=percentile(latencies, 0.50),
+        p95=percentile(latencies, 0.95),
+        p99=percentile(latencies, 0.99),
+        errors=len(failed),
+        lock_timeouts=sum(1 for outcome in outcomes if outcome.error == "lock"),
+        retries=sum(1 for outcome in outcomes if outcome.attempt > 0),
+        statuses=dict(Counter(outcome.status for outcome in outcomes)),
+    )
+
+
+def deliver(session, url, delivery, timeout):
+    started = time.perf_counter()
+    status, error = 0, ""
+    try:
+        response = session.post(
+            url,
+            data=delivery.body,
+            headers={"Content-Type": "application/json"},
+            timeout=timeout,
+        )
+        status = response.status_code
+        if status == 503 or LOCK_ERROR in response.text:
+            error = "lock"
+    except requests.Timeout:
+        error = "timeout"
+    except requests.ConnectionError:
+        error = "connection"
+    return Outcome(
+        submission=delivery.submission,
+        attempt=delivery.attempt,
+        seconds=time.perf_counter() - started,
+        status=status,
+        error=error,
+    )
+
+
+def run_load_test(
+    url,
+    typeform,
+    submissions=1000,
+    duration=None,
+    concurrency=8,
+    scenario=STEADY,
+    copies=3,
+    retries=5,
+    timeout=10.0,
+):
+    """
+    POST webhook deliveries to ``url`` from ``concurrency`` threads until
+    ``submissions`` submissions were sent or ``duration`` seconds passed.
+
+    ``duplicates`` delivers every submission ``copies`` times at once, as
+    Typeform does when it retries a delivery it thinks was lost.
+    ``retry-storm`` resends each failed or timed out delivery straight away,
+    up to ``retries`` times, the way a sender without backoff would.
+    """
+    # Unbounded so retrying workers never block, the producer keeps it short
+    deliveries = queue.Queue()
+    outcomes = []
+    outcomes_lock = threading.Lock()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker():
+        session = requests.Session()
+        while True:
+            delivery = deliveries.get()
+            if delivery is None:
+                deliveries.task_done()
+                return
+            outcome = deliver(session, url, delivery, timeout)
+            with outcomes_lock:
+                outcomes.append(outcome)
+            failed = outcome.error or not 200 <= outcome.status < 300
+            if scenario == RETRY_STORM and failed and delivery.attempt < retries:
+                deliveries.put(delivery._replace(attempt=delivery.attempt + 1))
+            deliveries.task_done()
+
+    threads = [
+        threading.Thread(target=worker, name=f"load-test-{n}", daemon=True)
+        for n in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    sent = 0
+    while sent < submissions and not (deadline and time.monotonic() >= deadline):
+        if deliveries.qsize() >= concurrency * 4:
+            time.sleep(0.001)
+            continue
+        body = typeform.submission()
+        for _ in range(copies if scenario == DUPLICATES else 1):
+            deliveries.put(Delivery(submission=sent, body=body, attempt=0))
+        sent += 1
+
+    deliveries.join()
+    for _ in threads:
+        deliveries.put(None)
+    for thread in threads:
+        thread.join()
+    return summarize(scenario, outcomes, time.perf_counter() - started)
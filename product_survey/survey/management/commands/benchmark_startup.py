@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from survey.benchmarks import FULL_ENTRY, WEBHOOK_ENTRY, measure_startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how fast fresh worker processes of the full ASGI app and of "
+        "the webhook-only entry point import and answer their first request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+
+    def handle(self, *args, **options):
+        full = measure_startup(FULL_ENTRY, runs=options["runs"])
+        webhook = measure_startup(WEBHOOK_ENTRY, runs=options["runs"])
+        for result in [full, webhook]:
+            self.stdout.write(
+                f"{result.entry}: import {result.import_seconds * 1000:.0f} ms, "
+                f"first response {result.first_response_seconds * 1000:.0f} ms, "
+                f"process start to first response "
+                f"{result.process_seconds * 1000:.0f} ms, "
+                f"{result.modules} modules loaded"
+            )
+        self.stdout.write(
+            f"Webhook workers reach their first response "
+            f"{full.process_seconds / webhook.process_seconds:.1f}x faster"
+        )
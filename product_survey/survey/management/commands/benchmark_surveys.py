@@ -0,0 +1,101 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from survey.benchmarks import (
+    DEFAULT_TOLERANCE,
+    SCALES,
+    check_results,
+    load_baseline,
+    run_scale,
+    save_baseline,
+)
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / "benchmark_baseline.json"
+
+
+def scale(value):
+    if value in SCALES:
+        return value, SCALES[value]
+    try:
+        return value, int(value)
+    except ValueError:
+        raise CommandError(
+            f"Unknown scale {value}, use {', '.join(SCALES)} or a number"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Time send_surveys and receive_survey_response on synthetic data in a "
+        "throwaway test database, and fail on query growth or timing "
+        "regressions against the stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            action="append",
+            help=f"{', '.join(SCALES)} or a number of orders, repeatable",
+        )
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Store these timings as the new baseline instead of comparing",
+        )
+        parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        scales = [scale(value) for value in options["scale"] or ["10k"]]
+        batch_dir = tempfile.mkdtemp()
+        # Never touches the configured database
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases={"default"}
+        )
+        try:
+            results = []
+            for name, orders in scales:
+                call_command("flush", interactive=False, verbosity=0)
+                result = run_scale(name, orders, batch_dir, seed=options["seed"])
+                results.append(result)
+                self.report(result)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(batch_dir)
+
+        if options["update_baseline"]:
+            save_baseline(options["baseline"], results)
+            self.stdout.write(f"Saved baseline to {options['baseline']}")
+            baseline = None
+        else:
+            baseline = load_baseline(options["baseline"])
+
+        failures = check_results(results, baseline, options["tolerance"])
+        if failures:
+            raise CommandError("Benchmark regressions:\n" + "\n".join(failures))
+
+    def report(self, result):
+        self.stdout.write(
+            f"{result.scale}: {result.orders} orders, {result.day_orders} "
+            f"delivered on the run day, {result.surveys_issued} surveys issued\n"
+            f"  send_surveys: {result.send_seconds:.3f}s, "
+            f"{result.send_queries} queries "
+            f"({result.send_queries_per_chunk:.1f} per chunk), "
+            f"peak {result.send_peak_bytes / 2**20:.1f} MiB\n"
+            f"  receive_survey_response: {result.receive_seconds * 1000:.2f} ms "
+            f"and {result.receive_queries:.1f} queries per webhook over "
+            f"{result.webhooks}, peak {result.receive_peak_bytes / 2**20:.1f} MiB"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from survey.answers import COMPACT_CHUNK_SIZE, compact_stored_answers
+
+
+class Command(BaseCommand):
+    help = (
+        "Move answers stored as NPSSurveyQuestionResponse rows onto their "
+        "primary response in compact form"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=COMPACT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        total = compact_stored_answers(chunk_size=options["chunk_size"])
+        self.stdout.write(f"Compacted the answers of {total} submissions")
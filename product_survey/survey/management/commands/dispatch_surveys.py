@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.dispatch import (
+    DISPATCH_BACKOFF,
+    DISPATCH_CHUNK_SIZE,
+    DISPATCH_CONCURRENCY,
+    DISPATCH_RETRIES,
+    FAILED,
+    PENDING,
+    FakeProvider,
+    dispatch_surveys,
+    messaging_provider,
+)
+from survey.jobs import DISPATCH_LOCK, JobLock, JobLocked
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the issued surveys that have not been dispatched yet through "
+        "the messaging provider and record how each delivery went"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=DISPATCH_CHUNK_SIZE)
+        parser.add_argument("--concurrency", type=int, default=DISPATCH_CONCURRENCY)
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=settings.SURVEY_DISPATCH_RATE,
+            help="Messages per second, 0 for no limit",
+        )
+        parser.add_argument("--burst", type=int, default=settings.SURVEY_DISPATCH_BURST)
+        parser.add_argument("--retries", type=int, default=DISPATCH_RETRIES)
+        parser.add_argument("--backoff", type=float, default=DISPATCH_BACKOFF)
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Also send surveys whose earlier dispatch failed",
+        )
+        parser.add_argument(
+            "--fake",
+            action="store_true",
+            help=(
+                "Send to an in-memory provider instead, to measure throughput. "
+                "Nothing is recorded on the surveys"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if not settings.SURVEY_DISPATCH_ENABLED and not options["fake"]:
+            raise CommandError(
+                "Survey dispatch is off, surveys are still sent from the CSV. "
+                "Set SURVEY_DISPATCH_ENABLED to switch over"
+            )
+        if options["fake"]:
+            provider = FakeProvider()
+        else:
+            try:
+                provider = messaging_provider()
+            except ValueError as e:
+                raise CommandError(str(e))
+        statuses = (PENDING, FAILED) if options["retry_failed"] else (PENDING,)
+
+        try:
+            with JobLock(DISPATCH_LOCK):
+                stats = dispatch_surveys(
+                    provider,
+                    statuses=statuses,
+                    rate=options["rate"] or None,
+                    burst=options["burst"],
+                    concurrency=options["concurrency"],
+                    retries=options["retries"],
+                    backoff=options["backoff"],
+                    chunk_size=options["chunk_size"],
+                    record=not options["fake"],
+                )
+        except JobLocked:
+            raise CommandError("Another survey dispatch run is in progress")
+        finally:
+            provider.close()
+
+        self.stdout.write(
+            f"{stats.sent} sent, {stats.failed} failed, {stats.retried} retried "
+            f"in {stats.seconds:.1f}s ({stats.throughput:.0f} messages/s)"
+        )
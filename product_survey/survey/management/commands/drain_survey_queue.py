@@ -0,0 +1,39 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from survey.ingest import drain, drain_forever, webhook_queue
+
+
+class Command(BaseCommand):
+    help = "Store webhook payloads waiting in the local queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain what is queued now and exit instead of polling",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.SURVEY_QUEUE_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        if not options["once"]:
+            stop_event = threading.Event()
+            try:
+                drain_forever(stop_event)
+            except KeyboardInterrupt:
+                stop_event.set()
+            return
+
+        queue = webhook_queue()
+        queue.recover()
+        total = 0
+        while True:
+            drained = drain(queue, options["batch_size"])
+            if not drained:
+                break
+            total += drained
+        self.stdout.write(f"Drained {total} payloads")
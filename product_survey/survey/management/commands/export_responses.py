@@ -0,0 +1,78 @@
+import os
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from survey.exports import (
+    EXPORT_FORMATS,
+    EXPORT_PAGE_SIZE,
+    ExportFilters,
+    export_chunks,
+)
+from survey.models import SurveyJobCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Write one row per survey submission, with a column per question, to "
+        "a CSV or JSONL file. An interrupted export resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output")
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument("--survey-id", type=int)
+        parser.add_argument("--product-category")
+        parser.add_argument(
+            "--start", type=date.fromisoformat, help="First day filled, inclusive"
+        )
+        parser.add_argument(
+            "--end", type=date.fromisoformat, help="Last day filled, inclusive"
+        )
+        parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Start over instead of resuming an unfinished export",
+        )
+
+    def handle(self, *args, **options):
+        filters = ExportFilters(
+            survey_id=options["survey_id"],
+            product_category=options["product_category"],
+            start=options["start"],
+            end=options["end"],
+        )
+        checkpoint, _ = SurveyJobCheckpoint.objects.get_or_create(
+            name=f"export_responses:{os.path.abspath(options['output'])}"
+        )
+        position = checkpoint.position
+        if options["restart"] or position.get("done"):
+            position = {}
+
+        written = 0
+        with open(options["output"], "a+", newline="") as f:
+            # Drop anything written after the last saved page
+            f.truncate(position.get("bytes", 0))
+            f.seek(0, os.SEEK_END)
+            chunks = export_chunks(
+                filters,
+                options["format"],
+                after=position.get("after", 0),
+                page_size=options["page_size"],
+                header=not f.tell(),
+            )
+            for text, last_nps_survey_id, submissions in chunks:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+                if last_nps_survey_id is not None:
+                    position = {"after": last_nps_survey_id}
+                    written += submissions
+                position["bytes"] = f.tell()
+                checkpoint.position = position
+                checkpoint.save()
+
+        checkpoint.position = dict(position, done=True)
+        checkpoint.save()
+        self.stdout.write(f"Wrote {written} submissions to {options['output']}")
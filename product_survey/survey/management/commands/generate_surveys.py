@@ -0,0 +1,98 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from survey.eligibility import ORDER_CHUNK_SIZE
+from survey import workers
+from survey.batches import record_batch
+from survey.generation import (
+    GenerationConflict,
+    check_checkpoints,
+    generate_shard,
+    merge_shards,
+)
+from survey.jobs import GENERATION_LOCK, JobLock, JobLocked
+from survey.models import SurveyBatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Issue surveys for a run date or range of run dates, as send_surveys "
+        "would on those days, and write the CSV to disk. Interrupted runs "
+        "resume from their last committed chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date", type=date.fromisoformat, help="Run date, defaults to today"
+        )
+        parser.add_argument("--end-date", type=date.fromisoformat)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument(
+            "--shards",
+            type=int,
+            help="Customer shards to split each day into, defaults to --workers",
+        )
+        parser.add_argument("--chunk-size", type=int, default=ORDER_CHUNK_SIZE)
+        parser.add_argument("--output", default=".")
+
+    def handle(self, *args, **options):
+        start = options["date"] or timezone.now().date()
+        end = options["end_date"] or start
+        if end < start:
+            raise CommandError("--end-date is before --date")
+        run_dates = []
+        for n in range((end - start).days + 1):
+            run_date = start + timedelta(days=n)
+            delivery_date = run_date - timedelta(days=30)
+            if SurveyBatch.objects.filter(delivery_date=delivery_date).exists():
+                self.stdout.write(f"Surveys for {run_date} were already generated")
+                continue
+            run_dates.append(run_date)
+        if not run_dates:
+            return
+
+        pool_size = options["workers"]
+        shards = options["shards"] or pool_size
+        output_dir = Path(options["output"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        try:
+            with JobLock(GENERATION_LOCK) as lock:
+                # Every worker refreshes the lock as its chunks commit
+                tasks = [
+                    (run_dates, shard, shards, output_dir, options["chunk_size"], lock)
+                    for shard in range(shards)
+                ]
+                for run_date in run_dates:
+                    check_checkpoints(run_date, shards, output_dir)
+                if pool_size > 1:
+                    # Workers open their own connections
+                    connections.close_all()
+                    with ProcessPoolExecutor(
+                        max_workers=pool_size,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=workers.init_worker,
+                    ) as pool:
+                        results = list(pool.map(workers.generate_shard, *zip(*tasks)))
+                else:
+                    results = [generate_shard(*task) for task in tasks]
+        except JobLocked:
+            raise CommandError(
+                "Another survey generation run is in progress or took over the lock"
+            )
+        except GenerationConflict as e:
+            raise CommandError(str(e))
+
+        for shard, issued in results:
+            self.stdout.write(f"Shard {shard + 1}/{shards}: {issued} surveys issued")
+        for run_date in run_dates:
+            path = merge_shards(run_date, shards, output_dir)
+            # send_surveys serves this file instead of generating the day again
+            record_batch(run_date - timedelta(days=30), path)
+            self.stdout.write(f"Wrote {path}")
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.imports import (
+    IMPORT_BATCH_SIZE,
+    InvalidRow,
+    export_format,
+    import_orders,
+    open_export,
+    read_export,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert Orders and OrderItems from a CSV or JSONL export (optionally "
+        "gzipped, - for stdin) in batched transactions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Defaults to the file extension",
+        )
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only load orders after the last imported watermark",
+        )
+        parser.add_argument(
+            "--max-errors",
+            type=int,
+            default=0,
+            help="Invalid rows to skip before giving up",
+        )
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or export_format(options["path"])
+        try:
+            with open_export(options["path"]) as f:
+                stats = import_orders(
+                    read_export(f, file_format),
+                    batch_size=options["batch_size"],
+                    incremental=options["incremental"],
+                    max_errors=options["max_errors"],
+                    on_error=lambda e: self.stderr.write(f"Skipped {e}"),
+                    on_batch=self.report,
+                )
+        except (InvalidRow, OSError) as e:
+            raise CommandError(str(e))
+
+        self.report(stats)
+        self.stdout.write(
+            f"Done: {stats.skipped} rows before the watermark, "
+            f"{stats.invalid} invalid rows skipped"
+        )
+
+    def report(self, stats):
+        self.stdout.write(
+            f"{stats.rows} rows, {stats.orders} orders, {stats.items} items "
+            f"in {stats.seconds:.1f}s ({stats.rows_per_second:.0f} rows/sec)"
+        )
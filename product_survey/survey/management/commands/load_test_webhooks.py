@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.loadtest import (
+    SCENARIOS,
+    STEADY,
+    FakeTypeform,
+    run_load_test,
+    unfilled_surveys,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire Typeform-shaped V1 and V2 webhook deliveries at a running server "
+        "and report throughput, latency percentiles and error rates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default="http://127.0.0.1:8000/surveys/receive_survey_response/",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--submissions",
+            type=int,
+            default=1000,
+            help="Distinct submissions to send",
+        )
+        parser.add_argument(
+            "--duration", type=float, help="Stop sending after this many seconds"
+        )
+        parser.add_argument("--scenario", choices=SCENARIOS, default=STEADY)
+        parser.add_argument(
+            "--copies",
+            type=int,
+            default=3,
+            help="Deliveries per submission in the duplicates scenario",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=5,
+            help="Immediate resends of a failed delivery in the retry-storm scenario",
+        )
+        parser.add_argument("--timeout", type=float, default=10.0)
+        parser.add_argument("--v1-share", type=float, default=0.5)
+        parser.add_argument(
+            "--issued",
+            action="store_true",
+            help="Answer unfilled surveys from the database instead of made-up ones",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        surveys = unfilled_surveys(options["submissions"]) if options["issued"] else []
+        typeform = FakeTypeform(
+            seed=options["seed"], v1_share=options["v1_share"], surveys=surveys
+        )
+        report = run_load_test(
+            options["url"],
+            typeform,
+            submissions=options["submissions"],
+            duration=options["duration"],
+            concurrency=options["concurrency"],
+            scenario=options["scenario"],
+            copies=options["copies"],
+            retries=options["retries"],
+            timeout=options["timeout"],
+        )
+
+        statuses = ", ".join(
+            f"{status or 'no response'}: {n}"
+            for status, n in sorted(report.statuses.items())
+        )
+        self.stdout.write(
+            f"{report.scenario}: {report.submissions} submissions in "
+            f"{report.requests} requests over {report.seconds:.1f}s "
+            f"({report.throughput:.1f} req/s)\n"
+            f"latency p50 {report.p50 * 1000:.1f} ms, p95 {report.p95 * 1000:.1f} ms, "
+            f"p99 {report.p99 * 1000:.1f} ms\n"
+            f"errors {report.error_rate:.2%}, lock timeouts "
+            f"{report.lock_timeout_rate:.2%}, retries {report.retries}\n"
+            f"statuses {statuses}"
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from survey.rollup import REBUILD_CHUNK_SIZE, rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily NPS rollup from the stored surveys and responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=REBUILD_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        total = rebuild_rollup(chunk_size=options["chunk_size"])
+        self.stdout.write(f"Rebuilt {total} NPS rollup rows")
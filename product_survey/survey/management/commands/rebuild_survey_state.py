@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from survey.state import CUSTOMER_CHUNK_SIZE, rebuild_customer_states
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-customer survey state from NPSSurveyCustomer history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=CUSTOMER_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        total = rebuild_customer_states(chunk_size=options["chunk_size"])
+        self.stdout.write(f"Rebuilt survey state for {total} customers")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from survey.state import RECONCILE_CHUNK_SIZE, reconcile_survey_filled
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute survey_filled on every NPSSurveyCustomer from the stored "
+        "primary responses and rebuild the state of the customers affected"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Count the changes only"
+        )
+
+    def handle(self, *args, **options):
+        stats = reconcile_survey_filled(
+            chunk_size=options["chunk_size"], dry_run=options["dry_run"]
+        )
+        verb = "would be" if options["dry_run"] else "were"
+        self.stdout.write(
+            f"{stats.filled + stats.unfilled} surveys {verb} changed: "
+            f"{stats.filled} marked filled, {stats.unfilled} marked unfilled, "
+            f"{stats.customers} customers"
+        )
+        if stats.filled + stats.unfilled and not options["dry_run"]:
+            self.stdout.write(
+                "Run rebuild_nps_rollup to bring the response counts up to date"
+            )
@@ -0,0 +1,56 @@
+import time
+from itertools import chain
+
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.wal import (
+    REPLAY_BATCH_SIZE,
+    REPLAY_WORKERS,
+    read_log_segment,
+    read_typeform_export,
+    replay,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-ingest webhook log segments or Typeform response exports through "
+        "the webhook parsing and storage path"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+")
+        parser.add_argument(
+            "--typeform-export",
+            metavar="FORM_ID",
+            help="Read the paths as Typeform Responses API exports of this form",
+        )
+        parser.add_argument("--batch-size", type=int, default=REPLAY_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, default=REPLAY_WORKERS)
+
+    def handle(self, *args, **options):
+        form_id = options["typeform_export"]
+        if form_id:
+            payloads = chain.from_iterable(
+                read_typeform_export(path, form_id) for path in options["paths"]
+            )
+        else:
+            payloads = chain.from_iterable(
+                read_log_segment(path) for path in options["paths"]
+            )
+
+        started = time.monotonic()
+        try:
+            stats = replay(
+                payloads,
+                batch_size=options["batch_size"],
+                workers=options["workers"],
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        seconds = time.monotonic() - started
+        self.stdout.write(
+            f"Replayed {stats.read} payloads in {seconds:.1f}s: {stats.stored} "
+            f"stored, {stats.duplicates} already stored, {stats.failed} failed"
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.routers import SYNC_PAGES, sync_sqlite_replica
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the SQLite file standing in for the read replica with a copy "
+        "of the primary"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=SYNC_PAGES)
+
+    def handle(self, *args, **options):
+        try:
+            sync_sqlite_replica(pages=options["pages"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write("Replica refreshed")
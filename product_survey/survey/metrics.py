@@ -0,0 +1,121 @@
+import bisect
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_help = {}
+_types = {}
+_values = defaultdict(float)
+_collectors = []
+_buckets = {}
+# (name, labels) -> [per-bucket counts, sum, count]
+_histograms = {}
+
+# Upper bounds used by histograms described without their own
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def describe(name, metric_type, help_text, buckets=None):
+    _types[name] = metric_type
+    _help[name] = help_text
+    if metric_type == "histogram":
+        _buckets[name] = tuple(sorted(buckets or DEFAULT_BUCKETS))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _values[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    buckets = _buckets.get(name, DEFAULT_BUCKETS)
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = [[0] * len(buckets), 0.0, 0]
+        histogram = _histograms[key]
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def get(name, **labels):
+    with _lock:
+        return _values.get(_key(name, labels), 0)
+
+
+def get_histogram(name, **labels):
+    """
+    ``(sum, count)`` of the values observed for ``name`` with ``labels``.
+    """
+    with _lock:
+        _, total, count = _histograms.get(_key(name, labels), (None, 0.0, 0))
+        return total, count
+
+
+def register_collector(collector):
+    """
+    ``collector`` is called on every scrape and sets gauges that are cheaper
+    to read on demand than to keep up to date.
+    """
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return "{" + pairs + "}"
+
+
+def render():
+    for collector in _collectors:
+        collector()
+
+    with _lock:
+        samples = sorted(_values.items())
+        histograms = sorted(
+            (key, (list(counts), total, count))
+            for key, (counts, total, count) in _histograms.items()
+        )
+
+    lines = []
+    described = set()
+
+    def header(name):
+        if name not in described and name in _types:
+            lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {_types[name]}")
+            described.add(name)
+
+    for (name, labels), value in samples:
+        header(name)
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for (name, labels), (counts, total, count) in histograms:
+        header(name)
+        cumulative = 0
+        for bound, bucket_count in zip(_buckets.get(name, DEFAULT_BUCKETS), counts):
+            cumulative += bucket_count
+            le = labels + (("le", f"{bound:g}"),)
+            lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+        le = labels + (("le", "+Inf"),)
+        lines.append(f"{name}_bucket{_format_labels(le)} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,156 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+
+from . import metrics
+
+# Statements whose row counts are reported as rows written
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+# send_surveys and exports run for minutes on a busy day
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+metrics.describe(
+    "survey_http_request_duration_seconds",
+    "histogram",
+    "Time to produce each response, by URL name",
+    buckets=LATENCY_BUCKETS,
+)
+metrics.describe(
+    "survey_http_requests_total", "counter", "Requests answered, by URL name and status"
+)
+metrics.describe(
+    "survey_db_queries_per_request",
+    "histogram",
+    "Queries run for each request, by URL name",
+    buckets=QUERY_BUCKETS,
+)
+metrics.describe(
+    "survey_db_queries_total", "counter", "Queries run for requests, by URL name"
+)
+metrics.describe(
+    "survey_db_query_seconds_total",
+    "counter",
+    "Time spent in queries run for requests, by URL name",
+)
+metrics.describe(
+    "survey_db_rows_written_total",
+    "counter",
+    "Rows inserted, updated or deleted for requests, by URL name",
+)
+
+
+class QueryStats:
+    """
+    A ``connection.execute_wrapper`` counting the queries it sees, the time
+    spent in them and the rows they wrote.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows_written = 0
+        # SQLite only knows how many rows an INSERT ... RETURNING wrote once
+        # its rows were fetched, so the count is read on the next query
+        self._write_cursor = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.settle()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+            if sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+                self._write_cursor = context["cursor"]
+
+    def settle(self):
+        if self._write_cursor is not None:
+            self.rows_written += max(0, self._write_cursor.rowcount)
+            self._write_cursor = None
+
+
+def url_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None or not match.url_name:
+        return "unmatched"
+    return match.url_name
+
+
+def record_request(request, response, started, stats=None):
+    view = url_name(request)
+    metrics.observe(
+        "survey_http_request_duration_seconds",
+        time.perf_counter() - started,
+        view=view,
+    )
+    metrics.inc(
+        "survey_http_requests_total",
+        view=view,
+        method=request.method,
+        status=response.status_code,
+    )
+    if stats is None:
+        return
+    stats.settle()
+    metrics.observe("survey_db_queries_per_request", stats.queries, view=view)
+    metrics.inc("survey_db_queries_total", stats.queries, view=view)
+    metrics.inc("survey_db_query_seconds_total", stats.seconds, view=view)
+    metrics.inc("survey_db_rows_written_total", stats.rows_written, view=view)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, queries, query time and rows written per URL name for
+    the metrics endpoint.
+
+    Streaming responses are measured until their last chunk was sent, since
+    that is where their queries run. Async views only get their latency
+    recorded: their queries run on another thread's connection.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        stats = QueryStats()
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        with stack:
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, request, response, started, stats
+            )
+        else:
+            record_request(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        record_request(request, response, started)
+        return response
+
+    def measure_stream(self, content, request, response, started, stats):
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                yield from content
+        finally:
+            record_request(request, response, started, stats)
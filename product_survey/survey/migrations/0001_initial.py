@@ -0,0 +1,114 @@
+# Generated by Django 5.1 on 2026-10-18 08:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="NPSSurveyCustomer",
+            fields=[
+                ("nps_survey_id", models.AutoField(primary_key=True, serialize=False)),
+                ("customer_id", models.IntegerField()),
+                ("customer_mobile", models.CharField(max_length=15)),
+                ("sent_date", models.DateTimeField()),
+                ("product_category", models.CharField(max_length=100)),
+                ("survey_id", models.IntegerField()),
+                ("order_id", models.IntegerField()),
+                ("utm_parameter", models.CharField(max_length=100)),
+                ("survey_filled", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="NPSSurveyPrimaryResponse",
+            fields=[
+                (
+                    "nps_survey_id",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("customer_id", models.IntegerField()),
+                ("age", models.CharField(max_length=50, null=True)),
+                ("gender", models.CharField(max_length=10, null=True)),
+                ("survey_filled_date", models.DateTimeField(null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="NPSSurveyQuestionnaire",
+            fields=[
+                ("survey_id", models.IntegerField(primary_key=True, serialize=False)),
+                ("product_category", models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="NPSSurveyQuestionResponse",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("nps_survey_id", models.CharField(max_length=50)),
+                ("question_id", models.CharField(max_length=50)),
+                ("response", models.CharField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="NPSSurveyQuestions",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("survey_id", models.IntegerField()),
+                ("question_id", models.CharField(max_length=50)),
+                ("question_description", models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Order",
+            fields=[
+                ("order_id", models.IntegerField(primary_key=True, serialize=False)),
+                ("customer_id", models.IntegerField()),
+                ("customer_mobile", models.CharField(max_length=15)),
+                ("delivery_time", models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="OrderItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("product_category", models.CharField(max_length=100)),
+                (
+                    "order_id",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="survey.order"
+                    ),
+                ),
+            ],
+        ),
+    ]
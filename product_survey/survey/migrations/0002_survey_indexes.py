@@ -0,0 +1,42 @@
+# Generated by Django 5.1 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="npssurveycustomer",
+            index=models.Index(
+                fields=["customer_id", "sent_date"], name="nps_customer_sent_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="npssurveycustomer",
+            index=models.Index(
+                fields=["customer_id", "survey_filled"], name="nps_customer_filled_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="npssurveycustomer",
+            index=models.Index(
+                fields=["customer_id", "survey_id", "product_category"],
+                name="nps_customer_survey_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="npssurveyquestionresponse",
+            index=models.Index(
+                fields=["nps_survey_id"], name="nps_response_survey_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["delivery_time"], name="order_delivery_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0002_survey_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="npssurveyprimaryresponse",
+            name="response_token",
+            field=models.CharField(max_length=100, null=True, unique=True),
+        ),
+    ]
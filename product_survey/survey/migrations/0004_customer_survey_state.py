@@ -0,0 +1,90 @@
+# Generated by Django 5.1 on 2026-10-18 08:34
+
+from itertools import islice
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+# Customers inserted per query
+BATCH_SIZE = 1000
+
+
+def backfill_customer_state(apps, schema_editor):
+    """
+    Give every customer with survey history a NPSSurveyCustomerState row,
+    as rebuild_survey_state would. Eligibility reads only the state, so
+    without it these customers would look as if they had never been sent a
+    survey.
+    """
+    NPSSurveyCustomer = apps.get_model("survey", "NPSSurveyCustomer")
+    NPSSurveyCustomerState = apps.get_model("survey", "NPSSurveyCustomerState")
+    NPSSurveyPrimaryResponse = apps.get_model("survey", "NPSSurveyPrimaryResponse")
+    db = schema_editor.connection.alias
+
+    survey_ids = list(
+        NPSSurveyCustomer.objects.using(db)
+        .order_by()
+        .values_list("survey_id", flat=True)
+        .distinct()
+    )
+    last_filled = dict(
+        NPSSurveyPrimaryResponse.objects.using(db)
+        .order_by()
+        .values("customer_id")
+        .annotate(last_filled_date=Max("survey_filled_date"))
+        .values_list("customer_id", "last_filled_date")
+    )
+
+    history = (
+        NPSSurveyCustomer.objects.using(db)
+        .order_by("customer_id")
+        .values("customer_id")
+        .annotate(
+            last_sent_date=Max("sent_date"),
+            unfilled_count=Count("pk", filter=Q(survey_filled=False)),
+            **{
+                f"received_{survey_id}": Count("pk", filter=Q(survey_id=survey_id))
+                for survey_id in survey_ids
+            },
+        )
+    )
+    states = (
+        NPSSurveyCustomerState(
+            customer_id=row["customer_id"],
+            last_sent_date=row["last_sent_date"],
+            unfilled_count=row["unfilled_count"],
+            # One bit per survey_id received, as in survey.state.version_bit
+            survey_versions=sum(
+                1 << (survey_id - 1)
+                for survey_id in survey_ids
+                if row[f"received_{survey_id}"]
+            ),
+            last_filled_date=last_filled.get(row["customer_id"]),
+        )
+        for row in history.iterator()
+    )
+    while batch := list(islice(states, BATCH_SIZE)):
+        NPSSurveyCustomerState.objects.using(db).bulk_create(
+            batch, ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0003_primary_response_token"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NPSSurveyCustomerState",
+            fields=[
+                ("customer_id", models.IntegerField(primary_key=True, serialize=False)),
+                ("last_sent_date", models.DateTimeField(null=True)),
+                ("unfilled_count", models.IntegerField(default=0)),
+                ("survey_versions", models.IntegerField(default=0)),
+                ("last_filled_date", models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_customer_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0004_customer_survey_state"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SurveyJobCheckpoint",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=200, primary_key=True, serialize=False),
+                ),
+                ("position", models.JSONField(default=dict)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SurveyJobLock",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("owner", models.CharField(max_length=200)),
+                ("acquired_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0005_survey_jobs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SurveyBatch",
+            fields=[
+                ("delivery_date", models.DateField(primary_key=True, serialize=False)),
+                ("path", models.CharField(max_length=500)),
+                ("row_count", models.IntegerField()),
+                ("etag", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
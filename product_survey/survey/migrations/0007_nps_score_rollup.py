@@ -0,0 +1,44 @@
+# Generated by Django 5.1 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0006_survey_batch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NPSScoreRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("survey_id", models.IntegerField()),
+                ("product_category", models.CharField(max_length=100)),
+                ("day", models.DateField()),
+                ("sent_count", models.IntegerField(default=0)),
+                ("response_count", models.IntegerField(default=0)),
+                ("promoters", models.IntegerField(default=0)),
+                ("passives", models.IntegerField(default=0)),
+                ("detractors", models.IntegerField(default=0)),
+            ],
+            options={
+                "indexes": [models.Index(fields=["day"], name="nps_rollup_day_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("survey_id", "product_category", "day"),
+                        name="nps_rollup_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1 on 2026-10-18 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0007_nps_score_rollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="npssurveyprimaryresponse",
+            name="answers",
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1 on 2026-10-18 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0008_compact_answers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="npssurveycustomer",
+            name="dispatch_attempts",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="npssurveycustomer",
+            name="dispatch_error",
+            field=models.CharField(default="", max_length=255),
+        ),
+        # Surveys issued so far were handed over as CSV, only new ones are
+        # left for dispatch_surveys
+        migrations.AddField(
+            model_name="npssurveycustomer",
+            name="dispatch_status",
+            field=models.CharField(default="manual", max_length=10),
+        ),
+        migrations.AlterField(
+            model_name="npssurveycustomer",
+            name="dispatch_status",
+            field=models.CharField(default="pending", max_length=10),
+        ),
+        migrations.AddField(
+            model_name="npssurveycustomer",
+            name="dispatched_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="npssurveycustomer",
+            name="provider_message_id",
+            field=models.CharField(default="", max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name="npssurveycustomer",
+            index=models.Index(
+                fields=["dispatch_status", "nps_survey_id"],
+                name="nps_dispatch_status_idx",
+            ),
+        ),
+    ]
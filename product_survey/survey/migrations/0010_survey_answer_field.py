@@ -0,0 +1,53 @@
+# Generated by Django 5.1 on 2026-10-18 09:19
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+# The 0-10 "Rate the brand" opinion scale of both survey forms
+NPS_QUESTION_ID = "1q9jwqqMvbvP"
+
+
+def seed_answer_fields(apps, schema_editor):
+    """
+    Give every field in NPSSurveyQuestions the code compact answers were
+    stored under so far, the id of its first NPSSurveyQuestions row.
+    """
+    NPSSurveyQuestions = apps.get_model("survey", "NPSSurveyQuestions")
+    SurveyAnswerField = apps.get_model("survey", "SurveyAnswerField")
+    connection = schema_editor.connection
+    db = connection.alias
+
+    codes = {}
+    questions = NPSSurveyQuestions.objects.using(db).order_by("pk")
+    for pk, question_id in questions.values_list("pk", "question_id"):
+        codes.setdefault(question_id, pk)
+    SurveyAnswerField.objects.using(db).bulk_create(
+        SurveyAnswerField(code=code, question_id=question_id)
+        for question_id, code in codes.items()
+    )
+    # Later fields are numbered after the explicit codes
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [SurveyAnswerField]):
+            cursor.execute(sql)
+    SurveyAnswerField.objects.using(db).update_or_create(
+        question_id=NPS_QUESTION_ID, defaults={"numeric": True}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("survey", "0009_survey_dispatch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SurveyAnswerField",
+            fields=[
+                ("code", models.AutoField(primary_key=True, serialize=False)),
+                ("question_id", models.CharField(max_length=50, unique=True)),
+                ("numeric", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(seed_answer_fields, migrations.RunPython.noop),
+    ]
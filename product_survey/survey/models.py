@@ -7,6 +7,11 @@ class Order(models.Model):
     customer_mobile = models.CharField(max_length=15)
     delivery_time = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["delivery_time"], name="order_delivery_idx"),
+        ]
+
     def __str__(self) -> str:
         return f'{self.order_id} - {self.delivery_time.date().strftime("%b %d %Y")}'
 
@@ -29,17 +34,61 @@ class NPSSurveyCustomer(models.Model):
     order_id = models.IntegerField()
     utm_parameter = models.CharField(max_length=100)
     survey_filled = models.BooleanField(default=False)
+    # Delivery through the messaging provider, recorded by dispatch_surveys.
+    # Surveys handed over as CSV instead are "manual", see
+    # SURVEY_DISPATCH_ENABLED
+    dispatch_status = models.CharField(max_length=10, default="pending")
+    dispatch_attempts = models.IntegerField(default=0)
+    dispatched_at = models.DateTimeField(null=True)
+    provider_message_id = models.CharField(max_length=100, default="")
+    dispatch_error = models.CharField(max_length=255, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["customer_id", "sent_date"], name="nps_customer_sent_idx"
+            ),
+            models.Index(
+                fields=["dispatch_status", "nps_survey_id"],
+                name="nps_dispatch_status_idx",
+            ),
+            models.Index(
+                fields=["customer_id", "survey_filled"], name="nps_customer_filled_idx"
+            ),
+            models.Index(
+                fields=["customer_id", "survey_id", "product_category"],
+                name="nps_customer_survey_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.customer_id}-{self.survey_id}-{self.product_category}"
 
 
+class NPSSurveyCustomerState(models.Model):
+    # Summary of a customer's NPSSurveyCustomer history used for eligibility
+    customer_id = models.IntegerField(primary_key=True)
+    last_sent_date = models.DateTimeField(null=True)
+    unfilled_count = models.IntegerField(default=0)
+    # One bit per survey_id received: 1 << (survey_id - 1)
+    survey_versions = models.IntegerField(default=0)
+    last_filled_date = models.DateTimeField(null=True)
+
+    def __str__(self) -> str:
+        return f"{self.customer_id} - {self.last_sent_date}"
+
+
 class NPSSurveyPrimaryResponse(models.Model):
     nps_survey_id = models.CharField(primary_key=True, max_length=50)
     customer_id = models.IntegerField()
     age = models.CharField(null=True, max_length=50)
     gender = models.CharField(max_length=10, null=True)
     survey_filled_date = models.DateTimeField(null=True)
+    # Typeform response token, one stored response per submission
+    response_token = models.CharField(max_length=100, null=True, unique=True)
+    # [question, value] pairs when answers are stored compactly, question
+    # being an NPSSurveyQuestions id or an unlisted Typeform field id
+    answers = models.JSONField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -64,10 +113,85 @@ class NPSSurveyQuestions(models.Model):
         return f"{self.survey_id}-{self.question_id}-{self.question_description}"
 
 
+class SurveyAnswerField(models.Model):
+    # Code of a Typeform field in compact answers, never reused or changed
+    # so stored answers decode the same after questions are edited
+    code = models.AutoField(primary_key=True)
+    question_id = models.CharField(max_length=50, unique=True)
+    # Answered with numbers (opinion_scale, number), kept as ints
+    numeric = models.BooleanField(default=False)
+
+    def __str__(self) -> str:
+        return f"{self.code}-{self.question_id}"
+
+
 class NPSSurveyQuestionResponse(models.Model):
     nps_survey_id = models.CharField(max_length=50)
     question_id = models.CharField(max_length=50)
     response = models.CharField(max_length=255, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["nps_survey_id"], name="nps_response_survey_idx"),
+        ]
+
     def __str__(self) -> str:
         return f"{self.nps_survey_id}-{self.question_id}-{self.response}"
+
+
+class SurveyJobCheckpoint(models.Model):
+    # Progress of a resumable job, saved with each committed chunk
+    name = models.CharField(primary_key=True, max_length=200)
+    position = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} - {self.position}"
+
+
+class SurveyJobLock(models.Model):
+    # Held while a job runs so two runs cannot overlap
+    name = models.CharField(primary_key=True, max_length=100)
+    owner = models.CharField(max_length=200)
+    acquired_at = models.DateTimeField()
+
+    def __str__(self) -> str:
+        return f"{self.name} - {self.owner}"
+
+
+class SurveyBatch(models.Model):
+    # CSV of the surveys issued for one delivery date, generated once
+    delivery_date = models.DateField(primary_key=True)
+    path = models.CharField(max_length=500)
+    row_count = models.IntegerField()
+    etag = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.delivery_date} - {self.row_count}"
+
+
+class NPSScoreRollup(models.Model):
+    # Surveys sent and responses received per survey, category and day
+    survey_id = models.IntegerField()
+    product_category = models.CharField(max_length=100)
+    day = models.DateField()
+    sent_count = models.IntegerField(default=0)
+    response_count = models.IntegerField(default=0)
+    promoters = models.IntegerField(default=0)
+    passives = models.IntegerField(default=0)
+    detractors = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["survey_id", "product_category", "day"],
+                name="nps_rollup_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["day"], name="nps_rollup_day_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.survey_id}-{self.product_category}-{self.day}"
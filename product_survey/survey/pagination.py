@@ -0,0 +1,96 @@
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Tables estimated smaller than this are still counted exactly
+EXACT_COUNT_LIMIT = 100000
+# Seconds a counted total is reused for the same query
+COUNT_CACHE_SECONDS = 60
+# Seconds the last key of a page is kept to start the next page from
+CURSOR_CACHE_SECONDS = 300
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for large tables.
+
+    The total comes from the planner statistics on PostgreSQL for
+    unfiltered lists, and from a briefly cached COUNT(*) otherwise.
+
+    Lists ordered by primary key are paged by key. The last key of every page
+    served is cached, and the page after it is read with ``pk < last`` (or
+    ``>``) and a LIMIT, so paging forward costs the same at any depth. A page
+    reached without its cursor, such as a typed page number, still needs an
+    OFFSET to find its first key, though it reads only the primary key index.
+    """
+
+    def query_key(self, prefix):
+        try:
+            sql = str(self.object_list.query)
+        except Exception:
+            return None
+        return prefix + hashlib.md5(sql.encode("utf-8")).hexdigest()
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > EXACT_COUNT_LIMIT:
+                return row[0]
+
+        key = self.query_key("admin-count:")
+        if key is None:
+            return super().count
+        return cache.get_or_set(
+            key, lambda: Paginator.count.func(self), COUNT_CACHE_SECONDS
+        )
+
+    def seek_direction(self):
+        ordering = self.object_list.query.order_by
+        pk_names = {"pk", self.object_list.model._meta.pk.name}
+        if len(ordering) != 1:
+            return None
+        field = ordering[0]
+        if field.lstrip("-") not in pk_names:
+            return None
+        return "lte" if field.startswith("-") else "gte"
+
+    def page(self, number):
+        direction = self.seek_direction()
+        if direction is None:
+            return super().page(number)
+
+        number = self.validate_number(number)
+        object_list = self.object_list
+        cursor_key = self.query_key("admin-cursor:")
+        after = None
+        if number > 1 and cursor_key:
+            after = cache.get(f"{cursor_key}:{number}")
+        if after is not None:
+            # Strictly after the last key of the page before
+            object_list = object_list.filter(**{f"pk__{direction[:2]}": after})
+        elif number > 1:
+            # Walks the primary key index only
+            bottom = (number - 1) * self.per_page
+            first_pk = next(
+                iter(object_list.values_list("pk", flat=True)[bottom : bottom + 1]),
+                None,
+            )
+            if first_pk is None:
+                return Page([], number, self)
+            object_list = object_list.filter(**{f"pk__{direction}": first_pk})
+
+        rows = list(object_list[: self.per_page])
+        if rows and cursor_key:
+            cache.set(f"{cursor_key}:{number + 1}", rows[-1].pk, CURSOR_CACHE_SECONDS)
+        return Page(rows, number, self)
@@ -0,0 +1,173 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .middleware import url_name
+
+# Frames closest to the root kept per sample
+MAX_STACK_DEPTH = 200
+
+
+def frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    label = f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+    # ``;`` separates frames and spaces end the stack in the collapsed format
+    return label.replace(";", ":").replace(" ", "_")
+
+
+def collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels[-MAX_STACK_DEPTH:]))
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads being profiled every ``interval``
+    seconds from one background thread, which only runs while a profile is
+    open. Each profile is a Counter of collapsed stacks.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._thread = None
+
+    def start(self, thread_id=None):
+        thread_id = thread_id or threading.get_ident()
+        with self._lock:
+            self._profiles[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, thread_id=None):
+        thread_id = thread_id or threading.get_ident()
+        with self._lock:
+            return self._profiles.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, stacks in self._profiles.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def stack_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(settings.SURVEY_PROFILE_INTERVAL)
+        return _sampler
+
+
+def save_profile(stacks, seconds, label, directory, keep):
+    """
+    Write ``stacks`` in the collapsed format read by flamegraph.pl and
+    speedscope, then delete all but the ``keep`` slowest profiles.
+    Returns the path written, or None when it was not among them.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # Names sort by duration
+    path = directory / f"{round(seconds * 1e6):012d}-{label}-{time.time_ns()}.folded"
+    with open(path, "w") as f:
+        for stack, samples in stacks.most_common():
+            f.write(f"{stack} {samples}\n")
+
+    profiles = sorted(directory.glob("*.folded"), reverse=True)
+    for stale in profiles[keep:]:
+        stale.unlink(missing_ok=True)
+    return path if path.exists() else None
+
+
+class ProfilingMiddleware:
+    """
+    Samples the stacks of a request when it carries the
+    ``SURVEY_PROFILE_HEADER`` header and comes from ``INTERNAL_IPS`` (any
+    address with DEBUG on), or of every request when
+    ``SURVEY_PROFILE_THRESHOLD`` is set, keeping those slower than it.
+    Streaming responses are profiled until their last chunk was sent.
+    Async views are not profiled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+
+        requested = bool(
+            settings.SURVEY_PROFILE_HEADER
+            and request.headers.get(settings.SURVEY_PROFILE_HEADER)
+            and (
+                settings.DEBUG
+                or request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS
+            )
+        )
+        if not requested and settings.SURVEY_PROFILE_THRESHOLD is None:
+            return self.get_response(request)
+
+        sampler = stack_sampler()
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            sampler.stop()
+            raise
+        if response.streaming:
+            response.streaming_content = self.profile_stream(
+                response.streaming_content, request, started, requested
+            )
+        else:
+            self.finish(request, started, requested)
+        return response
+
+    def profile_stream(self, content, request, started, requested):
+        try:
+            yield from content
+        finally:
+            self.finish(request, started, requested)
+
+    def finish(self, request, started, requested):
+        stacks = stack_sampler().stop()
+        seconds = time.perf_counter() - started
+        threshold = settings.SURVEY_PROFILE_THRESHOLD
+        if requested or (threshold is not None and seconds >= threshold):
+            save_profile(
+                stacks,
+                seconds,
+                url_name(request),
+                settings.SURVEY_PROFILE_DIR,
+                settings.SURVEY_PROFILE_KEEP,
+            )
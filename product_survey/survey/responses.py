@@ -0,0 +1,220 @@
+from collections import Counter
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .answers import compact_storage, encode_answers, record_numeric_fields
+from .cache import LRUSet
+from .eligibility import SURVEY_FORMS
+from .models import (
+    NPSSurveyCustomer,
+    NPSSurveyPrimaryResponse,
+    NPSSurveyQuestionResponse,
+)
+from .rollup import record_response_rollup
+from .state import record_filled
+
+# Typeform form id -> survey_id
+FORM_SURVEYS = {form_id: survey_id for survey_id, (form_id, _) in SURVEY_FORMS.items()}
+
+# Demographic questions only asked in the V1 form
+AGE_QUESTION_ID = "r7TMRukeAETP"
+GENDER_QUESTION_ID = "AYd3C9b0fXiJ"
+
+# Answers per INSERT statement
+INSERT_BATCH_SIZE = 500
+
+# Tokens of submissions stored or seen recently by this process
+recent_deliveries = LRUSet(settings.SURVEY_DEDUP_CACHE_SIZE)
+
+metrics.describe(
+    "survey_webhook_duplicates_total",
+    "counter",
+    "Repeated webhook deliveries skipped, by where they were detected",
+)
+metrics.describe(
+    "survey_webhook_lock_timeouts_total",
+    "counter",
+    "Webhook deliveries answered 503 because the database was locked",
+)
+
+
+class SurveyResponse(NamedTuple):
+    token: str
+    nps_survey_id: str
+    customer_id: str
+    product_category: str
+    form_id: str
+    survey_id: int
+    age: str
+    gender: str
+    answers: list
+
+
+def answer_value(answer):
+    answer_type = answer.get("type")
+    value = answer.get(answer_type)
+    if answer_type == "choice":
+        return value.get("label")
+    return value
+
+
+def parse_survey_response(data):
+    """
+    Turn a Typeform webhook payload into a ``SurveyResponse``. No database
+    access happens here.
+    """
+    form_responses = data.get("form_response")
+    form_id = form_responses.get("form_id")
+    hidden = form_responses.get("hidden") or {}
+    answers = form_responses.get("answers") or []
+
+    response_data = {
+        answer.get("field").get("id"): answer.get(answer.get("type"))
+        for answer in answers
+    }
+
+    age = None
+    gender = None
+    survey_id = FORM_SURVEYS.get(form_id, 2)
+    if survey_id == 1:
+        age = (response_data.get(AGE_QUESTION_ID) or {}).get("label")
+        gender = (response_data.get(GENDER_QUESTION_ID) or {}).get("label")
+
+    return SurveyResponse(
+        # Typeform keeps the token when it retries a delivery
+        token=form_responses.get("token") or data.get("event_id"),
+        # Links sent before nps_survey_id existed only carry the event id
+        nps_survey_id=hidden.get("nps_survey_id") or data.get("event_id"),
+        customer_id=hidden.get("customer_id"),
+        product_category=hidden.get("product_category"),
+        form_id=form_id,
+        survey_id=survey_id,
+        age=age,
+        gender=gender,
+        answers=[
+            (answer.get("field").get("id"), answer_value(answer)) for answer in answers
+        ],
+    )
+
+
+def skip_duplicates(responses, known_tokens, source):
+    fresh = []
+    batch_tokens = set()
+    for response in responses:
+        if response.token in known_tokens or response.token in batch_tokens:
+            metrics.inc("survey_webhook_duplicates_total", source=source)
+            continue
+        if response.token:
+            batch_tokens.add(response.token)
+        fresh.append(response)
+    return fresh
+
+
+def record_survey_responses(responses):
+    """
+    Store parsed ``responses`` in one transaction: one batched insert for the
+    primary responses, one for all their answers and a single UPDATE marking
+    the matching surveys as filled.
+
+    Submissions already stored are skipped, answering from ``recent_deliveries``
+    where possible before asking the database. Returns the responses stored.
+    """
+    responses = skip_duplicates(responses, recent_deliveries, "cache")
+    if not responses:
+        return []
+
+    with transaction.atomic():
+        tokens = [response.token for response in responses if response.token]
+        stored_tokens = set(
+            NPSSurveyPrimaryResponse.objects.filter(
+                response_token__in=tokens
+            ).values_list("response_token", flat=True)
+        )
+        responses = skip_duplicates(responses, stored_tokens, "database")
+        if responses:
+            write_survey_responses(responses)
+
+    for token in tokens:
+        recent_deliveries.add(token)
+    return responses
+
+
+def write_survey_responses(responses):
+    survey_filled_date = timezone.now()
+    compact = compact_storage()
+    primary_responses = []
+    question_responses = []
+    filled_survey_ids = []
+
+    for response in responses:
+        primary_responses.append(
+            NPSSurveyPrimaryResponse(
+                nps_survey_id=response.nps_survey_id,
+                response_token=response.token,
+                customer_id=response.customer_id,
+                age=response.age,
+                gender=response.gender,
+                survey_filled_date=survey_filled_date,
+                answers=encode_answers(response.answers) if compact else None,
+            )
+        )
+        if not compact:
+            question_responses.extend(
+                NPSSurveyQuestionResponse(
+                    nps_survey_id=response.nps_survey_id,
+                    question_id=question_id,
+                    response=answer,
+                )
+                for question_id, answer in response.answers
+            )
+        if str(response.nps_survey_id).isdigit():
+            filled_survey_ids.append(int(response.nps_survey_id))
+
+    record_numeric_fields(
+        answer for response in responses for answer in response.answers
+    )
+    NPSSurveyPrimaryResponse.objects.bulk_create(primary_responses)
+    NPSSurveyQuestionResponse.objects.bulk_create(
+        question_responses, batch_size=INSERT_BATCH_SIZE
+    )
+    # The sent surveys these responses answer
+    surveys = []
+    if filled_survey_ids:
+        surveys = list(
+            NPSSurveyCustomer.objects.filter(
+                nps_survey_id__in=filled_survey_ids
+            ).values_list(
+                "nps_survey_id",
+                "customer_id",
+                "survey_id",
+                "product_category",
+                "survey_filled",
+            )
+        )
+    record_response_rollup(
+        responses,
+        {
+            str(nps_survey_id): (survey_id, product_category)
+            for nps_survey_id, _, survey_id, product_category, _ in surveys
+        },
+        survey_filled_date,
+    )
+    # Record if the customer filled the survey form or not.
+    if surveys:
+        newly_filled = [
+            (nps_survey_id, customer_id)
+            for nps_survey_id, customer_id, _, _, survey_filled in surveys
+            if not survey_filled
+        ]
+        if newly_filled:
+            NPSSurveyCustomer.objects.filter(
+                nps_survey_id__in=[nps_survey_id for nps_survey_id, _ in newly_filled]
+            ).update(survey_filled=True)
+            record_filled(
+                Counter(customer_id for _, customer_id in newly_filled),
+                survey_filled_date,
+            )
@@ -0,0 +1,251 @@
+from collections import defaultdict
+
+from django.db import connections, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncWeek
+from django.utils import timezone
+
+from .answers import answer_rows
+from .models import NPSScoreRollup, NPSSurveyCustomer, NPSSurveyPrimaryResponse
+
+# "Rate the brand on the below scale." in both survey forms
+NPS_QUESTION_ID = "1q9jwqqMvbvP"
+
+# Rollup rows per upsert statement
+UPSERT_BATCH_SIZE = 500
+# Filled surveys read per query when rebuilding
+REBUILD_CHUNK_SIZE = 1000
+
+COUNT_FIELDS = ["sent_count", "response_count", "promoters", "passives", "detractors"]
+
+GROUPINGS = {
+    "survey_id": F("survey_id"),
+    "product_category": F("product_category"),
+    "day": F("day"),
+    "week": TruncWeek("day"),
+}
+
+
+def score_counts(score):
+    """
+    Promoter, passive and detractor counts for one answer to the 0-10
+    question. Missing or unreadable answers count as none of them.
+    """
+    try:
+        score = int(score)
+    except (TypeError, ValueError):
+        return (0, 0, 0)
+    if score >= 9:
+        return (1, 0, 0)
+    if score >= 7:
+        return (0, 1, 0)
+    return (0, 0, 1)
+
+
+def upsert_rollup(counts, using="default"):
+    """
+    Add ``counts``, a mapping of (survey_id, product_category, day) to a
+    tuple ordered like ``COUNT_FIELDS``, onto the rollup. Rows are updated
+    in place by the database, so concurrent writers never lose an increment.
+    """
+    if not counts:
+        return
+
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(NPSScoreRollup._meta.db_table)
+    key_columns = ["survey_id", "product_category", "day"]
+    columns = ", ".join(quote(column) for column in key_columns + COUNT_FIELDS)
+    updates = ", ".join(
+        f"{quote(field)} = {table}.{quote(field)} + excluded.{quote(field)}"
+        for field in COUNT_FIELDS
+    )
+    placeholders = (
+        "(" + ", ".join(["%s"] * (len(key_columns) + len(COUNT_FIELDS))) + ")"
+    )
+
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [key + tuple(values) for key, values in sorted(counts.items())]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start : start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"VALUES {', '.join([placeholders] * len(batch))} "
+                f"ON CONFLICT ({', '.join(quote(c) for c in key_columns)}) "
+                f"DO UPDATE SET {updates}",
+                [value for row in batch for value in row],
+            )
+
+
+def sent_counts(surveys):
+    counts = defaultdict(lambda: [0] * len(COUNT_FIELDS))
+    for survey in surveys:
+        key = (
+            survey.survey_id,
+            survey.product_category,
+            timezone.localdate(survey.sent_date),
+        )
+        counts[key][0] += 1
+    return counts
+
+
+def record_sent_rollup(surveys, using="default"):
+    upsert_rollup(sent_counts(surveys), using=using)
+
+
+def record_response_rollup(responses, surveys, filled_date, using="default"):
+    """
+    Count stored ``responses`` (``SurveyResponse`` tuples) under the day
+    they were filled, and under the survey_id and product category of the
+    survey they answer. ``surveys`` maps nps_survey_id to that pair.
+    Responses that match no sent survey are left out, as in rebuild_rollup.
+    """
+    counts = defaultdict(lambda: [0] * len(COUNT_FIELDS))
+    day = timezone.localdate(filled_date)
+    for response in responses:
+        survey = surveys.get(str(response.nps_survey_id))
+        if survey is None:
+            continue
+        score = dict(response.answers).get(NPS_QUESTION_ID)
+        values = counts[(*survey, day)]
+        values[1] += 1
+        for index, count in enumerate(score_counts(score), start=2):
+            values[index] += count
+    upsert_rollup(counts, using=using)
+
+
+def rebuild_rollup(chunk_size=REBUILD_CHUNK_SIZE):
+    """
+    Recompute the rollup from NPSSurveyCustomer and the stored responses.
+    Responses are counted under the survey and category they were sent
+    for; responses that match no sent survey are left out. Returns the
+    number of rollup rows written.
+
+    Runs in one transaction that holds off the incremental writers, so
+    their increments land either in the history read here or on top of the
+    rebuilt rows. On SQLite the transaction takes the write lock when it
+    begins. On PostgreSQL the rollup table is locked before anything is
+    read, and writers wait at their upsert until the rebuild commits.
+    """
+    with transaction.atomic():
+        connection = connections[NPSScoreRollup.objects.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "LOCK TABLE %s IN EXCLUSIVE MODE"
+                    % connection.ops.quote_name(NPSScoreRollup._meta.db_table)
+                )
+        counts = rollup_counts(chunk_size)
+        NPSScoreRollup.objects.all().delete()
+        NPSScoreRollup.objects.bulk_create(
+            [
+                NPSScoreRollup(
+                    survey_id=survey_id,
+                    product_category=product_category,
+                    day=day,
+                    **dict(zip(COUNT_FIELDS, values)),
+                )
+                for (survey_id, product_category, day), values in counts.items()
+            ],
+            batch_size=UPSERT_BATCH_SIZE,
+        )
+    return len(counts)
+
+
+def rollup_counts(chunk_size):
+    counts = defaultdict(lambda: [0] * len(COUNT_FIELDS))
+
+    sent = (
+        NPSSurveyCustomer.objects.annotate(day=TruncDate("sent_date"))
+        .order_by()
+        .values("survey_id", "product_category", "day")
+        .annotate(sent=Count("pk"))
+    )
+    for row in sent:
+        counts[(row["survey_id"], row["product_category"], row["day"])][0] = row["sent"]
+
+    filled = NPSSurveyCustomer.objects.filter(survey_filled=True).order_by(
+        "nps_survey_id"
+    )
+    last_nps_survey_id = 0
+    while True:
+        surveys = list(
+            filled.filter(nps_survey_id__gt=last_nps_survey_id).values_list(
+                "nps_survey_id", "survey_id", "product_category"
+            )[:chunk_size]
+        )
+        if not surveys:
+            break
+        last_nps_survey_id = surveys[-1][0]
+        ids = [str(nps_survey_id) for nps_survey_id, _, _ in surveys]
+        filled_dates = dict(
+            NPSSurveyPrimaryResponse.objects.filter(nps_survey_id__in=ids).values_list(
+                "nps_survey_id", "survey_filled_date"
+            )
+        )
+        scores = {
+            nps_survey_id: response
+            for nps_survey_id, question_id, response in answer_rows(ids)
+            if question_id == NPS_QUESTION_ID
+        }
+        for nps_survey_id, survey_id, product_category in surveys:
+            filled_date = filled_dates.get(str(nps_survey_id))
+            if filled_date is None:
+                continue
+            values = counts[
+                (survey_id, product_category, timezone.localdate(filled_date))
+            ]
+            values[1] += 1
+            for index, count in enumerate(
+                score_counts(scores.get(str(nps_survey_id))), start=2
+            ):
+                values[index] += count
+    return counts
+
+
+def nps(promoters, detractors, scored):
+    if not scored:
+        return None
+    return round((promoters - detractors) * 100 / scored, 1)
+
+
+def summarize(row):
+    scored = row["promoters"] + row["passives"] + row["detractors"]
+    row["nps"] = nps(row["promoters"], row["detractors"], scored)
+    row["response_rate"] = (
+        round(row["response_count"] / row["sent_count"], 4)
+        if row["sent_count"]
+        else None
+    )
+    return row
+
+
+def nps_summary(start, end, group_by=(), **filters):
+    """
+    NPS and response rate for the days ``start`` to ``end`` inclusive, read
+    from the rollup alone. ``group_by`` takes keys of ``GROUPINGS``.
+    """
+    rows = NPSScoreRollup.objects.filter(day__range=(start, end), **filters)
+    totals = summarize(
+        {
+            field: value or 0
+            for field, value in rows.aggregate(
+                **{field: Sum(field) for field in COUNT_FIELDS}
+            ).items()
+        }
+    )
+    if not group_by:
+        return totals, []
+
+    groups = (
+        rows.order_by()
+        .annotate(**{f"group_{key}": GROUPINGS[key] for key in group_by})
+        .values(*[f"group_{key}" for key in group_by])
+        .annotate(**{field: Sum(field) for field in COUNT_FIELDS})
+        .order_by(*[f"group_{key}" for key in group_by])
+    )
+    return totals, [
+        summarize({key.removeprefix("group_"): value for key, value in row.items()})
+        for row in groups
+    ]
@@ -0,0 +1,70 @@
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = "replica"
+
+# Pages sync_replica copies per step, writers may commit between steps
+SYNC_PAGES = 1024
+
+_use_replica = ContextVar("survey_use_replica", default=False)
+
+
+@contextmanager
+def read_replica():
+    """
+    Send the reads made inside the block to the replica, when
+    SURVEY_READ_REPLICA is on. Only for reads that can be a little behind
+    the primary.
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_enabled():
+    return settings.SURVEY_READ_REPLICA and REPLICA in settings.DATABASES
+
+
+class ReadReplicaRouter:
+    """
+    Reads go to the replica inside ``read_replica()`` blocks and to the
+    primary everywhere else. Writes always go to the primary, even for
+    objects read from the replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_enabled():
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        return db != REPLICA
+
+
+def sync_sqlite_replica(pages=SYNC_PAGES):
+    """
+    Copy the SQLite primary over the replica file with the online backup
+    API. Readers of the replica see the old copy until it completes.
+    """
+    primary, replica = connections[DEFAULT_DB_ALIAS], connections[REPLICA]
+    if primary.vendor != "sqlite" or replica.vendor != "sqlite":
+        raise ValueError("Only SQLite replicas are copied, use replication")
+    primary.ensure_connection()
+    target = sqlite3.connect(replica.settings_dict["NAME"])
+    try:
+        primary.connection.backup(target, pages=pages)
+    finally:
+        target.close()
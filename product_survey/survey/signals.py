@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .answers import clear_question_dictionary, register_fields
+from .eligibility import invalidate_eligibility
+from .models import NPSSurveyCustomer, NPSSurveyQuestions
+from .state import refresh_customer_states
+
+
+# Bulk paths maintain the state themselves, these cover single-row saves
+# such as admin edits
+@receiver(post_save, sender=NPSSurveyCustomer)
+@receiver(post_delete, sender=NPSSurveyCustomer)
+def refresh_customer_state(sender, instance, **kwargs):
+    refresh_customer_states(customer_id=instance.customer_id)
+    invalidate_eligibility([instance.customer_id])
+
+
+@receiver(post_save, sender=NPSSurveyQuestions)
+def register_question_field(sender, instance, **kwargs):
+    register_fields([instance.question_id])
+
+
+# Codes outlive their questions so stored answers still decode
+@receiver(post_delete, sender=NPSSurveyQuestions)
+def reload_question_dictionary(sender, **kwargs):
+    clear_question_dictionary()
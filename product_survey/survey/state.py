@@ -0,0 +1,228 @@
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import CharField, Count, Exists, F, Max, Min, OuterRef, Q
+from django.db.models.functions import Cast, Greatest
+
+from .eligibility import ELIGIBILITY_CACHE, SURVEY_FORMS, invalidate_eligibility
+from .models import NPSSurveyCustomer, NPSSurveyCustomerState, NPSSurveyPrimaryResponse
+
+# Customers read or rebuilt per query
+CUSTOMER_CHUNK_SIZE = 500
+
+# Range of nps_survey_id values reconciled per transaction
+RECONCILE_CHUNK_SIZE = 5000
+
+STATE_FIELDS = ["last_sent_date", "unfilled_count", "survey_versions"]
+
+
+def version_bit(survey_id):
+    return 1 << (survey_id - 1)
+
+
+def chunked(values, size=CUSTOMER_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def record_sent(surveys, using="default"):
+    """
+    Fold newly inserted ``surveys`` into their customers' state. Call inside
+    the transaction that inserted them. The counts are added by the database
+    in the upsert, so a concurrent record_filled is never overwritten.
+    """
+    sent = defaultdict(lambda: [None, 0, 0])
+    for survey in surveys:
+        customer = sent[survey.customer_id]
+        if customer[0] is None or survey.sent_date > customer[0]:
+            customer[0] = survey.sent_date
+        if not survey.survey_filled:
+            customer[1] += 1
+        customer[2] |= version_bit(survey.survey_id)
+    if not sent:
+        return
+
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(NPSSurveyCustomerState._meta.db_table)
+    greatest = "GREATEST" if connection.vendor == "postgresql" else "MAX"
+    last_sent, unfilled, versions = (quote(field) for field in STATE_FIELDS)
+    columns = ", ".join([quote("customer_id"), last_sent, unfilled, versions])
+    updates = (
+        f"{last_sent} = {greatest}("
+        f"COALESCE({table}.{last_sent}, excluded.{last_sent}), excluded.{last_sent}), "
+        f"{unfilled} = {table}.{unfilled} + excluded.{unfilled}, "
+        f"{versions} = {table}.{versions} | excluded.{versions}"
+    )
+
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [
+        (customer_id, connection.ops.adapt_datetimefield_value(last_sent_date))
+        + tuple(counts)
+        for customer_id, (last_sent_date, *counts) in sorted(sent.items())
+    ]
+    with connection.cursor() as cursor:
+        for batch in chunked(rows):
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({quote('customer_id')}) DO UPDATE SET {updates}",
+                [value for row in batch for value in row],
+            )
+    invalidate_eligibility(sent)
+
+
+def record_filled(filled_per_customer, filled_date):
+    """
+    Take surveys that just became filled off their customers' unfilled
+    count. ``filled_per_customer`` maps customer_id to surveys filled.
+    """
+    customers_by_count = defaultdict(list)
+    for customer_id, filled in filled_per_customer.items():
+        customers_by_count[filled].append(customer_id)
+
+    for filled, customer_ids in customers_by_count.items():
+        for chunk in chunked(customer_ids):
+            NPSSurveyCustomerState.objects.filter(customer_id__in=chunk).update(
+                unfilled_count=Greatest(F("unfilled_count") - filled, 0),
+                last_filled_date=filled_date,
+            )
+    invalidate_eligibility(filled_per_customer)
+
+
+def refresh_customer_states(**lookup):
+    """
+    Recompute the state of the customers matching ``lookup`` (a filter on
+    customer_id) from their full survey history.
+    """
+    history = (
+        NPSSurveyCustomer.objects.filter(**lookup)
+        .order_by()
+        .values("customer_id")
+        .annotate(
+            last_sent_date=Max("sent_date"),
+            unfilled_count=Count("pk", filter=Q(survey_filled=False)),
+            **{
+                f"received_{survey_id}": Count("pk", filter=Q(survey_id=survey_id))
+                for survey_id in SURVEY_FORMS
+            },
+        )
+    )
+    last_filled = dict(
+        NPSSurveyPrimaryResponse.objects.filter(**lookup)
+        .order_by()
+        .values("customer_id")
+        .annotate(last_filled_date=Max("survey_filled_date"))
+        .values_list("customer_id", "last_filled_date")
+    )
+
+    states = [
+        NPSSurveyCustomerState(
+            customer_id=row["customer_id"],
+            last_sent_date=row["last_sent_date"],
+            unfilled_count=row["unfilled_count"],
+            survey_versions=sum(
+                version_bit(survey_id)
+                for survey_id in SURVEY_FORMS
+                if row[f"received_{survey_id}"]
+            ),
+            last_filled_date=last_filled.get(row["customer_id"]),
+        )
+        for row in history
+    ]
+
+    with transaction.atomic():
+        NPSSurveyCustomerState.objects.filter(**lookup).exclude(
+            customer_id__in=[state.customer_id for state in states]
+        ).delete()
+        NPSSurveyCustomerState.objects.bulk_create(
+            states,
+            update_conflicts=True,
+            unique_fields=["customer_id"],
+            update_fields=STATE_FIELDS + ["last_filled_date"],
+        )
+    return len(states)
+
+
+def rebuild_customer_states(chunk_size=CUSTOMER_CHUNK_SIZE):
+    """
+    Rebuild every customer's state from history, walking customer ids in
+    ranges of ``chunk_size`` customers. Returns the number of customers.
+    """
+    customers = (
+        NPSSurveyCustomer.objects.order_by("customer_id")
+        .values_list("customer_id", flat=True)
+        .distinct()
+    )
+    NPSSurveyCustomerState.objects.exclude(
+        customer_id__in=NPSSurveyCustomer.objects.values("customer_id")
+    ).delete()
+
+    total = 0
+    last_customer_id = None
+    while True:
+        chunk = customers
+        if last_customer_id is not None:
+            chunk = chunk.filter(customer_id__gt=last_customer_id)
+        customer_ids = list(chunk[:chunk_size])
+        if not customer_ids:
+            caches[ELIGIBILITY_CACHE].clear()
+            return total
+        total += refresh_customer_states(
+            customer_id__range=(customer_ids[0], customer_ids[-1])
+        )
+        last_customer_id = customer_ids[-1]
+
+
+class ReconcileStats(NamedTuple):
+    # Surveys marked filled, marked unfilled, and their customers
+    filled: int
+    unfilled: int
+    customers: int
+
+
+def has_response():
+    # The primary response keyed by the survey's id, as a string
+    return Exists(
+        NPSSurveyPrimaryResponse.objects.filter(
+            nps_survey_id=Cast(OuterRef("nps_survey_id"), CharField())
+        )
+    )
+
+
+def reconcile_survey_filled(chunk_size=RECONCILE_CHUNK_SIZE, dry_run=False):
+    """
+    Set survey_filled on every survey to whether a primary response exists
+    for it, with two UPDATEs per range of ``chunk_size`` nps_survey_ids, and
+    rebuild the state of the customers whose surveys changed.
+    """
+    bounds = NPSSurveyCustomer.objects.aggregate(
+        first=Min("nps_survey_id"), last=Max("nps_survey_id")
+    )
+    if bounds["first"] is None:
+        return ReconcileStats(0, 0, 0)
+
+    filled = unfilled = customers = 0
+    for start in range(bounds["first"], bounds["last"] + 1, chunk_size):
+        surveys = NPSSurveyCustomer.objects.filter(
+            nps_survey_id__range=(start, start + chunk_size - 1)
+        )
+        missing = surveys.filter(has_response(), survey_filled=False)
+        stale = surveys.filter(~has_response(), survey_filled=True)
+        with transaction.atomic():
+            customer_ids = set(missing.values_list("customer_id", flat=True))
+            customer_ids.update(stale.values_list("customer_id", flat=True))
+            if dry_run:
+                filled += missing.count()
+                unfilled += stale.count()
+            else:
+                filled += missing.update(survey_filled=True)
+                unfilled += stale.update(survey_filled=False)
+                if customer_ids:
+                    refresh_customer_states(customer_id__in=customer_ids)
+                    invalidate_eligibility(customer_ids)
+        customers += len(customer_ids)
+    return ReconcileStats(filled, unfilled, customers)
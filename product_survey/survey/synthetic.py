@@ -0,0 +1,186 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .eligibility import EXCLUDED_CATEGORIES, SURVEY_FORMS, start_of_day
+from .models import NPSSurveyCustomer, Order, OrderItem
+from .responses import AGE_QUESTION_ID, GENDER_QUESTION_ID
+from .rollup import NPS_QUESTION_ID
+from .state import rebuild_customer_states
+
+CATEGORIES = [
+    "lepa",
+    "Tikta",
+    "Kesh",
+    "Face Wash",
+    "Hair Oil",
+    "Body Lotion",
+] + EXCLUDED_CATEGORIES
+
+# Share of the generated orders delivered on the day send_surveys processes
+TARGET_DAY_SHARE = 0.1
+# Days of delivery history before that day
+HISTORY_DAYS = 120
+# Share of past orders that were surveyed, and of those surveys filled
+SURVEYED_SHARE = 0.5
+FILLED_SHARE = 0.3
+
+# Rows per INSERT statement
+INSERT_BATCH_SIZE = 5000
+
+AGE_GROUPS = ["18-24", "25-34", "35-44", "45+"]
+GENDERS = ["Female", "Male", "Other"]
+COMMENTS = ["Lovely", "Works well", "Too expensive", "Smells great", ""]
+
+
+def delivery_day(run_date):
+    return run_date - timedelta(days=30)
+
+
+def synthetic_orders(count, rng, run_date):
+    """
+    Yield ``(order, categories)`` for ``count`` orders from about a third as
+    many customers, ``TARGET_DAY_SHARE`` of them delivered on the day
+    send_surveys processes on ``run_date`` and the rest over the
+    ``HISTORY_DAYS`` before it.
+    """
+    customers = max(1, count // 3)
+    target_start = start_of_day(delivery_day(run_date))
+    target_orders = max(1, int(count * TARGET_DAY_SHARE))
+    for order_id in range(1, count + 1):
+        customer_id = rng.randint(1, customers)
+        if order_id <= target_orders:
+            delivered = target_start
+        else:
+            delivered = target_start - timedelta(days=rng.randint(1, HISTORY_DAYS))
+        order = Order(
+            order_id=order_id,
+            customer_id=customer_id,
+            customer_mobile=f"9{customer_id:09d}",
+            delivery_time=delivered + timedelta(seconds=rng.randrange(86400)),
+        )
+        yield order, rng.sample(CATEGORIES, rng.choice([1, 1, 2, 3]))
+
+
+def past_surveys(order, categories, rng, now):
+    # Surveys sent 30 days after delivery for orders old enough
+    sent_date = order.delivery_time + timedelta(days=30)
+    if sent_date >= now or rng.random() >= SURVEYED_SHARE:
+        return []
+    survey_id = rng.choice(list(SURVEY_FORMS))
+    return [
+        NPSSurveyCustomer(
+            customer_id=order.customer_id,
+            customer_mobile=order.customer_mobile,
+            sent_date=sent_date,
+            product_category=category,
+            survey_id=survey_id,
+            order_id=order.order_id,
+            utm_parameter=f"utm={order.customer_id}",
+            survey_filled=rng.random() < FILLED_SHARE,
+        )
+        for category in categories
+        if category not in EXCLUDED_CATEGORIES
+    ]
+
+
+def generate_history(count, seed=0, run_date=None):
+    """
+    Fill the database with ``count`` synthetic orders, their items and the
+    surveys already sent for them, then rebuild the customer state table.
+    Returns the number of orders delivered on the day send_surveys
+    processes on ``run_date``.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    run_date = run_date or now.date()
+    target_day = delivery_day(run_date)
+
+    orders, items, surveys = [], [], []
+    target_orders = 0
+
+    def flush():
+        with transaction.atomic():
+            Order.objects.bulk_create(orders, batch_size=INSERT_BATCH_SIZE)
+            OrderItem.objects.bulk_create(items, batch_size=INSERT_BATCH_SIZE)
+            NPSSurveyCustomer.objects.bulk_create(surveys, batch_size=INSERT_BATCH_SIZE)
+        orders.clear()
+        items.clear()
+        surveys.clear()
+
+    for order, categories in synthetic_orders(count, rng, run_date):
+        orders.append(order)
+        items.extend(
+            OrderItem(order_id_id=order.order_id, product_category=category)
+            for category in categories
+        )
+        if timezone.localdate(order.delivery_time) == target_day:
+            target_orders += 1
+        else:
+            surveys.extend(past_surveys(order, categories, rng, now))
+        if len(orders) >= INSERT_BATCH_SIZE:
+            flush()
+    flush()
+
+    rebuild_customer_states()
+    return target_orders
+
+
+def webhook_payload(survey, rng=random):
+    """
+    A Typeform ``form_response`` webhook body answering ``survey``, shaped
+    like the deliveries of the V1 and V2 forms.
+    """
+    form_id, survey_type = SURVEY_FORMS[survey.survey_id]
+    token = uuid.UUID(int=rng.getrandbits(128)).hex
+    answers = [
+        {
+            "type": "number",
+            "number": rng.randint(0, 10),
+            "field": {"id": NPS_QUESTION_ID, "type": "opinion_scale"},
+        },
+        {
+            "type": "number",
+            "number": rng.randint(0, 10),
+            "field": {"id": "KW2jgYqWNMCG", "type": "opinion_scale"},
+        },
+        {
+            "type": "text",
+            "text": rng.choice(COMMENTS),
+            "field": {"id": "OculzI47RCHJ", "type": "long_text"},
+        },
+    ]
+    if survey.survey_id == 1:
+        answers += [
+            {
+                "type": "choice",
+                "choice": {"label": rng.choice(AGE_GROUPS)},
+                "field": {"id": AGE_QUESTION_ID, "type": "multiple_choice"},
+            },
+            {
+                "type": "choice",
+                "choice": {"label": rng.choice(GENDERS)},
+                "field": {"id": GENDER_QUESTION_ID, "type": "dropdown"},
+            },
+        ]
+    submitted_at = timezone.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "event_id": token.upper()[:26],
+        "event_type": "form_response",
+        "form_response": {
+            "form_id": form_id,
+            "token": token,
+            "landed_at": submitted_at,
+            "submitted_at": submitted_at,
+            "hidden": {
+                "customer_id": str(survey.customer_id),
+                "product_category": survey.product_category,
+                "nps_survey_id": str(survey.nps_survey_id),
+            },
+            "definition": {"id": form_id, "title": f"Survey - {survey_type}"},
+            "answers": answers,
+        },
+    }
@@ -1,11 +1,109 @@
-from django.test import TestCase
+import csv
+from django.db import (
+    DatabaseError,
+    IntegrityError,
+    OperationalError,
+    connection,
+    connections,
+    router,
+)
+import os
+import shutil
+from io import StringIO
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.test import (
+    LiveServerTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.db.migrations.executor import MigrationExecutor
 from django.utils import timezone
 from datetime import timedelta
-from .models import Order, OrderItem, NPSSurveyCustomer, NPSSurveyPrimaryResponse
-from django.urls import reverse
+from .models import (
+    Order,
+    OrderItem,
+    NPSScoreRollup,
+    NPSSurveyCustomer,
+    NPSSurveyCustomerState,
+    NPSSurveyPrimaryResponse,
+    NPSSurveyQuestionResponse,
+    NPSSurveyQuestions,
+    SurveyAnswerField,
+    SurveyBatch,
+    SurveyJobCheckpoint,
+    SurveyJobLock,
+)
+from .eligibility import (
+    ELIGIBLE,
+    EXCLUDED_CATEGORY,
+    EXCLUDED_COOLDOWN,
+    EXCLUDED_UNFILLED,
+    SurveyDecision,
+    delivered_on,
+    evaluate_orders,
+    order_chunks,
+)
+from . import metrics
+from .ingest import drain, webhook_queue
+from .loadtest import DUPLICATES, RETRY_STORM, FakeTypeform, run_load_test
+from .jobs import GENERATION_LOCK, LOCK_TIMEOUT, JobLock
+from .issuance import CSV_FIELDS, allocate_survey_ids, issue_surveys
+from .pagination import EstimatedCountPaginator
+from .profiling import save_profile
+from .responses import parse_survey_response, recent_deliveries
+from .answers import answer_rows
+from .batches import generate_batch
+from .dispatch import (
+    FakeProvider,
+    HTTPProvider,
+    Message,
+    ProviderError,
+    TokenBucket,
+    dispatch_surveys,
+)
+from .benchmarks import (
+    FULL_ENTRY,
+    WEBHOOK_ENTRY,
+    check_results,
+    measure_startup,
+    run_scale,
+)
+from .rollup import rebuild_rollup
+from .routers import read_replica
+from .state import reconcile_survey_filled, record_sent
+from .synthetic import generate_history, webhook_payload
+from .wal import WebhookLog, read_log_segment, webhook_log
+from django.urls import NoReverseMatch, reverse
+from product_survey.databases import postgres_database, sqlite_database
+from collections import Counter
 import json
+import time
 
+# Generated survey batches of every test go here
+BATCH_DIR = tempfile.mkdtemp()
+# So is the raw webhook log
+WEBHOOK_LOG_DIR = tempfile.mkdtemp()
+webhook_log_settings = override_settings(SURVEY_WEBHOOK_LOG_DIR=WEBHOOK_LOG_DIR)
 
+
+def setUpModule():
+    webhook_log_settings.enable()
+
+
+def tearDownModule():
+    webhook_log_settings.disable()
+    shutil.rmtree(BATCH_DIR)
+    shutil.rmtree(WEBHOOK_LOG_DIR)
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
 class NPSSurveyTestCase(TestCase):
 
     def setUp(self):
@@ -50,15 +148,15 @@ class NPSSurveyTestCase(TestCase):
 
         # Check if the response is a valid CSV
         self.assertEqual(response.status_code, 200)
-        self.assertIn("lepa", response.content.decode("utf-8"))
+        self.assertIn("lepa", response.getvalue().decode("utf-8"))
 
         # Ensure 'Netraa' category was excluded
-        self.assertNotIn("Netraa", response.content.decode("utf-8"))
+        self.assertNotIn("Netraa", response.getvalue().decode("utf-8"))
 
     def test_survey_version_selection(self):
         # Verify the correct version of the survey is selected
         response = self.client.get(reverse("send_surveys"))
-        content = response.content.decode("utf-8")
+        content = response.getvalue().decode("utf-8")
 
         # If a V1 survey has been filled before, V2 should be sent next
         self.assertIn("V2", content)
@@ -388,7 +486,1920 @@ class NPSSurveyTestCase(TestCase):
         )
 
         response = self.client.get(reverse("send_surveys"))
-        content = response.content.decode("utf-8")
+        content = response.getvalue().decode("utf-8")
 
         # Customer 102 should be excluded because they haven't filled the last 3 surveys
         self.assertNotIn("ubtan", content)
+
+
+class SurveyEligibilityTestCase(TestCase):
+
+    def create_order(self, order_id, customer_id, categories, days=30):
+        order = Order.objects.create(
+            order_id=order_id,
+            customer_id=customer_id,
+            customer_mobile=f"99{customer_id:08d}",
+            delivery_time=timezone.now() - timedelta(days=days),
+        )
+        for category in categories:
+            OrderItem.objects.create(order_id=order, product_category=category)
+        return order
+
+    def test_query_count_does_not_grow_with_orders(self):
+        for order_id in range(1, 4):
+            self.create_order(order_id, 200 + order_id, ["lepa"])
+        orders = Order.objects.all()
+        with self.assertNumQueries(3):
+            decisions = list(evaluate_orders(orders, timezone.now().date()))
+        self.assertEqual(len(decisions), 3)
+
+        for order_id in range(4, 40):
+            self.create_order(order_id, 200 + order_id, ["lepa", "ubtan"])
+        with self.assertNumQueries(3):
+            decisions = list(evaluate_orders(orders, timezone.now().date()))
+        self.assertEqual(len(decisions), 39)
+
+    def test_rules_per_order(self):
+        # Customer 301 has two orders: only the first one is surveyed
+        self.create_order(1, 301, ["lepa"])
+        self.create_order(2, 301, ["ubtan"])
+        # Customer 302 orders an excluded category first, then an eligible one
+        self.create_order(3, 302, ["Conditioner", "lepa"])
+        self.create_order(4, 302, ["ubtan"])
+        # Customer 303 has three unfilled surveys outside the cooldown window
+        self.create_order(5, 303, ["lepa"])
+        for order_id in range(3):
+            NPSSurveyCustomer.objects.create(
+                customer_id=303,
+                customer_mobile="9900000303",
+                sent_date=timezone.now() - timedelta(days=200),
+                product_category="lepa",
+                survey_id=1,
+                order_id=order_id,
+                utm_parameter="utm=303",
+            )
+
+        decisions = {
+            d.order_id: d
+            for d in evaluate_orders(
+                Order.objects.all(), timezone.now().date() - timedelta(days=90)
+            )
+        }
+        self.assertEqual(decisions[1].outcome, ELIGIBLE)
+        self.assertEqual(decisions[1].survey_id, 1)
+        self.assertEqual(decisions[2].outcome, EXCLUDED_COOLDOWN)
+        self.assertEqual(decisions[3].outcome, EXCLUDED_CATEGORY)
+        self.assertEqual(decisions[4].outcome, ELIGIBLE)
+        self.assertEqual(decisions[5].outcome, EXCLUDED_UNFILLED)
+        self.assertEqual(decisions[5].survey_id, 2)
+
+
+class SurveyIssuanceTestCase(TestCase):
+
+    def test_allocated_ids_are_not_reused(self):
+        first = allocate_survey_ids(5)
+        second = allocate_survey_ids(3)
+        self.assertEqual(len(set(first + second)), 8)
+        self.assertGreater(min(second), max(first))
+
+        # Rows inserted the normal way never collide with a reserved block
+        survey = NPSSurveyCustomer.objects.create(
+            customer_id=1,
+            customer_mobile="1",
+            sent_date=timezone.now(),
+            product_category="lepa",
+            survey_id=1,
+            order_id=1,
+            utm_parameter="utm=1",
+        )
+        self.assertGreater(survey.nps_survey_id, max(second))
+
+    def test_survey_links_carry_inserted_ids(self):
+        for order_id in range(1, 6):
+            order = Order.objects.create(
+                order_id=order_id,
+                customer_id=400 + order_id,
+                customer_mobile="9876543210",
+                delivery_time=timezone.now() - timedelta(days=30),
+            )
+            OrderItem.objects.create(order_id=order, product_category="lepa")
+            OrderItem.objects.create(order_id=order, product_category="ubtan")
+
+        decisions = evaluate_orders(Order.objects.all(), timezone.now().date())
+        with CaptureQueriesContext(connection) as queries:
+            rows = issue_surveys(decisions)
+        inserts = [
+            q
+            for q in queries
+            if q["sql"].startswith('INSERT INTO "survey_npssurveycustomer"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertEqual(len(rows), 10)
+        for row in rows:
+            nps_survey_id = int(row["survey_link"].rsplit("=", 1)[1])
+            survey = NPSSurveyCustomer.objects.get(nps_survey_id=nps_survey_id)
+            self.assertEqual(survey.customer_id, row["customer_id"])
+            self.assertEqual(survey.product_category, row["product_category"])
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
+class StreamingSurveysTestCase(TestCase):
+
+    def setUp(self):
+        for order_id in range(1, 8):
+            order = Order.objects.create(
+                order_id=order_id,
+                # Customer 501 has orders 1 and 7 on the same day
+                customer_id=500 + (order_id % 6),
+                customer_mobile="9876543210",
+                delivery_time=timezone.now() - timedelta(days=30),
+            )
+            OrderItem.objects.create(order_id=order, product_category="lepa")
+
+    def test_order_chunks(self):
+        chunks = [
+            sorted(chunk.values_list("order_id", flat=True))
+            for chunk in order_chunks(Order.objects.all(), chunk_size=3)
+        ]
+        self.assertEqual(chunks, [[1, 2, 3], [4, 5, 6], [7]])
+
+    def test_streamed_csv(self):
+        response = self.client.get(reverse("send_surveys"), {"stream": 1})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+
+        self.assertEqual(lines[0], ",".join(CSV_FIELDS))
+        # One survey per customer, the repeat order falls in the cooldown
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 6)
+
+    def test_abandoned_stream_releases_the_lock(self):
+        response = self.client.get(reverse("send_surveys"), {"stream": 1})
+        # The client went away before the first chunk was read
+        response.close()
+        response.close()
+        self.assertEqual(self.client.get(reverse("send_surveys")).status_code, 200)
+
+
+@skipUnless(connection.vendor == "sqlite", "Plans are checked on SQLite")
+class QueryPlanTestCase(TestCase):
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(f"INDEX {index_name}", queryset.explain())
+
+    def test_delivery_date_lookup(self):
+        orders = delivered_on(timezone.now().date())
+        self.assertUsesIndex(orders, "order_delivery_idx")
+
+    def test_customer_history_lookups(self):
+        surveys = NPSSurveyCustomer.objects.filter(customer_id=1)
+        self.assertUsesIndex(
+            surveys.filter(sent_date__gte=timezone.now()), "nps_customer_sent_idx"
+        )
+        self.assertUsesIndex(
+            surveys.filter(survey_filled=False), "nps_customer_filled_idx"
+        )
+        self.assertUsesIndex(
+            surveys.filter(survey_id=1, product_category="lepa"),
+            "nps_customer_survey_idx",
+        )
+
+    def test_question_response_lookup(self):
+        responses = NPSSurveyQuestionResponse.objects.filter(nps_survey_id="1")
+        self.assertUsesIndex(responses, "nps_response_survey_idx")
+
+
+def typeform_payload(nps_survey_id, form_id="bXFb9h7f", customer_id="8", score=9):
+    return {
+        "event_id": f"event-{nps_survey_id}",
+        "event_type": "form_response",
+        "form_response": {
+            "form_id": form_id,
+            "token": f"token-{nps_survey_id}",
+            "hidden": {
+                "customer_id": customer_id,
+                "product_category": "lepa",
+                "nps_survey_id": str(nps_survey_id),
+            },
+            "answers": [
+                {
+                    "type": "number",
+                    "number": score,
+                    "field": {"id": "1q9jwqqMvbvP", "type": "opinion_scale"},
+                },
+                {
+                    "type": "text",
+                    "text": "Lovely",
+                    "field": {"id": "OculzI47RCHJ", "type": "long_text"},
+                },
+            ],
+        },
+    }
+
+
+class ReceiveSurveyResponseTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+
+    def create_survey(self, days):
+        return NPSSurveyCustomer.objects.create(
+            customer_id=8,
+            customer_mobile="1234567890",
+            sent_date=timezone.now() - timedelta(days=days),
+            product_category="lepa",
+            survey_id=2,
+            order_id=days,
+            utm_parameter="utm=8",
+        )
+
+    def post(self, payload):
+        return self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_marks_the_answered_survey_filled(self):
+        older = self.create_survey(days=200)
+        newer = self.create_survey(days=100)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(typeform_payload(newer.nps_survey_id))
+        self.assertEqual(response.status_code, 200)
+
+        # Primary response, answers, rollup, the survey and the customer state
+        writes = [q for q in queries if q["sql"].startswith(("INSERT", "UPDATE"))]
+        self.assertEqual(len(writes), 5)
+        older.refresh_from_db()
+        newer.refresh_from_db()
+        self.assertFalse(older.survey_filled)
+        self.assertTrue(newer.survey_filled)
+        self.assertEqual(
+            NPSSurveyQuestionResponse.objects.filter(
+                nps_survey_id=str(newer.nps_survey_id)
+            ).count(),
+            2,
+        )
+
+    def test_answers_are_written_atomically(self):
+        payload = typeform_payload(1)
+        # An answer without a field id cannot be stored
+        payload["form_response"]["answers"].append(
+            {"type": "text", "text": "x", "field": {"id": None}}
+        )
+        with self.assertRaises(IntegrityError):
+            self.post(payload)
+        self.assertFalse(NPSSurveyPrimaryResponse.objects.exists())
+
+
+class QueuedSurveyResponseTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        self.queue_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.queue_dir)
+        overrides = override_settings(
+            SURVEY_QUEUE_DIR=self.queue_dir, SURVEY_QUEUE_MAX_DEPTH=2
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def post(self, payload):
+        return self.client.post(
+            reverse("queue_survey_response"),
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_queued_payloads_are_drained(self):
+        survey = NPSSurveyCustomer.objects.create(
+            customer_id=8,
+            customer_mobile="1234567890",
+            sent_date=timezone.now(),
+            product_category="lepa",
+            survey_id=2,
+            order_id=1,
+            utm_parameter="utm=8",
+        )
+        self.assertEqual(
+            self.post(typeform_payload(survey.nps_survey_id)).status_code, 200
+        )
+        self.assertEqual(self.post(typeform_payload("x1")).status_code, 200)
+        self.assertFalse(NPSSurveyPrimaryResponse.objects.exists())
+        self.assertEqual(webhook_queue().depth(), 2)
+
+        self.assertEqual(drain(webhook_queue(), batch_size=10), 2)
+        self.assertEqual(webhook_queue().depth(), 0)
+        self.assertEqual(NPSSurveyPrimaryResponse.objects.count(), 2)
+        survey.refresh_from_db()
+        self.assertTrue(survey.survey_filled)
+
+    def test_full_queue_is_refused(self):
+        self.post(typeform_payload(1))
+        self.post(typeform_payload(2))
+        response = self.post(typeform_payload(3))
+        self.assertEqual(response.status_code, 429)
+
+        content = self.client.get(reverse("metrics")).content.decode("utf-8")
+        self.assertIn("survey_queue_depth 2", content)
+
+    def test_bad_payload_does_not_block_the_batch(self):
+        self.post({"form_response": None})
+        self.post(typeform_payload(1))
+        drain(webhook_queue(), batch_size=10)
+        self.assertEqual(NPSSurveyPrimaryResponse.objects.count(), 1)
+        self.assertEqual(len(os.listdir(webhook_queue().failed)), 1)
+
+    def test_database_errors_leave_payloads_queued(self):
+        self.post(typeform_payload(1))
+        self.post(typeform_payload(2))
+        queue = webhook_queue()
+        locked = OperationalError("database is locked")
+        with patch("survey.ingest.record_survey_responses", side_effect=locked):
+            with self.assertRaises(OperationalError):
+                drain(queue, batch_size=10)
+        self.assertEqual(queue.depth(), 2)
+
+        # One by one after a failed batch, only the bad payload is parked
+        errors = [IntegrityError("bad"), locked, IntegrityError("bad")]
+        with patch("survey.ingest.record_survey_responses", side_effect=errors):
+            self.assertEqual(drain(queue, batch_size=10), 1)
+        self.assertEqual(queue.depth(), 1)
+        self.assertEqual(len(os.listdir(queue.failed)), 1)
+
+    def test_scrape_does_not_create_the_queue(self):
+        queue_dir = os.path.join(self.queue_dir, "missing")
+        with override_settings(SURVEY_QUEUE_DIR=queue_dir):
+            content = self.client.get(reverse("metrics")).content.decode("utf-8")
+        self.assertIn("survey_queue_depth 0", content)
+        self.assertFalse(os.path.exists(queue_dir))
+
+
+class DuplicateDeliveryTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+
+    def post(self, payload):
+        return self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+
+    def test_retry_is_answered_from_the_cache(self):
+        payload = typeform_payload(1)
+        self.assertEqual(self.post(payload).json(), {"status": "success"})
+
+        before = metrics.get("survey_webhook_duplicates_total", source="cache")
+        with self.assertNumQueries(0):
+            response = self.post(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "duplicate"})
+        self.assertEqual(
+            metrics.get("survey_webhook_duplicates_total", source="cache"), before + 1
+        )
+        self.assertEqual(NPSSurveyQuestionResponse.objects.count(), 2)
+
+    def test_retry_is_detected_by_the_database(self):
+        payload = typeform_payload(1)
+        self.post(payload)
+        # Another worker process has not seen this delivery
+        recent_deliveries.clear()
+
+        before = metrics.get("survey_webhook_duplicates_total", source="database")
+        self.assertEqual(self.post(payload).json(), {"status": "duplicate"})
+        self.assertEqual(
+            metrics.get("survey_webhook_duplicates_total", source="database"),
+            before + 1,
+        )
+        self.assertEqual(NPSSurveyPrimaryResponse.objects.count(), 1)
+        self.assertEqual(NPSSurveyQuestionResponse.objects.count(), 2)
+
+    def test_resubmission_of_an_answered_survey(self):
+        self.post(typeform_payload(1))
+        # The respondent submitted the same survey link again
+        payload = typeform_payload(1, score=3)
+        payload["form_response"]["token"] = "token-resubmitted"
+
+        before = metrics.get("survey_webhook_duplicates_total", source="survey")
+        response = self.post(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "duplicate"})
+        self.assertEqual(
+            metrics.get("survey_webhook_duplicates_total", source="survey"),
+            before + 1,
+        )
+        self.assertEqual(
+            NPSSurveyPrimaryResponse.objects.get().response_token, "token-1"
+        )
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
+class CustomerSurveyStateTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        order = Order.objects.create(
+            order_id=1,
+            customer_id=601,
+            customer_mobile="9876543210",
+            delivery_time=timezone.now() - timedelta(days=30),
+        )
+        OrderItem.objects.create(order_id=order, product_category="lepa")
+        OrderItem.objects.create(order_id=order, product_category="ubtan")
+        NPSSurveyCustomer.objects.create(
+            customer_id=601,
+            customer_mobile="9876543210",
+            sent_date=timezone.now() - timedelta(days=120),
+            product_category="lepa",
+            survey_id=1,
+            order_id=0,
+            utm_parameter="utm=601",
+        )
+
+    def state_values(self):
+        return list(
+            NPSSurveyCustomerState.objects.values(
+                "customer_id", "last_sent_date", "unfilled_count", "survey_versions"
+            )
+        )
+
+    def test_state_follows_sends_and_fills(self):
+        state = NPSSurveyCustomerState.objects.get(customer_id=601)
+        self.assertEqual(state.unfilled_count, 1)
+        self.assertEqual(state.survey_versions, 1)
+
+        self.client.get(reverse("send_surveys"))
+        state.refresh_from_db()
+        self.assertEqual(state.unfilled_count, 3)
+        self.assertEqual(state.survey_versions, 3)
+        self.assertGreater(state.last_sent_date, timezone.now() - timedelta(days=1))
+
+        survey = NPSSurveyCustomer.objects.filter(customer_id=601).latest("pk")
+        payload = typeform_payload(survey.nps_survey_id, customer_id="601")
+        for _ in range(2):
+            self.client.post(
+                reverse("receive_survey_response"),
+                data=json.dumps(payload),
+                content_type="application/json",
+            )
+        state.refresh_from_db()
+        self.assertEqual(state.unfilled_count, 2)
+        self.assertIsNotNone(state.last_filled_date)
+
+    def test_sends_add_onto_the_stored_state(self):
+        # A fill committed since the state was last read is kept
+        NPSSurveyCustomerState.objects.filter(customer_id=601).update(unfilled_count=0)
+        older = NPSSurveyCustomer(
+            customer_id=601,
+            sent_date=timezone.now() - timedelta(days=200),
+            survey_filled=False,
+            survey_id=2,
+        )
+        record_sent([older])
+        state = NPSSurveyCustomerState.objects.get(customer_id=601)
+        self.assertEqual(state.unfilled_count, 1)
+        self.assertEqual(state.survey_versions, 3)
+        self.assertLess(state.last_sent_date, timezone.now() - timedelta(days=119))
+
+        record_sent(
+            [NPSSurveyCustomer(customer_id=602, sent_date=timezone.now(), survey_id=1)]
+        )
+        state = NPSSurveyCustomerState.objects.get(customer_id=602)
+        self.assertEqual((state.unfilled_count, state.survey_versions), (1, 1))
+
+    def test_rebuild_matches_incremental_state(self):
+        self.client.get(reverse("send_surveys"))
+        incremental = self.state_values()
+
+        NPSSurveyCustomerState.objects.all().delete()
+        call_command("rebuild_survey_state", stdout=StringIO())
+        self.assertEqual(self.state_values(), incremental)
+
+    def test_eligibility_reads_only_the_state(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(evaluate_orders(Order.objects.all(), timezone.now().date()))
+        history = [q for q in queries if '"survey_npssurveycustomer"' in q["sql"]]
+        self.assertEqual(history, [])
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
+class GenerateSurveysCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        for order_id in range(1, 7):
+            order = Order.objects.create(
+                order_id=order_id,
+                customer_id=700 + order_id,
+                customer_mobile="9876543210",
+                delivery_time=timezone.now() - timedelta(days=30),
+            )
+            OrderItem.objects.create(order_id=order, product_category="lepa")
+
+    def generate(self):
+        call_command(
+            "generate_surveys",
+            shards=2,
+            chunk_size=2,
+            output=self.output_dir,
+            stdout=StringIO(),
+        )
+        run_date = timezone.now().date()
+        with open(os.path.join(self.output_dir, f"surveys-{run_date}.csv")) as f:
+            return f.read().splitlines()
+
+    def test_generates_every_shard(self):
+        lines = self.generate()
+        self.assertEqual(lines[0], ",".join(CSV_FIELDS))
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 6)
+
+        # A finished run does not issue anything again
+        self.assertEqual(len(self.generate()), 7)
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 6)
+
+    def test_resumes_after_a_crash(self):
+        calls = []
+
+        def crash_on_second_chunk(decisions):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return issue_surveys(decisions)
+
+        with patch("survey.generation.issue_surveys", crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.generate()
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 2)
+
+        lines = self.generate()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 6)
+        links = [line.rsplit("=", 1)[1] for line in lines[1:]]
+        self.assertEqual(
+            sorted(int(link) for link in links),
+            sorted(NPSSurveyCustomer.objects.values_list("nps_survey_id", flat=True)),
+        )
+
+    def test_unfinished_run_is_finished_by_the_same_layout(self):
+        def crash_on_second_chunk(decisions, calls=[]):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return issue_surveys(decisions)
+
+        with patch("survey.generation.issue_surveys", crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.generate()
+
+        # Surveys the crashed run issued are only listed in its files
+        response = self.client.get(reverse("send_surveys"))
+        self.assertEqual(response.status_code, 409)
+        self.assertIn(self.output_dir, response.json()["error"])
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 2)
+        with self.assertRaises(CommandError):
+            call_command("generate_surveys", output=self.output_dir, stdout=StringIO())
+        other_dir = os.path.join(self.output_dir, "other")
+        with self.assertRaises(CommandError):
+            call_command(
+                "generate_surveys", shards=2, output=other_dir, stdout=StringIO()
+            )
+
+        self.assertEqual(len(self.generate()), 7)
+
+    def test_shortened_file_is_not_padded(self):
+        def crash_on_second_chunk(decisions, calls=[]):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("worker died")
+            return issue_surveys(decisions)
+
+        with patch("survey.generation.issue_surveys", crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.generate()
+        for name in os.listdir(self.output_dir):
+            os.remove(os.path.join(self.output_dir, name))
+        with self.assertRaisesMessage(CommandError, "shorter than its checkpoint"):
+            self.generate()
+
+    def test_lock_is_kept_past_the_timeout(self):
+        taken_over = []
+
+        def slow_issue(decisions):
+            taken_over.append(JobLock(GENERATION_LOCK).acquire())
+            # This chunk ran for longer than the lock timeout
+            SurveyJobLock.objects.update(
+                acquired_at=timezone.now() - LOCK_TIMEOUT - timedelta(minutes=1)
+            )
+            return issue_surveys(decisions)
+
+        with patch("survey.generation.issue_surveys", slow_issue):
+            self.generate()
+        self.assertGreater(len(taken_over), 1)
+        self.assertEqual(set(taken_over), {False})
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 6)
+
+    def test_run_stops_when_its_lock_is_taken_over(self):
+        def stale_issue(decisions):
+            SurveyJobLock.objects.all().delete()
+            JobLock(GENERATION_LOCK).acquire()
+            return issue_surveys(decisions)
+
+        with patch("survey.generation.issue_surveys", stale_issue):
+            with self.assertRaisesMessage(CommandError, "took over the lock"):
+                self.generate()
+        # Only the chunk committed before the takeover was issued
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 2)
+
+    def test_concurrent_runs_are_refused(self):
+        with JobLock(GENERATION_LOCK):
+            with self.assertRaises(CommandError):
+                self.generate()
+            response = self.client.get(reverse("send_surveys"))
+            self.assertEqual(response.status_code, 409)
+        self.assertFalse(NPSSurveyCustomer.objects.exists())
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
+class SurveyBatchTestCase(TestCase):
+
+    def setUp(self):
+        order = Order.objects.create(
+            order_id=1,
+            customer_id=801,
+            customer_mobile="9876543210",
+            delivery_time=timezone.now() - timedelta(days=30),
+        )
+        OrderItem.objects.create(order_id=order, product_category="lepa")
+
+    def test_batch_is_generated_once(self):
+        first = self.client.get(reverse("send_surveys"))
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header("ETag"))
+        content = first.getvalue()
+        self.assertEqual(len(content.splitlines()), 2)
+
+        with self.assertNumQueries(1):
+            second = self.client.get(reverse("send_surveys"))
+            self.assertEqual(second.getvalue(), content)
+        self.assertEqual(NPSSurveyCustomer.objects.count(), 1)
+        batch = SurveyBatch.objects.get()
+        self.assertEqual(batch.row_count, 1)
+
+    def test_conditional_download(self):
+        etag = self.client.get(reverse("send_surveys"))["ETag"]
+        response = self.client.get(reverse("send_surveys"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_streamed_batch_is_stored(self):
+        response = self.client.get(reverse("send_surveys"), {"stream": 1})
+        streamed = b"".join(response.streaming_content)
+        self.assertEqual(self.client.get(reverse("send_surveys")).getvalue(), streamed)
+
+    def test_run_crossing_midnight(self):
+        tomorrow = patch(
+            "survey.views.timezone.now",
+            return_value=timezone.now() + timedelta(days=1),
+        )
+        self.addCleanup(tomorrow.stop)
+
+        def generate_until_midnight(run_date, lock=None):
+            yield from generate_batch(run_date, lock)
+            tomorrow.start()
+
+        with patch("survey.views.generate_batch", generate_until_midnight):
+            response = self.client.get(reverse("send_surveys"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.getvalue().splitlines()), 2)
+
+
+class SurveyAdminTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.force_login(user)
+
+    def create_responses(self, count):
+        start = NPSSurveyPrimaryResponse.objects.count()
+        for n in range(start, start + count):
+            nps_survey_id = f"survey-{n}"
+            NPSSurveyPrimaryResponse.objects.create(
+                nps_survey_id=nps_survey_id, customer_id=900 + n
+            )
+            NPSSurveyQuestionResponse.objects.create(
+                nps_survey_id=nps_survey_id, question_id="1q9jwqqMvbvP", response="9"
+            )
+
+    def changelist_queries(self):
+        url = reverse("admin:survey_npssurveyquestionresponse_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.content.decode("utf-8")
+
+    def test_customer_column_does_not_query_per_row(self):
+        self.create_responses(2)
+        few, _ = self.changelist_queries()
+        self.create_responses(20)
+        cache.clear()
+        many, content = self.changelist_queries()
+        self.assertEqual(few, many)
+        self.assertIn('">921</a></th>', content)
+
+    def test_seek_pages_match_offset_pages(self):
+        self.create_responses(25)
+        responses = NPSSurveyQuestionResponse.objects.order_by("-pk")
+        paginator = EstimatedCountPaginator(responses, 10)
+        self.assertEqual(paginator.count, 25)
+        for number in (1, 2, 3):
+            offset = list(responses[(number - 1) * 10 : number * 10])
+            self.assertEqual(list(paginator.page(number)), offset)
+
+    def test_next_page_is_read_by_key(self):
+        self.create_responses(25)
+        cache.clear()
+        responses = NPSSurveyQuestionResponse.objects.order_by("-pk")
+        paginator = EstimatedCountPaginator(responses, 10)
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(3)
+        self.assertIn("OFFSET", queries[-1]["sql"] + queries[-2]["sql"])
+
+        paginator.page(1)
+        with CaptureQueriesContext(connection) as queries:
+            page = paginator.page(2)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("OFFSET", queries[0]["sql"])
+        self.assertEqual(list(page), list(responses[10:20]))
+
+
+class NPSRollupTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        self.today = timezone.localdate()
+        decisions = [
+            SurveyDecision(
+                order_id=n,
+                customer_id=100 + n,
+                customer_mobile="1234567890",
+                product_categories=["lepa"],
+                outcome=ELIGIBLE,
+                survey_id=2,
+            )
+            for n in range(4)
+        ]
+        issue_surveys(decisions)
+        self.surveys = list(NPSSurveyCustomer.objects.order_by("nps_survey_id"))
+
+    def answer(self, survey, score):
+        return self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(
+                typeform_payload(
+                    survey.nps_survey_id,
+                    customer_id=str(survey.customer_id),
+                    score=score,
+                )
+            ),
+            content_type="application/json",
+        )
+
+    def rollup(self):
+        return list(
+            NPSScoreRollup.objects.values_list(
+                "survey_id",
+                "product_category",
+                "day",
+                "sent_count",
+                "response_count",
+                "promoters",
+                "passives",
+                "detractors",
+            )
+        )
+
+    def test_sends_and_responses_update_rollup(self):
+        for survey, score in zip(self.surveys, [10, 9, 3]):
+            self.answer(survey, score)
+        self.answer(self.surveys[0], 10)
+        self.assertEqual(self.rollup(), [(2, "lepa", self.today, 4, 3, 2, 0, 1)])
+
+    def test_rebuild_matches_incremental(self):
+        for survey, score in zip(self.surveys, [10, 7, 2]):
+            self.answer(survey, score)
+        # Answers no sent survey, so neither path counts it
+        self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(typeform_payload(99999, score=10)),
+            content_type="application/json",
+        )
+        incremental = self.rollup()
+        self.assertEqual(incremental, [(2, "lepa", self.today, 4, 3, 1, 1, 1)])
+        NPSScoreRollup.objects.all().delete()
+        self.assertEqual(rebuild_rollup(chunk_size=2), 1)
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_nps_endpoint(self):
+        for survey, score in zip(self.surveys, [10, 9, 3]):
+            self.answer(survey, score)
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("nps_scores"),
+                {"start": self.today.isoformat(), "group_by": "product_category"},
+            )
+        data = response.json()
+        self.assertEqual(data["total"]["nps"], 33.3)
+        self.assertEqual(data["total"]["response_rate"], 0.75)
+        self.assertEqual(data["groups"][0]["product_category"], "lepa")
+
+        response = self.client.get(reverse("nps_scores"), {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportOrdersCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def import_orders(self, path, *args):
+        out = StringIO()
+        call_command("import_orders", path, *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def items(self):
+        return list(
+            OrderItem.objects.order_by("order_id", "product_category").values_list(
+                "order_id", "product_category"
+            )
+        )
+
+    def test_csv_upserts_orders_and_replaces_items(self):
+        header = "order_id,customer_id,customer_mobile,delivery_time,product_category\n"
+        path = self.write(
+            "orders.csv",
+            header
+            + "1,10,9000000001,2024-08-01T10:00:00,lepa\n"
+            + "1,10,9000000001,2024-08-01T10:00:00,Tikta\n"
+            + "2,20,9000000002,2024-08-01T11:00:00,Netraa\n"
+            + "3,30,9000000003,2024-08-02T09:00:00+05:30,lepa\n",
+        )
+        output = self.import_orders(path, "--batch-size", "2")
+        self.assertIn("rows/sec", output)
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(
+            self.items(), [(1, "Tikta"), (1, "lepa"), (2, "Netraa"), (3, "lepa")]
+        )
+
+        path = self.write(
+            "update.csv",
+            header + "1,11,9000000009,2024-08-01T10:00:00,Conditioner\n",
+        )
+        self.import_orders(path)
+        order = Order.objects.get(order_id=1)
+        self.assertEqual((order.customer_id, order.customer_mobile), (11, "9000000009"))
+        self.assertEqual(self.items(), [(1, "Conditioner"), (2, "Netraa"), (3, "lepa")])
+
+    def test_incremental_import_skips_orders_before_watermark(self):
+        def order(order_id, day):
+            return json.dumps(
+                {
+                    "order_id": order_id,
+                    "customer_id": order_id,
+                    "customer_mobile": "9000000000",
+                    "delivery_time": f"2024-08-{day:02d}T10:00:00",
+                    "product_categories": ["lepa"],
+                }
+            )
+
+        first = self.write("first.jsonl", order(1, 1) + "\n" + order(2, 2) + "\n")
+        self.import_orders(first, "--incremental")
+        Order.objects.filter(order_id=2).update(customer_id=99)
+
+        second = self.write("second.jsonl", order(2, 2) + "\n\n" + order(3, 3) + "\n")
+        output = self.import_orders(second, "--incremental")
+        self.assertIn("1 rows before the watermark", output)
+        self.assertEqual(Order.objects.get(order_id=2).customer_id, 99)
+        self.assertTrue(Order.objects.filter(order_id=3).exists())
+
+    def test_invalid_rows(self):
+        path = self.write(
+            "orders.jsonl",
+            '{"order_id": 1, "customer_id": 1, "customer_mobile": "9000000000", '
+            '"delivery_time": "2024-08-01T10:00:00"}\n'
+            "not json\n"
+            '{"order_id": "x", "customer_id": 1}\n',
+        )
+        with self.assertRaisesMessage(CommandError, "line 2"):
+            self.import_orders(path)
+        self.assertFalse(Order.objects.exists())
+
+        output = self.import_orders(path, "--max-errors", "2")
+        self.assertIn("Skipped line 3", output)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class WebhookLogTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def replay(self, *args):
+        out = StringIO()
+        call_command("replay_webhooks", *args, "--workers", "1", stdout=out)
+        return out.getvalue()
+
+    def test_failed_webhook_can_be_replayed_from_log(self):
+        log = webhook_log()
+        log.close()
+        segments = set(log.segments())
+        payload = typeform_payload("event-lost", customer_id="8")
+
+        with patch(
+            "survey.webhook_views.record_survey_responses",
+            side_effect=DatabaseError("down"),
+        ):
+            with self.assertRaises(DatabaseError):
+                self.client.post(
+                    reverse("receive_survey_response"),
+                    data=json.dumps(payload),
+                    content_type="application/json",
+                )
+        self.assertFalse(NPSSurveyPrimaryResponse.objects.exists())
+
+        log.close()
+        (segment,) = set(log.segments()) - segments
+        self.assertEqual(list(read_log_segment(segment)), [payload])
+        output = self.replay(str(segment))
+        self.assertIn("1 stored", output)
+        self.assertTrue(
+            NPSSurveyPrimaryResponse.objects.filter(
+                response_token="token-event-lost"
+            ).exists()
+        )
+        self.assertIn("1 already stored", self.replay(str(segment)))
+
+    def test_segments_rotate_and_survive_a_torn_tail(self):
+        log = WebhookLog(self.directory, segment_bytes=300)
+        for n in range(6):
+            log.append(json.dumps(typeform_payload(n)).encode("utf-8"))
+        log.close()
+        segments = log.segments()
+        self.assertGreater(len(segments), 1)
+        replayed = [
+            payload for segment in segments for payload in read_log_segment(segment)
+        ]
+        self.assertEqual(replayed, [typeform_payload(n) for n in range(6)])
+
+        last = segments[-1]
+        data = last.read_bytes()
+        last.write_bytes(data[: len(data) - 12])
+        self.assertLessEqual(len(list(read_log_segment(last))), 1)
+
+    def test_replays_typeform_export(self):
+        items = [
+            dict(typeform_payload(n, customer_id=str(n))["form_response"])
+            for n in range(5)
+        ]
+        for item in items:
+            del item["form_id"]
+        path = os.path.join(self.directory, "export.json")
+        with open(path, "w") as f:
+            json.dump({"total_items": 5, "page_count": 1, "items": items}, f)
+
+        output = self.replay(path, "--typeform-export", "bXFb9h7f", "--batch-size", "2")
+        self.assertIn("Replayed 5 payloads", output)
+        self.assertEqual(NPSSurveyPrimaryResponse.objects.count(), 5)
+
+
+class CompactAnswerStorageTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        self.score_question = NPSSurveyQuestions.objects.create(
+            survey_id=2,
+            question_id="1q9jwqqMvbvP",
+            question_description="Rate the brand on the below scale.",
+        )
+
+    def post(self, nps_survey_id):
+        response = self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(typeform_payload(nps_survey_id, score=9)),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_compact_mode_stores_one_row_per_submission(self):
+        self.post("row-1")
+        with override_settings(SURVEY_ANSWER_STORAGE="compact"):
+            self.post("compact-1")
+
+        self.assertEqual(
+            NPSSurveyQuestionResponse.objects.filter(nps_survey_id="compact-1").count(),
+            0,
+        )
+        self.assertEqual(
+            NPSSurveyPrimaryResponse.objects.get(nps_survey_id="compact-1").answers,
+            [[self.score_code(), 9], ["OculzI47RCHJ", "Lovely"]],
+        )
+        rows = answer_rows(["row-1", "compact-1"])
+        self.assertEqual(
+            sorted(rows),
+            [
+                ("compact-1", "1q9jwqqMvbvP", "9"),
+                ("compact-1", "OculzI47RCHJ", "Lovely"),
+                ("row-1", "1q9jwqqMvbvP", "9"),
+                ("row-1", "OculzI47RCHJ", "Lovely"),
+            ],
+        )
+
+    def test_compact_answers_command_moves_stored_rows(self):
+        for n in range(3):
+            self.post(f"row-{n}")
+        before = sorted(answer_rows([f"row-{n}" for n in range(3)]))
+
+        out = StringIO()
+        call_command("compact_answers", "--chunk-size", "2", stdout=out)
+        self.assertIn("3 submissions", out.getvalue())
+        self.assertFalse(NPSSurveyQuestionResponse.objects.exists())
+        self.assertEqual(sorted(answer_rows([f"row-{n}" for n in range(3)])), before)
+        self.assertEqual(
+            NPSSurveyPrimaryResponse.objects.get(nps_survey_id="row-0").answers[0],
+            [self.score_code(), 9],
+        )
+
+    def test_only_numeric_fields_become_numbers(self):
+        NPSSurveyQuestions.objects.create(
+            survey_id=2, question_id="OculzI47RCHJ", question_description="Why?"
+        )
+        self.post("row-1")
+        NPSSurveyQuestionResponse.objects.filter(question_id="OculzI47RCHJ").update(
+            response="007"
+        )
+        call_command("compact_answers", stdout=StringIO())
+        self.assertEqual(
+            NPSSurveyPrimaryResponse.objects.get(nps_survey_id="row-1").answers,
+            [[self.score_code(), 9], [self.field_code("OculzI47RCHJ"), "007"]],
+        )
+        self.assertIn(("row-1", "OculzI47RCHJ", "007"), answer_rows(["row-1"]))
+
+    def test_codes_survive_question_edits(self):
+        with override_settings(SURVEY_ANSWER_STORAGE="compact"):
+            self.post("compact-1")
+        code = self.score_code()
+        self.score_question.delete()
+        NPSSurveyQuestions.objects.create(
+            survey_id=2,
+            question_id="1q9jwqqMvbvP",
+            question_description="Rate the brand on the below scale.",
+        )
+        self.assertEqual(self.score_code(), code)
+        self.assertIn(("compact-1", "1q9jwqqMvbvP", "9"), answer_rows(["compact-1"]))
+
+    def field_code(self, question_id):
+        return SurveyAnswerField.objects.get(question_id=question_id).code
+
+    def score_code(self):
+        return self.field_code("1q9jwqqMvbvP")
+
+
+class ExportResponsesTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for question_id in ["1q9jwqqMvbvP", "OculzI47RCHJ"]:
+            NPSSurveyQuestions.objects.create(
+                survey_id=2, question_id=question_id, question_description=question_id
+            )
+        self.surveys = []
+        for n in range(5):
+            survey = NPSSurveyCustomer.objects.create(
+                customer_id=50 + n,
+                customer_mobile="1234567890",
+                sent_date=timezone.now() - timedelta(days=30),
+                product_category="lepa" if n % 2 else "Tikta",
+                survey_id=2,
+                order_id=n,
+                utm_parameter=f"utm={50 + n}",
+            )
+            self.surveys.append(survey)
+            if n != 2:
+                self.client.post(
+                    reverse("receive_survey_response"),
+                    data=json.dumps(
+                        typeform_payload(survey.nps_survey_id, score=n + 5)
+                    ),
+                    content_type="application/json",
+                )
+        self.answered = [s.nps_survey_id for n, s in enumerate(self.surveys) if n != 2]
+
+    def export(self, **params):
+        response = self.client.get(reverse("export_responses"), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode("utf-8")
+
+    def test_csv_has_a_column_per_question(self):
+        rows = list(csv.reader(StringIO(self.export(survey_id=2))))
+        self.assertEqual(rows[0][-2:], ["1q9jwqqMvbvP", "OculzI47RCHJ"])
+        self.assertEqual([int(row[0]) for row in rows[1:]], self.answered)
+        self.assertEqual(rows[1][-2:], ["5", "Lovely"])
+
+        rows = list(csv.reader(StringIO(self.export(after=self.answered[1]))))
+        self.assertEqual([int(row[0]) for row in rows[1:]], self.answered[2:])
+
+    def test_jsonl_filters(self):
+        today = timezone.localdate().isoformat()
+        lines = self.export(format="jsonl", product_category="lepa", start=today)
+        submissions = [json.loads(line) for line in lines.splitlines()]
+        self.assertEqual(
+            [s["nps_survey_id"] for s in submissions],
+            [self.surveys[1].nps_survey_id, self.surveys[3].nps_survey_id],
+        )
+        self.assertEqual(submissions[0]["answers"]["1q9jwqqMvbvP"], "6")
+        self.assertEqual(self.export(format="jsonl", end="2020-01-01"), "")
+
+    def test_command_resumes_an_interrupted_export(self):
+        path = os.path.join(self.directory, "export.csv")
+        call_command("export_responses", path, "--page-size", "2", stdout=StringIO())
+        with open(path) as f:
+            complete = f.read()
+
+        # As if the run died after its first page and a partial second one
+        with open(path, newline="") as f:
+            first_page = "".join(f.readlines()[:3])
+        with open(path, "w", newline="") as f:
+            f.write(first_page + "partial row")
+        SurveyJobCheckpoint.objects.filter(name__startswith="export_responses:").update(
+            position={"after": self.answered[1], "bytes": len(first_page)}
+        )
+
+        out = StringIO()
+        call_command("export_responses", path, "--page-size", "2", stdout=out)
+        self.assertIn("Wrote 2 submissions", out.getvalue())
+        with open(path) as f:
+            self.assertEqual(f.read(), complete)
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_generated_history(self):
+        day_orders = generate_history(300, seed=1)
+        self.assertEqual(Order.objects.count(), 300)
+        self.assertEqual(day_orders, 30)
+        self.assertEqual(
+            delivered_on(timezone.localdate() - timedelta(days=30)).count(), 30
+        )
+        self.assertEqual(
+            NPSSurveyCustomerState.objects.count(),
+            NPSSurveyCustomer.objects.values("customer_id").distinct().count(),
+        )
+        survey = NPSSurveyCustomer.objects.filter(survey_id=1).first()
+        response = parse_survey_response(webhook_payload(survey))
+        self.assertEqual(response.nps_survey_id, str(survey.nps_survey_id))
+        self.assertIsNotNone(response.age)
+
+    def test_scales_are_compared(self):
+        small = run_scale("small", 300, BATCH_DIR, webhooks=10)
+        self.assertEqual(small.webhooks, 10)
+        self.assertGreater(small.send_queries, 0)
+        self.assertEqual(check_results([small], {"small": small._asdict()}), [])
+
+        # Twice the orders in one chunk and one query per webhook more
+        larger = small._replace(
+            scale="large",
+            orders=600,
+            send_queries=small.send_queries * 2,
+            receive_queries=small.receive_queries + 5,
+        )
+        failures = check_results([larger, small])
+        self.assertEqual(len(failures), 2)
+
+        slower = small._replace(send_seconds=small.send_seconds * 2)
+        failures = check_results([slower], {"small": small._asdict()})
+        self.assertEqual(len(failures), 1)
+        self.assertIn("send_seconds", failures[0])
+
+        failures = check_results([small], {})
+        self.assertEqual(len(failures), 1)
+        self.assertIn("no stored baseline", failures[0])
+
+
+class LoadTestHarnessTestCase(LiveServerTestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        self.url = self.live_server_url + reverse("receive_survey_response")
+
+    def test_duplicate_deliveries_store_each_submission_once(self):
+        # One sender: the live server shares a single in-memory SQLite
+        # connection between its request threads
+        report = run_load_test(
+            self.url,
+            FakeTypeform(seed=3),
+            submissions=10,
+            concurrency=1,
+            scenario=DUPLICATES,
+            copies=3,
+        )
+        self.assertEqual((report.submissions, report.requests), (10, 30))
+        self.assertEqual(report.errors, 0)
+        self.assertEqual(report.statuses, {200: 30})
+        self.assertLessEqual(report.p50, report.p99)
+        self.assertEqual(NPSSurveyPrimaryResponse.objects.count(), 10)
+        ages = set(
+            NPSSurveyPrimaryResponse.objects.values_list("age", flat=True).distinct()
+        )
+        # V1 submissions carry an age, V2 ones do not
+        self.assertGreater(len(ages), 1)
+
+    def test_retry_storm_resends_lock_timeouts(self):
+        locked = OperationalError("database is locked")
+        with patch(
+            "survey.webhook_views.record_survey_responses",
+            side_effect=[locked, locked, []],
+        ):
+            report = run_load_test(
+                self.url,
+                FakeTypeform(seed=4),
+                submissions=1,
+                concurrency=1,
+                scenario=RETRY_STORM,
+            )
+        self.assertEqual(report.requests, 3)
+        self.assertEqual(report.retries, 2)
+        self.assertEqual(report.lock_timeouts, 2)
+        self.assertEqual(report.statuses, {503: 2, 200: 1})
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
+class RequestMetricsTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        delivered = timezone.now() - timedelta(days=30)
+        # Order 2 is a repeat of order 1, 3 has an excluded category and
+        # customer 703 ignored their last surveys
+        for order_id, customer_id, category in [
+            (1, 701, "lepa"),
+            (2, 701, "Kesh"),
+            (3, 702, "Netraa"),
+            (4, 703, "lepa"),
+            (5, 704, "Tikta"),
+        ]:
+            order = Order.objects.create(
+                order_id=order_id,
+                customer_id=customer_id,
+                customer_mobile="9876543210",
+                delivery_time=delivered,
+            )
+            OrderItem.objects.create(order_id=order, product_category=category)
+        NPSSurveyCustomerState.objects.create(customer_id=703, unfilled_count=3)
+
+    def counters(self):
+        return {
+            "scanned": metrics.get("survey_orders_scanned_total"),
+            "category": metrics.get("survey_orders_excluded_total", reason="category"),
+            "cooldown": metrics.get("survey_orders_excluded_total", reason="cooldown"),
+            "unfilled": metrics.get("survey_orders_excluded_total", reason="unfilled"),
+            "issued": metrics.get("survey_surveys_issued_total"),
+        }
+
+    def test_send_surveys_pipeline_counters(self):
+        before = self.counters()
+        response = self.client.get(reverse("send_surveys"), {"stream": 1})
+        b"".join(response.streaming_content)
+        after = self.counters()
+        self.assertEqual(
+            {name: after[name] - before[name] for name in after},
+            {"scanned": 5, "category": 1, "cooldown": 1, "unfilled": 1, "issued": 2},
+        )
+
+        # The streamed response is measured once its last chunk was sent
+        _, count = metrics.get_histogram(
+            "survey_http_request_duration_seconds", view="send_surveys"
+        )
+        self.assertGreaterEqual(count, 1)
+        self.assertGreaterEqual(
+            metrics.get("survey_db_rows_written_total", view="send_surveys"), 2
+        )
+
+    def test_webhook_queries_and_rows_written(self):
+        NPSSurveyCustomer.objects.create(
+            nps_survey_id=1,
+            customer_id=701,
+            customer_mobile="9876543210",
+            sent_date=timezone.now(),
+            product_category="lepa",
+            survey_id=2,
+            order_id=1,
+            utm_parameter="utm=701",
+        )
+        view = "receive_survey_response"
+        queries = metrics.get("survey_db_queries_total", view=view)
+        rows = metrics.get("survey_db_rows_written_total", view=view)
+        _, requests = metrics.get_histogram("survey_db_queries_per_request", view=view)
+
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post(
+                reverse(view),
+                data=json.dumps(typeform_payload(1)),
+                content_type="application/json",
+            )
+        self.assertEqual(
+            metrics.get("survey_db_queries_total", view=view) - queries,
+            len(captured),
+        )
+        # The primary response, two answers and the filled survey at least
+        self.assertGreaterEqual(
+            metrics.get("survey_db_rows_written_total", view=view) - rows, 4
+        )
+        self.assertGreater(metrics.get("survey_db_query_seconds_total", view=view), 0)
+        self.assertEqual(
+            metrics.get_histogram("survey_db_queries_per_request", view=view)[1],
+            requests + 1,
+        )
+
+    def test_histograms_are_rendered(self):
+        self.client.get(reverse("nps_scores"))
+        content = self.client.get(reverse("metrics")).content.decode("utf-8")
+        self.assertIn("# TYPE survey_http_request_duration_seconds histogram", content)
+        self.assertIn(
+            'survey_http_request_duration_seconds_bucket{view="nps_scores",le="+Inf"}',
+            content,
+        )
+        self.assertIn(
+            'survey_http_request_duration_seconds_count{view="nps_scores"}', content
+        )
+
+
+def slow_render():
+    time.sleep(0.1)
+    return ""
+
+
+class ProfilingTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(
+            SURVEY_PROFILE_DIR=self.directory, SURVEY_PROFILE_INTERVAL=0.001
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    @patch("survey.metrics.render", slow_render)
+    @override_settings(
+        SURVEY_PROFILE_HEADER="X-Survey-Profile", INTERNAL_IPS=["127.0.0.1"]
+    )
+    def test_header_profiles_the_request(self):
+        self.client.get(reverse("metrics"), headers={"X-Survey-Profile": "1"})
+        [name] = self.profiles()
+        self.assertIn("-metrics-", name)
+        self.assertTrue(name.endswith(".folded"))
+
+        with open(os.path.join(self.directory, name)) as f:
+            lines = f.read().splitlines()
+        stack, samples = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(samples), 0)
+        self.assertIn("slow_render", stack)
+        self.assertIn(";", stack)
+
+    def test_requests_are_not_profiled_by_default(self):
+        self.client.get(reverse("metrics"))
+        self.client.get(reverse("metrics"), headers={"X-Survey-Profile": "1"})
+        self.assertEqual(self.profiles(), [])
+
+    @override_settings(SURVEY_PROFILE_HEADER="X-Survey-Profile", INTERNAL_IPS=[])
+    def test_header_is_ignored_from_outside(self):
+        self.client.get(reverse("metrics"), headers={"X-Survey-Profile": "1"})
+        self.assertEqual(self.profiles(), [])
+
+    @patch("survey.metrics.render", slow_render)
+    def test_threshold_keeps_slow_requests(self):
+        with override_settings(SURVEY_PROFILE_THRESHOLD=60):
+            self.client.get(reverse("metrics"))
+        self.assertEqual(self.profiles(), [])
+        with override_settings(SURVEY_PROFILE_THRESHOLD=0.05):
+            self.client.get(reverse("metrics"))
+        self.assertEqual(len(self.profiles()), 1)
+
+    def test_only_the_slowest_are_kept(self):
+        stacks = Counter({"main;work": 3})
+        for seconds in [0.5, 2.0, 0.1, 1.0]:
+            save_profile(stacks, seconds, "send_surveys", self.directory, keep=2)
+        self.assertIsNone(
+            save_profile(stacks, 0.2, "send_surveys", self.directory, keep=2)
+        )
+        self.assertEqual(
+            [name.split("-")[0] for name in self.profiles()],
+            ["000001000000", "000002000000"],
+        )
+
+
+class ReadReplicaRouterTestCase(TestCase):
+
+    @override_settings(SURVEY_READ_REPLICA=True)
+    def test_only_marked_reads_use_the_replica(self):
+        self.assertEqual(router.db_for_read(Order), "default")
+        with read_replica():
+            self.assertEqual(router.db_for_read(Order), "replica")
+            self.assertEqual(router.db_for_write(Order), "default")
+        self.assertEqual(router.db_for_read(Order), "default")
+
+    def test_replica_is_off_by_default(self):
+        with read_replica():
+            self.assertEqual(router.db_for_read(Order), "default")
+
+    def test_writes_of_replica_objects_go_to_the_primary(self):
+        order = Order(order_id=1, customer_id=1, customer_mobile="1")
+        order._state.db = "replica"
+        self.assertEqual(router.db_for_write(Order, instance=order), "default")
+        self.assertFalse(router.allow_migrate("replica", "survey"))
+        self.assertTrue(router.allow_migrate("default", "survey"))
+
+    def test_database_settings(self):
+        replica = sqlite_database("replica.sqlite3", replica=True)
+        self.assertIn("PRAGMA journal_mode = WAL", replica["OPTIONS"]["init_command"])
+        self.assertIn("PRAGMA query_only = ON", replica["OPTIONS"]["init_command"])
+        self.assertEqual(replica["TEST"], {"MIRROR": "default"})
+
+        persistent = postgres_database("nps", "db", "nps")
+        self.assertGreater(persistent["CONN_MAX_AGE"], 0)
+        self.assertTrue(persistent["CONN_HEALTH_CHECKS"])
+        pooled = postgres_database("nps", "db", "nps", pool={"max_size": 10})
+        self.assertEqual(pooled["CONN_MAX_AGE"], 0)
+        self.assertEqual(pooled["OPTIONS"]["pool"], {"max_size": 10})
+
+
+@override_settings(SURVEY_READ_REPLICA=True, SURVEY_BATCH_DIR=BATCH_DIR)
+class ReadReplicaTestCase(TransactionTestCase):
+    # The replica mirrors the test database, which only shows it committed
+    # rows, hence TransactionTestCase
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        recent_deliveries.clear()
+        for order_id, customer_id in [(1, 801), (2, 802)]:
+            order = Order.objects.create(
+                order_id=order_id,
+                customer_id=customer_id,
+                customer_mobile="9876543210",
+                delivery_time=timezone.now() - timedelta(days=30),
+            )
+            OrderItem.objects.create(order_id=order, product_category="lepa")
+        NPSSurveyCustomerState.objects.create(customer_id=802, unfilled_count=3)
+
+    def test_eligibility_reads_orders_from_the_replica(self):
+        with CaptureQueriesContext(connections["replica"]) as replica_queries:
+            with CaptureQueriesContext(connection) as primary_queries:
+                decisions = list(
+                    evaluate_orders(Order.objects.all(), timezone.now().date())
+                )
+        self.assertEqual([d.outcome for d in decisions], [ELIGIBLE, EXCLUDED_UNFILLED])
+        replica_sql = " ".join(query["sql"] for query in replica_queries)
+        primary_sql = " ".join(query["sql"] for query in primary_queries)
+        self.assertIn("survey_orderitem", replica_sql)
+        self.assertNotIn("survey_npssurveycustomerstate", replica_sql)
+        self.assertIn("survey_npssurveycustomerstate", primary_sql)
+
+    def test_export_reads_from_the_replica(self):
+        survey = NPSSurveyCustomer.objects.create(
+            customer_id=801,
+            customer_mobile="9876543210",
+            sent_date=timezone.now(),
+            product_category="lepa",
+            survey_id=2,
+            order_id=1,
+            utm_parameter="utm=801",
+        )
+        self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(typeform_payload(survey.nps_survey_id)),
+            content_type="application/json",
+        )
+        with CaptureQueriesContext(connection) as primary_queries:
+            with CaptureQueriesContext(connections["replica"]) as replica_queries:
+                response = self.client.get(
+                    reverse("export_responses"), {"format": "jsonl"}
+                )
+                [line] = b"".join(response.streaming_content).splitlines()
+        self.assertEqual(json.loads(line)["nps_survey_id"], survey.nps_survey_id)
+        self.assertGreaterEqual(len(replica_queries), 3)
+        self.assertEqual(len(primary_queries), 0)
+
+
+@override_settings(
+    ROOT_URLCONF="product_survey.webhook_urls",
+    MIDDLEWARE=["survey.middleware.RequestMetricsMiddleware"],
+)
+class WebhookEntryPointTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+
+    def test_serves_only_the_webhook_routes(self):
+        response = self.client.post(
+            reverse("receive_survey_response"),
+            data=json.dumps(typeform_payload(1)),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"status": "success"})
+        self.assertEqual(NPSSurveyPrimaryResponse.objects.count(), 1)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+        with self.assertRaises(NoReverseMatch):
+            reverse("send_surveys")
+
+    def test_webhook_workers_load_less(self):
+        full = measure_startup(FULL_ENTRY, runs=1)
+        webhook = measure_startup(WEBHOOK_ENTRY, runs=1)
+        self.assertLess(webhook.modules, full.modules)
+
+
+@override_settings(SURVEY_BATCH_DIR=BATCH_DIR)
+class CustomerEligibilityTestCase(TestCase):
+
+    def setUp(self):
+        recent_deliveries.clear()
+        caches["eligibility"].clear()
+
+    def lookup(self, customer_id):
+        response = self.client.get(reverse("customer_eligibility", args=[customer_id]))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_hot_customers_are_answered_from_the_cache(self):
+        self.assertEqual(
+            self.lookup(901),
+            {
+                "customer_id": 901,
+                "eligible": True,
+                "outcome": ELIGIBLE,
+                "survey_id": 1,
+                "survey_version": "V1",
+            },
+        )
+        with self.assertNumQueries(0):
+            self.assertTrue(self.lookup(901)["eligible"])
+
+    def test_issued_survey_invalidates(self):
+        order = Order.objects.create(
+            order_id=1,
+            customer_id=902,
+            customer_mobile="9876543210",
+            delivery_time=timezone.now() - timedelta(days=30),
+        )
+        OrderItem.objects.create(order_id=order, product_category="lepa")
+        self.assertTrue(self.lookup(902)["eligible"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse("send_surveys"), {"stream": 1})
+            b"".join(response.streaming_content)
+        answer = self.lookup(902)
+        self.assertFalse(answer["eligible"])
+        self.assertEqual(answer["outcome"], EXCLUDED_COOLDOWN)
+
+    def test_filled_survey_invalidates(self):
+        sent_date = timezone.now() - timedelta(days=120)
+        survey = NPSSurveyCustomer.objects.create(
+            customer_id=903,
+            customer_mobile="9876543210",
+            sent_date=sent_date,
+            product_category="lepa",
+            survey_id=1,
+            order_id=1,
+            utm_parameter="utm=903",
+        )
+        NPSSurveyCustomerState.objects.filter(customer_id=903).update(unfilled_count=3)
+        caches["eligibility"].clear()
+        self.assertEqual(self.lookup(903)["outcome"], EXCLUDED_UNFILLED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("receive_survey_response"),
+                data=json.dumps(
+                    typeform_payload(
+                        survey.nps_survey_id, form_id="RVcdBbTG", customer_id="903"
+                    )
+                ),
+                content_type="application/json",
+            )
+        answer = self.lookup(903)
+        self.assertTrue(answer["eligible"])
+        self.assertEqual(answer["survey_version"], "V2")
+
+
+@override_settings(SURVEY_DISPATCH_ENABLED=True)
+class DispatchTestCase(TestCase):
+
+    def setUp(self):
+        NPSSurveyCustomer.objects.bulk_create(
+            NPSSurveyCustomer(
+                customer_id=1000 + n,
+                customer_mobile="" if n == 0 else f"98765{n:05d}",
+                sent_date=timezone.now(),
+                product_category="lepa",
+                survey_id=1,
+                order_id=n,
+                utm_parameter=f"utm={n}",
+                dispatch_status="manual" if n == 1 else "pending",
+            )
+            for n in range(40)
+        )
+
+    def test_sends_pending_surveys(self):
+        provider = FakeProvider(batch_size=7)
+        stats = dispatch_surveys(provider, concurrency=3, chunk_size=15, backoff=0)
+
+        self.assertEqual((stats.sent, stats.failed, stats.retried), (38, 1, 0))
+        self.assertEqual(len(provider.delivered), 38)
+        self.assertLessEqual(provider.max_in_flight, 3)
+        sent = NPSSurveyCustomer.objects.filter(dispatch_status="sent")
+        self.assertEqual(sent.count(), 38)
+        survey = sent.first()
+        self.assertEqual(survey.dispatch_attempts, 1)
+        self.assertIsNotNone(survey.dispatched_at)
+        self.assertEqual(survey.provider_message_id, f"fake-{survey.nps_survey_id}-1")
+        self.assertIn(
+            f"nps_survey_id={survey.nps_survey_id}",
+            provider.delivered[survey.nps_survey_id].survey_link,
+        )
+        # Surveys handed over before dispatch existed are left alone
+        manual = NPSSurveyCustomer.objects.get(customer_id=1001)
+        self.assertEqual(manual.dispatch_status, "manual")
+        self.assertNotIn(manual.nps_survey_id, provider.attempts)
+
+    def test_rejected_messages_fail_without_retry(self):
+        provider = FakeProvider(batch_size=10)
+        dispatch_surveys(provider, backoff=0)
+        failed = NPSSurveyCustomer.objects.get(dispatch_status="failed")
+        self.assertEqual(failed.customer_id, 1000)
+        self.assertEqual(failed.dispatch_error, "No phone")
+        self.assertEqual(failed.dispatch_attempts, 1)
+
+        # Failed surveys are only sent again when asked for
+        self.assertEqual(dispatch_surveys(provider, backoff=0).sent, 0)
+        stats = dispatch_surveys(provider, statuses=["failed"], backoff=0)
+        self.assertEqual(stats.failed, 1)
+        failed.refresh_from_db()
+        self.assertEqual(failed.dispatch_attempts, 2)
+
+    def test_transient_failures_are_retried(self):
+        provider = FakeProvider(batch_size=10, transient_failures=2)
+        stats = dispatch_surveys(provider, retries=2, backoff=0)
+        self.assertEqual((stats.sent, stats.failed, stats.retried), (38, 1, 38))
+        survey = NPSSurveyCustomer.objects.filter(dispatch_status="sent").first()
+        self.assertEqual(survey.dispatch_attempts, 3)
+
+        NPSSurveyCustomer.objects.exclude(dispatch_status="manual").update(
+            dispatch_status="pending"
+        )
+        provider = FakeProvider(batch_size=10, transient_failures=2)
+        stats = dispatch_surveys(provider, retries=1, backoff=0)
+        self.assertEqual(stats.failed, 39)
+        self.assertEqual(
+            NPSSurveyCustomer.objects.filter(dispatch_error="Try again").count(), 38
+        )
+
+    def test_rate_limit(self):
+        # The provider accepts 400 messages a second and bursts of 20, headroom
+        # for concurrent batches that leave the client's bucket close together
+        provider = FakeProvider(batch_size=5, rate_limit=400, burst=20)
+        stats = dispatch_surveys(provider, rate=400, burst=10, concurrency=4)
+        self.assertEqual(provider.rate_limited, 0)
+        self.assertEqual(stats.sent, 38)
+        # Everything past the burst waits for its tokens
+        self.assertGreaterEqual(stats.seconds, (39 - 10) / 400)
+
+        # Without the limit the provider turns batches away until retried
+        NPSSurveyCustomer.objects.exclude(dispatch_status="manual").update(
+            dispatch_status="pending"
+        )
+        provider = FakeProvider(batch_size=5, rate_limit=400, burst=10)
+        stats = dispatch_surveys(provider, concurrency=4, retries=20, backoff=0.01)
+        self.assertGreater(provider.rate_limited, 0)
+        self.assertEqual(stats.sent, 38)
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(10, 5, clock=lambda: now[0])
+        self.assertEqual(bucket.reserve(5), 0)
+        self.assertAlmostEqual(bucket.reserve(5), 0.5)
+        self.assertFalse(bucket.try_take(1))
+        now[0] = 1.0
+        self.assertTrue(bucket.try_take(5))
+        now[0] = 10.0
+        # Idle time only refills up to the burst
+        self.assertFalse(bucket.try_take(6))
+
+    def test_http_provider(self):
+        provider = HTTPProvider("https://sms.example.com/send", token="secret")
+        messages = [
+            Message(1, "9876543210", "V1", "https://example.com/1"),
+            Message(2, "9876543211", "V1", "https://example.com/2"),
+            Message(3, "9876543212", "V2", "https://example.com/3"),
+        ]
+        answer = {
+            "results": [
+                {"id": "1", "status": "accepted", "message_id": "m1"},
+                {"id": "2", "status": "rejected", "error": "Invalid number"},
+            ]
+        }
+        with patch.object(provider.session, "post") as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = answer
+            results = provider.send_batch(messages)
+        self.assertEqual(
+            post.call_args.kwargs["json"]["messages"][2]["to"], "9876543212"
+        )
+        self.assertEqual(provider.session.headers["Authorization"], "Bearer secret")
+        self.assertEqual([r.ok for r in results], [True, False, False])
+        self.assertEqual(results[0].provider_message_id, "m1")
+        self.assertFalse(results[1].retryable)
+        self.assertTrue(results[2].retryable)
+
+        with patch.object(provider.session, "post") as post:
+            post.return_value.status_code = 429
+            post.return_value.headers = {"Retry-After": "2"}
+            with self.assertRaises(ProviderError) as raised:
+                provider.send_batch(messages)
+        self.assertTrue(raised.exception.retryable)
+        self.assertEqual(raised.exception.retry_after, 2)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("dispatch_surveys", "--fake", "--rate", "0", stdout=out)
+        self.assertIn("38 sent, 1 failed", out.getvalue())
+        # A fake run leaves the real surveys pending
+        self.assertEqual(
+            NPSSurveyCustomer.objects.filter(dispatch_status="pending").count(), 39
+        )
+        with self.assertRaises(CommandError):
+            call_command("dispatch_surveys")
+
+    def test_cut_over_from_the_csv(self):
+        def issue(customer_id):
+            decision = SurveyDecision(
+                order_id=customer_id,
+                customer_id=customer_id,
+                customer_mobile="1234567890",
+                product_categories=["lepa"],
+                outcome=ELIGIBLE,
+                survey_id=1,
+            )
+            issue_surveys([decision])
+            return NPSSurveyCustomer.objects.get(customer_id=customer_id)
+
+        with override_settings(SURVEY_DISPATCH_ENABLED=False):
+            # Surveys uploaded from the CSV by hand are never dispatched
+            self.assertEqual(issue(2000).dispatch_status, "manual")
+            with self.assertRaisesMessage(CommandError, "dispatch is off"):
+                call_command("dispatch_surveys")
+        self.assertEqual(issue(2001).dispatch_status, "pending")
+
+
+class ReconcileSurveyFilledTestCase(TestCase):
+
+    def setUp(self):
+        surveys = NPSSurveyCustomer.objects.bulk_create(
+            NPSSurveyCustomer(
+                customer_id=customer_id,
+                customer_mobile="9876543210",
+                sent_date=timezone.now() - timedelta(days=100),
+                product_category="lepa",
+                survey_id=1,
+                order_id=customer_id,
+                utm_parameter=f"utm={customer_id}",
+                survey_filled=survey_filled,
+            )
+            for customer_id, survey_filled in [
+                (2001, False),
+                (2002, True),
+                (2003, True),
+                (2004, False),
+                (2004, False),
+            ]
+        )
+        self.surveys = {survey.customer_id: survey for survey in surveys}
+        # Stored responses of 2001, never flagged, and 2003
+        for customer_id in (2001, 2003):
+            NPSSurveyPrimaryResponse.objects.create(
+                nps_survey_id=str(self.surveys[customer_id].nps_survey_id),
+                customer_id=customer_id,
+                survey_filled_date=timezone.now(),
+            )
+        call_command("rebuild_survey_state", stdout=StringIO())
+
+    def filled(self):
+        return dict(
+            NPSSurveyCustomer.objects.filter(customer_id__lt=2004).values_list(
+                "customer_id", "survey_filled"
+            )
+        )
+
+    def test_reconcile(self):
+        self.assertEqual(
+            NPSSurveyCustomerState.objects.get(customer_id=2001).unfilled_count, 1
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = reconcile_survey_filled(chunk_size=2)
+        self.assertEqual(tuple(stats), (1, 1, 2))
+        self.assertEqual(self.filled(), {2001: True, 2002: False, 2003: True})
+        states = {
+            state.customer_id: state.unfilled_count
+            for state in NPSSurveyCustomerState.objects.all()
+        }
+        self.assertEqual(states, {2001: 0, 2002: 1, 2003: 0, 2004: 2})
+        self.assertEqual(tuple(reconcile_survey_filled()), (0, 0, 0))
+
+    def test_update_is_set_based(self):
+        with CaptureQueriesContext(connection) as queries:
+            reconcile_survey_filled(chunk_size=2)
+        updates = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('UPDATE "survey_npssurveycustomer"')
+        ]
+        # Two statements per chunk of 2 surveys, whatever the rows changed
+        self.assertEqual(len(updates), 6)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("reconcile_survey_filled", "--dry-run", stdout=out)
+        self.assertIn("2 surveys would be changed: 1 marked filled", out.getvalue())
+        self.assertEqual(self.filled(), {2001: False, 2002: True, 2003: True})
+
+        call_command("reconcile_survey_filled", stdout=out)
+        self.assertIn("2 surveys were changed", out.getvalue())
+        self.assertEqual(self.filled(), {2001: True, 2002: False, 2003: True})
+
+
+class BackfillCustomerStateTestCase(TransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([("survey", target)])
+        return executor.loader.project_state(("survey", target)).apps
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def tearDown(self):
+        self.migrate_to_latest()
+
+    def test_history_is_backfilled(self):
+        apps = self.migrate("0003_primary_response_token")
+        # Rows written without signals, as before the state table existed
+        apps.get_model("survey", "NPSSurveyCustomer").objects.bulk_create(
+            apps.get_model("survey", "NPSSurveyCustomer")(
+                customer_id=701,
+                customer_mobile="9876543210",
+                sent_date=timezone.now() - timedelta(days=days),
+                product_category="lepa",
+                survey_id=survey_id,
+                order_id=days,
+                utm_parameter="utm=701",
+            )
+            for days, survey_id in [(10, 2), (200, 1)]
+        )
+        apps = self.migrate("0004_customer_survey_state")
+        state = apps.get_model("survey", "NPSSurveyCustomerState").objects.get(
+            customer_id=701
+        )
+        self.assertEqual((state.unfilled_count, state.survey_versions), (2, 3))
+
+        self.migrate_to_latest()
+        order = Order.objects.create(
+            order_id=7010,
+            customer_id=701,
+            customer_mobile="9876543210",
+            delivery_time=timezone.now() - timedelta(days=30),
+        )
+        OrderItem.objects.create(order_id=order, product_category="lepa")
+        (decision,) = evaluate_orders(
+            Order.objects.filter(order_id=7010),
+            timezone.now() - timedelta(days=90),
+        )
+        self.assertEqual(decision.outcome, EXCLUDED_COOLDOWN)
+        self.assertEqual(decision.survey_id, 2)
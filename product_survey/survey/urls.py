@@ -1,5 +1,10 @@
 from django.urls import path
-from .views import send_surveys, receive_survey_response
+from .views import send_surveys, nps_scores, eligibility, export_responses
+from .webhook_views import (
+    receive_survey_response,
+    queue_survey_response,
+    metrics_view,
+)
 
 urlpatterns = [
     path("send_surveys/", send_surveys, name="send_surveys"),
@@ -8,4 +13,13 @@ urlpatterns = [
         receive_survey_response,
         name="receive_survey_response",
     ),
+    path(
+        "queue_survey_response/",
+        queue_survey_response,
+        name="queue_survey_response",
+    ),
+    path("nps/", nps_scores, name="nps_scores"),
+    path("export/", export_responses, name="export_responses"),
+    path("eligibility/<int:customer_id>/", eligibility, name="customer_eligibility"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
@@ -1,179 +1,187 @@
-import csv
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
-from .models import (
-    Order,
-    OrderItem,
-    NPSSurveyCustomer,
-    NPSSurveyPrimaryResponse,
-    NPSSurveyQuestionResponse,
-)
-from datetime import timedelta
-from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import http_date, quote_etag
+from .batches import check_batch, generate_batch
+from .eligibility import customer_eligibility
+from .exports import EXPORT_FORMATS, ExportFilters, export_chunks
+from .generation import GenerationConflict
+from .jobs import GENERATION_LOCK, JobLock, JobLocked
+from .models import SurveyBatch
+from .rollup import GROUPINGS, nps_summary
+from .routers import read_replica
+from datetime import date, timedelta
+from django.views.decorators.http import condition
 from django.http import JsonResponse
-import json
 
 
-def send_surveys(request):
-    current_date = timezone.now().date()
-    # Get the current date and calculate the target date (30 days before)
-    DAY_BEFORE_30 = current_date - timedelta(days=30)
-    # Get the current date and calculate the target date (90 days before)
-    DAY_BEFORE_90 = current_date - timedelta(days=90)
-
-    survey_id = 1
-    form_id = "RVcdBbTG"
-    survey_type = "V1"
-
-    # Filter eligible customers
-    eligible_orders = Order.objects.filter(delivery_time__date=DAY_BEFORE_30)
-    customers = []
-
-    for order in eligible_orders:
-        customer_id = order.customer_id
-        order_items = OrderItem.objects.filter(order_id=order.order_id)
-
-        # Segmentation logic
-        product_categories = [item.product_category for item in order_items]
-        if any(pc in ["Netraa", "Conditioner"] for pc in product_categories):
-            continue
-
-        # Customers should not receive two surveys back to back in a span of 90 days
-        if NPSSurveyCustomer.objects.filter(
-            customer_id=customer_id, sent_date__gte=DAY_BEFORE_90
-        ):
-            continue
-
-        # Customer has not filled 3 consecutive surveys in a row customer is to be omitted
-        if (
-            NPSSurveyCustomer.objects.filter(
-                customer_id=customer_id, survey_filled=False
-            )
-            .order_by("sent_date")
-            .count()
-            >= 3
-        ):
-            continue
-
-        # Add logic to determine survey version (V1 or V2)
-        if NPSSurveyCustomer.objects.filter(
-            customer_id=customer_id, survey_id=survey_id
-        ):
-            survey_id = 2
-            form_id = "bXFb9h7f"
-            survey_type = "V2"
-
-        # Select a product category to send the survey
-        for selected_product_category in product_categories:
-            # Record the customer in the NPSSurveyCustomer table
-            nps_survey_customer = NPSSurveyCustomer.objects.create(
-                customer_id=customer_id,
-                customer_mobile=order.customer_mobile,
-                sent_date=timezone.now(),
-                product_category=selected_product_category,
-                survey_id=survey_id,  # survey_id=1 Means V1 and survey_id=1 Means V2
-                order_id=order.order_id,
-                utm_parameter=f"utm={customer_id}",
-            )
-            nps_survey_id = nps_survey_customer.nps_survey_id
-
-            survey_link = f"https://nathabit.typeform.com/to/{form_id}#customer_id={customer_id}&product_category={selected_product_category}&nps_survey_id={nps_survey_id}"
-            # https://nathabit.typeform.com/to/RVcdBbTG#customer_id=xxxxx&product_category=xxxxx&nps_survey_id=xxxxx
-
-            # Collect data for the CSV
-            customers.append(
-                {
-                    "order_id": order.order_id,
-                    "customer_id": customer_id,
-                    "customer_phone": order.customer_mobile,
-                    "product_category": selected_product_category,
-                    "survey_type": survey_type,
-                    "survey_link": survey_link,
-                }
-            )
-
-    # Create CSV
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = 'attachment; filename="survey_customers.csv"'
-
-    writer = csv.DictWriter(
-        response,
-        fieldnames=[
-            "order_id",
-            "customer_id",
-            "customer_phone",
-            "product_category",
-            "survey_type",
-            "survey_link",
-        ],
-    )
-    writer.writeheader()
-    for customer in customers:
-        writer.writerow(customer)
+class Locked:
+    """
+    Streamed rows that hold ``lock`` until the response is closed. Django
+    closes the response even when the client left before the first chunk
+    was read, when a generator's ``finally`` would never run.
+    """
+
+    def __init__(self, lock, rows):
+        self.lock = lock
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        try:
+            self.rows.close()
+        finally:
+            self.lock.release()
+
+
+def batch_for(run_date):
+    # Get the target date (30 days before the run date)
+    DAY_BEFORE_30 = run_date - timedelta(days=30)
+    return SurveyBatch.objects.filter(delivery_date=DAY_BEFORE_30).first()
+
 
+def survey_batch(request):
+    # Looked up once per request, by the conditional GET checks and the view.
+    # The run date is fixed here so a run crossing midnight keeps its day.
+    if not hasattr(request, "survey_batch"):
+        request.survey_run_date = timezone.now().date()
+        request.survey_batch = batch_for(request.survey_run_date)
+    return request.survey_batch
+
+
+def survey_batch_etag(request):
+    batch = survey_batch(request)
+    return batch and batch.etag
+
+
+def survey_batch_last_modified(request):
+    batch = survey_batch(request)
+    return batch and batch.created_at
+
+
+def serve_survey_batch(batch):
+    try:
+        f = open(batch.path, "rb")
+    except FileNotFoundError:
+        raise Http404("Survey batch file is missing")
+    response = FileResponse(
+        f, as_attachment=True, filename="survey_customers.csv", content_type="text/csv"
+    )
+    response["ETag"] = quote_etag(batch.etag)
+    response["Last-Modified"] = http_date(batch.created_at.timestamp())
     return response
 
 
-@csrf_exempt
-def receive_survey_response(request):
-    if request.method == "POST":
-        data = json.loads(request.body)
-        response_data = {}
-        age = None
-        gender = None
-        # nps_survey_id = data.get('event_id')
-        form_responses = data.get("form_response")
-        form_id = form_responses.get("form_id")
-        customer_id = form_responses.get("hidden").get("customer_id")
-        product_category = form_responses.get("hidden").get("product_category")
-        nps_survey_id = form_responses.get("hidden").get("nps_survey_id")
-
-        for response in form_responses.get("answers"):
-            response_data[response.get("field").get("id")] = response.get(
-                response.get("type")
-            )
-
-        responses = form_responses.get("answers", [])
-        if form_id == "RVcdBbTG":
-            age = response_data.get("r7TMRukeAETP").get("label")
-            gender = response_data.get("AYd3C9b0fXiJ").get("label")
-            survey_id = 1
-        else:
-            survey_id = 2
-
-        # Save primary response
-        NPSSurveyPrimaryResponse.objects.create(
-            nps_survey_id=nps_survey_id,
-            customer_id=customer_id,
-            age=age,
-            gender=gender,
-            survey_filled_date=timezone.now(),
+@condition(etag_func=survey_batch_etag, last_modified_func=survey_batch_last_modified)
+def send_surveys(request):
+    # A day's surveys are issued once, later requests download the stored CSV
+    batch = survey_batch(request)
+    if batch is not None:
+        return serve_survey_batch(batch)
+
+    # Only one run may issue surveys at a time
+    lock = JobLock(GENERATION_LOCK)
+    if not lock.acquire():
+        return JsonResponse(
+            {"error": "Survey generation already in progress"}, status=409
+        )
+
+    current_date = request.survey_run_date
+    try:
+        check_batch(current_date)
+    except GenerationConflict as e:
+        lock.release()
+        return JsonResponse({"error": str(e)}, status=409)
+
+    if request.GET.get("stream"):
+        # Send rows as each chunk of orders is committed
+        response = StreamingHttpResponse(
+            Locked(lock, generate_batch(current_date, lock)), content_type="text/csv"
+        )
+        response["Content-Disposition"] = 'attachment; filename="survey_customers.csv"'
+        return response
+
+    try:
+        for _ in generate_batch(current_date, lock):
+            pass
+    except JobLocked:
+        return JsonResponse(
+            {"error": "Survey generation was taken over by another run"}, status=409
+        )
+    finally:
+        lock.release()
+
+    return serve_survey_batch(batch_for(current_date))
+
+
+def nps_scores(request):
+    # Answered from the daily rollup, never from the raw responses
+    try:
+        start = date.fromisoformat(request.GET["start"])
+        end = date.fromisoformat(request.GET.get("end", request.GET["start"]))
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {"error": "start and end must be dates as YYYY-MM-DD"}, status=400
+        )
+
+    group_by = [key for key in request.GET.get("group_by", "").split(",") if key]
+    if any(key not in GROUPINGS for key in group_by):
+        return JsonResponse(
+            {"error": f"group_by takes {', '.join(GROUPINGS)}"}, status=400
+        )
+
+    filters = {}
+    if request.GET.get("product_category"):
+        filters["product_category"] = request.GET["product_category"]
+    if request.GET.get("survey_id", "").isdigit():
+        filters["survey_id"] = int(request.GET["survey_id"])
+
+    with read_replica():
+        totals, groups = nps_summary(start, end, group_by, **filters)
+    return JsonResponse({"start": start, "end": end, "total": totals, "groups": groups})
+
+
+def eligibility(request, customer_id):
+    # Cached per customer, see eligibility.customer_eligibility
+    return JsonResponse(customer_eligibility(customer_id))
+
+
+def export_responses(request):
+    # Resume an interrupted export with after=<last nps_survey_id received>
+    file_format = request.GET.get("format", "csv")
+    try:
+        after = int(request.GET.get("after", 0))
+        survey_id = request.GET.get("survey_id")
+        filters = ExportFilters(
+            survey_id=int(survey_id) if survey_id else None,
+            product_category=request.GET.get("product_category") or None,
+            start=(
+                date.fromisoformat(request.GET["start"])
+                if request.GET.get("start")
+                else None
+            ),
+            end=(
+                date.fromisoformat(request.GET["end"])
+                if request.GET.get("end")
+                else None
+            ),
+        )
+    except ValueError:
+        return JsonResponse(
+            {"error": "after and survey_id must be integers, start and end dates"},
+            status=400,
+        )
+    if file_format not in EXPORT_FORMATS:
+        return JsonResponse(
+            {"error": f"format takes {', '.join(EXPORT_FORMATS)}"}, status=400
         )
 
-        # Save question responses
-        for response in responses:
-            type = response.get("type")
-            if type in ["number", "text"]:
-                answer = response.get(type)
-            if type == "choice" and form_id == "RVcdBbTG":
-                answer = response.get(type).get("label")
-
-            question_id = response.get("field").get("id")
-            NPSSurveyQuestionResponse.objects.create(
-                nps_survey_id=nps_survey_id, question_id=question_id, response=answer
-            )
-        # Record if the customer filled the survery form or not.
-        nps_survey_customer = NPSSurveyCustomer.objects.filter(
-            customer_id=customer_id,
-            survey_id=survey_id,
-            product_category=product_category,
-        ).order_by("sent_date")
-
-        if nps_survey_customer:
-            obj = nps_survey_customer.first()
-            obj.survey_filled = True
-            obj.save()
-
-        return JsonResponse({"status": "success"}, status=200)
-
-    return JsonResponse({"error": "Invalid request"}, status=400)
+    response = StreamingHttpResponse(
+        (text for text, _, _ in export_chunks(filters, file_format, after=after)),
+        content_type="text/csv" if file_format == "csv" else "application/x-ndjson",
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="survey_responses.{file_format}"'
+    )
+    return response
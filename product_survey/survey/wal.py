@@ -0,0 +1,215 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+from .responses import parse_survey_response, record_survey_responses
+
+logger = logging.getLogger(__name__)
+
+metrics.describe(
+    "survey_webhook_log_bytes_total", "counter", "Raw webhook bytes appended to the log"
+)
+
+# Responses stored per transaction when replaying
+REPLAY_BATCH_SIZE = 200
+REPLAY_WORKERS = 4
+
+
+class WebhookLog:
+    """
+    Append-only, gzip-compressed log of raw webhook bodies.
+
+    Each process writes its own segment, one JSON line per body holding the
+    receive time and the body text, and flushes the compressor after every
+    append so a crash loses at most a torn last line. A new segment is
+    started once the current one reaches ``segment_bytes`` on disk.
+    """
+
+    def __init__(self, directory, segment_bytes):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+
+    def _open(self):
+        # Names sort in the order segments were started
+        name = f"webhooks-{time.time_ns():020d}-{os.getpid()}.jsonl.gz"
+        self._path = self.directory / name
+        self._file = gzip.open(self._path, "ab")
+
+    def append(self, body):
+        record = {
+            "received_at": time.time(),
+            "body": body.decode("utf-8", "replace"),
+        }
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            if self._file.fileobj.tell() >= self.segment_bytes:
+                self._close()
+        metrics.inc("survey_webhook_log_bytes_total", len(body))
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def segments(self):
+        return sorted(self.directory.glob("webhooks-*.jsonl.gz"))
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def webhook_log():
+    # One open segment per process and log directory
+    directory = str(settings.SURVEY_WEBHOOK_LOG_DIR)
+    with _logs_lock:
+        if directory not in _logs:
+            _logs[directory] = WebhookLog(
+                directory, settings.SURVEY_WEBHOOK_LOG_SEGMENT_BYTES
+            )
+        return _logs[directory]
+
+
+def log_webhook(body):
+    if settings.SURVEY_WEBHOOK_LOG:
+        webhook_log().append(body)
+
+
+def read_log_segment(path):
+    """
+    Yield the webhook payloads of a log segment. A segment cut off by a
+    crash yields every complete line before the cut.
+    """
+    with gzip.open(path, "rb") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(json.loads(line)["body"])
+                except (ValueError, KeyError):
+                    logger.warning("Skipping unreadable line in %s", path)
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            logger.warning("%s ends early, replayed up to the cut", path)
+
+
+def read_typeform_export(path, form_id):
+    """
+    Yield webhook-shaped payloads for the items of a Typeform Responses API
+    export, which carry no form id of their own.
+    """
+    with open(path, "rb") as f:
+        export = json.load(f)
+    for item in export.get("items", []):
+        yield {
+            "event_id": item.get("token") or item.get("response_id"),
+            "event_type": "form_response",
+            "form_response": dict(item, form_id=form_id),
+        }
+
+
+class ReplayStats(NamedTuple):
+    read: int
+    stored: int
+    duplicates: int
+    failed: int
+
+
+def store_batch(payloads):
+    """
+    Store one batch of payloads in a transaction, falling back to one
+    transaction per payload when the batch fails. Returns ``ReplayStats``.
+    """
+    responses = []
+    failed = 0
+    for payload in payloads:
+        try:
+            responses.append(parse_survey_response(payload))
+        except (AttributeError, TypeError, ValueError):
+            logger.exception("Unparseable webhook payload")
+            failed += 1
+
+    try:
+        stored = len(record_survey_responses(responses))
+        duplicates = len(responses) - stored
+    except Exception:
+        stored = duplicates = 0
+        for response in responses:
+            try:
+                stored_one = len(record_survey_responses([response]))
+            except Exception:
+                logger.exception("Could not store response %s", response.token)
+                failed += 1
+                continue
+            stored += stored_one
+            duplicates += 1 - stored_one
+
+    return ReplayStats(
+        read=len(payloads), stored=stored, duplicates=duplicates, failed=failed
+    )
+
+
+def store_batch_in_thread(payloads):
+    try:
+        return store_batch(payloads)
+    finally:
+        # Each replay thread opens its own connection
+        connection.close()
+
+
+def batched(payloads, size):
+    payloads = iter(payloads)
+    while batch := list(islice(payloads, size)):
+        yield batch
+
+
+def replay(payloads, batch_size=REPLAY_BATCH_SIZE, workers=REPLAY_WORKERS):
+    """
+    Re-ingest ``payloads`` through the webhook parsing and storage path in
+    batches of ``batch_size`` spread over ``workers`` threads. Submissions
+    already stored are skipped, so replaying a segment twice is harmless.
+    """
+    totals = [0, 0, 0, 0]
+
+    def add(stats):
+        for index, value in enumerate(stats):
+            totals[index] += value
+
+    batches = batched(payloads, batch_size)
+    if workers <= 1:
+        for batch in batches:
+            add(store_batch(batch))
+        return ReplayStats(*totals)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded number of batches in flight
+        pending = []
+        for batch in batches:
+            pending.append(pool.submit(store_batch_in_thread, batch))
+            if len(pending) >= workers * 2:
+                add(pending.pop(0).result())
+        for future in pending:
+            add(future.result())
+    return ReplayStats(*totals)
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from django.db import IntegrityError, OperationalError
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import metrics
+from .ingest import QueueFull, webhook_queue
+from .models import NPSSurveyPrimaryResponse
+from .responses import parse_survey_response, record_survey_responses
+from .wal import log_webhook
+
+# Everything a webhook worker serves, kept apart from the reporting views so
+# the webhook entry point (product_survey.webhook_asgi) imports only this
+
+
+def store_response(response):
+    try:
+        return record_survey_responses([response])
+    except IntegrityError:
+        pass
+    # A concurrent delivery of the same submission won the insert
+    try:
+        return record_survey_responses([response])
+    except IntegrityError:
+        # A resubmission of an answered survey comes with a new token
+        answered = NPSSurveyPrimaryResponse.objects.filter(
+            nps_survey_id=response.nps_survey_id
+        )
+        if not answered.exists():
+            raise
+    metrics.inc("survey_webhook_duplicates_total", source="survey")
+    return []
+
+
+@csrf_exempt
+def receive_survey_response(request):
+    if request.method == "POST":
+        # Logged first so a payload that fails below can be replayed
+        log_webhook(request.body)
+        data = json.loads(request.body)
+        response = parse_survey_response(data)
+        try:
+            stored = store_response(response)
+        except OperationalError as e:
+            if "database is locked" not in str(e):
+                raise
+            # SQLite gave up waiting for the write lock, Typeform will retry
+            metrics.inc("survey_webhook_lock_timeouts_total")
+            response = JsonResponse({"error": "Database busy"}, status=503)
+            response["Retry-After"] = "1"
+            return response
+
+        if not stored:
+            return JsonResponse({"status": "duplicate"}, status=200)
+        return JsonResponse({"status": "success"}, status=200)
+
+    return JsonResponse({"error": "Invalid request"}, status=400)
+
+
+@csrf_exempt
+async def queue_survey_response(request):
+    # Acknowledge once the raw payload is on disk, the queue writer stores it
+    if request.method == "POST":
+        await asyncio.to_thread(log_webhook, request.body)
+        try:
+            await asyncio.to_thread(webhook_queue().put, request.body)
+        except QueueFull:
+            metrics.inc("survey_queue_rejected_total")
+            response = JsonResponse({"error": "Queue full"}, status=429)
+            response["Retry-After"] = "5"
+            return response
+
+        metrics.inc("survey_queue_enqueued_total")
+        return JsonResponse({"status": "queued"}, status=200)
+
+    return JsonResponse({"error": "Invalid request"}, status=400)
+
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
@@ -0,0 +1,17 @@
+# Entry points for process pools. Spawned workers unpickle these before
+# Django is set up, so nothing here may import models at module level.
+import django
+from django.db import connections
+
+
+def init_worker():
+    django.setup()
+
+
+def generate_shard(*args):
+    from .generation import generate_shard
+
+    try:
+        return generate_shard(*args)
+    finally:
+        connections.close_all()